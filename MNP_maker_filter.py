@@ -1,73 +1,119 @@
 import argparse
-import pandas as pd
+import numpy as np
 from scipy.stats import chi2
-
-# 定义一个函数来计算ll、lm的个数
-def count_genotypes(row, parent_type):
-    if parent_type == 'male':
-        nn_count = row.str.count('nn').sum()
-        np_count = row.str.count('np').sum()
-        return nn_count, np_count
-    elif parent_type == 'female':
-        ll_count = row.str.count('ll').sum()
-        lm_count = row.str.count('lm').sum()
-        return ll_count, lm_count
-    return 0, 0
-
-# 自由度为1的卡方检验函数
+import genotype_store
+import metrics
+
+# 每种亲本类型的两种基因型
+GENOTYPE_CLASSES = {'male': ('nn', 'np'), 'female': ('ll', 'lm')}
+
+# 定义一个函数来计算ll、lm的个数：只统计子代基因型列（第3列起），一次计算整个染色体
+def count_genotypes(genotypes, parent_type):
+    genotypes = np.asarray(genotypes, dtype=object)
+    if parent_type not in GENOTYPE_CLASSES:
+        zeros = np.zeros(genotypes.shape[0])
+        return zeros, zeros
+    class1, class2 = GENOTYPE_CLASSES[parent_type]
+    count1 = (genotypes == class1).sum(axis=1).astype(float)
+    count2 = (genotypes == class2).sum(axis=1).astype(float)
+    return count1, count2
+
+def count_store_genotypes(store, parent_type):
+    """与 count_genotypes 相同，直接比较二进制存储中的 int8 编码"""
+    if parent_type not in GENOTYPE_CLASSES:
+        zeros = np.zeros(store.codes.shape[0])
+        return zeros, zeros
+    class1, class2 = GENOTYPE_CLASSES[parent_type]
+    return store.genotype_mask(class1).sum(axis=1).astype(float), store.genotype_mask(class2).sum(axis=1).astype(float)
+
+# 自由度为1的卡方检验函数，count1、count2 可以是数组
 def chi_square_test_1(count1, count2):
+    count1 = np.asarray(count1, dtype=float)
+    count2 = np.asarray(count2, dtype=float)
     total = count1 + count2
-    if total == 0:
-        return None  # 当总数为0时，没有足够的数据进行测试
     exp1 = 0.5 * total
     exp2 = 0.5 * total
 
-    chi2_statistic = (count1 - exp1)**2 / exp1 + (count2 - exp2)**2 / exp2
-    p_value = 1 - chi2.cdf(chi2_statistic, df=1)
+    # 当总数为0时，没有足够的数据进行测试，p-value 记为 NaN
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2_statistic = (count1 - exp1)**2 / exp1 + (count2 - exp2)**2 / exp2
+    p_value = np.where(total == 0, np.nan, chi2.sf(chi2_statistic, df=1))
 
     return p_value
 
-def process_data(input_file, output_file, parent_type, threshold):
-    # 读取CSV文件，假设第一行是表头，所以不设置header=None
-    df = pd.read_csv(input_file, sep=';')
-
-    # 应用函数并添加新列
-    counts = df.apply(lambda row: count_genotypes(row, parent_type), axis=1)
-    df[['count1', 'count2']] = pd.DataFrame(counts.tolist(), index=df.index)
-    df['dots_count'] = df.apply(lambda row: row.str.count('--').sum(), axis=1)
-
-    # 过滤掉--个数大于等于阈值的行，并创建一个新的DataFrame的拷贝
-    df_filtered = df[df['dots_count'] < threshold].copy()
-
-    # 对剩余的行应用卡方检验，添加p-value列
-    df_filtered['p_value'] = df_filtered.apply(lambda row: chi_square_test_1(row['count1'], row['count2']), axis=1)
+def process_data(input_file, output_file, parent_type, threshold, fmt='csv', min_p_value=0.01, record=None):
+    # 计数：子代基因型矩阵与基因型逐元素比较后按行求和；二进制存储直接比较 int8 编码，不还原为字符串
+    if fmt == 'store':
+        store = genotype_store.read_store(genotype_store.store_path(input_file))
+        genotype_end = store.metadata['n_columns']
+        count1, count2 = count_store_genotypes(store, parent_type)
+        dots_count = store.genotype_mask('--').sum(axis=1).astype(float)
+    else:
+        # 读取CSV文件，假设第一行是表头，所以不设置header=None
+        df = genotype_store.read_frame(input_file, fmt)
+        genotype_end = df.shape[1]
+        genotypes = df.iloc[:, 2:genotype_end].to_numpy(dtype=object)
+        count1, count2 = count_genotypes(genotypes, parent_type)
+        dots_count = (genotypes == '--').sum(axis=1).astype(float)
+
+    # 过滤掉--个数大于等于阈值的行，对剩余的行一次完成卡方检验
+    passed_missing = np.flatnonzero(dots_count < threshold)
+    p_value = chi_square_test_1(count1[passed_missing], count2[passed_missing])
+
+    # 过滤出p-value大于阈值的行
+    passed_chi_square = p_value > min_p_value
+    rows = passed_missing[passed_chi_square]
+    p_value = p_value[passed_chi_square]
+
+    # 输出到文件，保留表头；基因型列之后是新增的计数和p-value列
+    added = {'count1': count1[rows], 'count2': count2[rows], 'dots_count': dots_count[rows], 'p_value': p_value}
+    if fmt == 'store':
+        other_columns = {col: values[rows] for col, values in store.other_columns().items()}
+        for offset, values in enumerate(added.values()):
+            other_columns[genotype_end + offset] = genotype_store.column_strings(values)
+        genotype_store.write_codes(genotype_store.store_path(output_file), store.codes[rows], store.alleles,
+                                   store.positions[rows], 1, (2, genotype_end), genotype_end + len(added),
+                                   store.columns + list(added), other_columns, parent_type=parent_type)
+    else:
+        final_df = df.iloc[rows].assign(**added)
+        genotype_store.write_frame(final_df, output_file, fmt, (2, genotype_end), 1, parent_type=parent_type)
+
+    if record is not None:
+        record.add_rows_in(len(dots_count))
+        record.drop('missing_rate', len(dots_count) - len(passed_missing))
+        record.drop('chi_square', len(passed_missing) - len(rows))
+        record.add_rows_out(len(rows))
 
-    # 过滤出p-value > 0.01的行
-    final_df = df_filtered[df_filtered['p_value'] > 0.01]
+    print(f"染色体 {input_file} 处理完成，结果已保存至: {output_file}")
 
-    # 输出到文件，保留表头
-    final_df.to_csv(output_file, index=False, sep=';')
+def filter_chromosome(chrom_id, parent_type, threshold, fmt='csv', min_p_value=0.01):
+    input_file = f"{chrom_id}.MNP.genotype.{parent_type}.csv"
+    output_file = f"{chrom_id}.MNP.genotype.filted.{parent_type}.csv"
 
-    print(f"染色体 {input_file} 处理完成，结果已保存至: {output_file}")
+    with metrics.stage('MNP_maker_filter', chrom_id, parent_type) as record:
+        process_data(input_file, output_file, parent_type, threshold, fmt, min_p_value, record)
 
-def process_chromosomes(chrom_ids_file, parent_type, offspring_count):
+def process_chromosomes(chrom_ids_file, parent_type, offspring_count, fmt='csv', max_missing_rate=0.25, min_p_value=0.01):
     with open(chrom_ids_file, mode='r') as infile:
         chrom_ids = [line.strip() for line in infile.readlines()]
 
-    threshold = int(offspring_count * 0.25)
+    threshold = int(offspring_count * max_missing_rate)
 
     for chrom_id in chrom_ids:
-        input_file = f"{chrom_id}.MNP.genotype.{parent_type}.csv"
-        output_file = f"{chrom_id}.MNP.genotype.filted.{parent_type}.csv"
-
         # 处理每个染色体的文件
-        process_data(input_file, output_file, parent_type, threshold)
+        filter_chromosome(chrom_id, parent_type, threshold, fmt, min_p_value)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Filter CSV files based on genotype counts and chi-square test with p-value > 0.01.")
     parser.add_argument('chrom_ids_file', type=str, help="Path to the text file containing chromosome IDs.")
     parser.add_argument('parent_type', type=str, choices=['male', 'female'], help="Parent type: 'male' or 'female'.")
     parser.add_argument('offspring_count', type=int, help="The number of offspring.")
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help="Input and output format (default: csv).")
+    parser.add_argument('--max-missing-rate', type=float, default=0.25,
+                        help="Markers with at least offspring_count * rate missing calls are removed (default: 0.25).")
+    parser.add_argument('--min-p-value', type=float, default=0.01,
+                        help="Only markers with a chi-square p-value above this value are kept (default: 0.01).")
 
     args = parser.parse_args()
-    process_chromosomes(args.chrom_ids_file, args.parent_type, args.offspring_count)
+    process_chromosomes(args.chrom_ids_file, args.parent_type, args.offspring_count, args.format,
+                        args.max_missing_rate, args.min_p_value)
@@ -2,112 +2,227 @@ import csv
 import argparse
 from collections import Counter, defaultdict
 import ast
+import numpy as np
+import pandas as pd
+import genotype_store
+import metrics
+
+def group_haplotypes(reader, markers_per_mnp=5):
+    """将每 markers_per_mnp 个位点合并为一个MNP，每个子代的基因型用逗号连接为单倍型；返回 (表头, 行列表)"""
+    headers = next(reader)
+    columns_range = range(6, len(headers) - 1)
+
+    new_headers = [headers[0], headers[1]] + headers[6:-1]
+    grouped_rows = []
+
+    def merge_group(group):
+        first_column = set(r[0] for r in group).pop()
+        second_column = min(int(r[1]) for r in group)
+        remaining_columns = [','.join(r[i] for r in group) for i in columns_range]
+        # 位置以字符串保存，与写出再读回中间文件的结果一致
+        return [first_column, str(second_column)] + remaining_columns
+
+    group = []
+    for row in reader:
+        group.append(row)
+        if len(group) == markers_per_mnp:
+            grouped_rows.append(merge_group(group))
+            group = []
+
+    if group:
+        grouped_rows.append(merge_group(group))
+
+    return new_headers, grouped_rows
+
+def count_haplotype_types(grouped_rows):
+    """统计每个MNP中每种单倍型的子代个数，保持首次出现的顺序"""
+    return [(row[:2], Counter(row[2:])) for row in grouped_rows]
 
-def process_step1(input_file, output_file):
-    """Step 1: 处理CSV文件，重新结构化数据"""
-    with open(input_file, mode='r', newline='') as infile, \
-         open(output_file, mode='w', newline='') as outfile:
+def valid_types(type1, type2):
+    """检查两种类型在相同位置上的数字是否都不同"""
+    type1_points = type1.split(',')
+    type2_points = type2.split(',')
+    return all(p1 != p2 for p1, p2 in zip(type1_points, type2_points))
 
-        reader = csv.reader(infile, delimiter=';')
-        writer = csv.writer(outfile, delimiter=';')
+def encode_haplotypes(haplotypes):
+    """将逗号连接的单倍型字符串编码为整数矩阵（单倍型数 × SNP数）；长度不一致时返回 None"""
+    alleles = ','.join(haplotypes).split(',')
+    n_snps = haplotypes[0].count(',') + 1
+    if len(alleles) != len(haplotypes) * n_snps:
+        return None
+    codes, _ = pd.factorize(np.array(alleles, dtype=object))
+    return codes.reshape(len(haplotypes), n_snps)
+
+def find_complementary_pair(sorted_types):
+    """在按个数排序的单倍型中找出第一对每个位置都不同的单倍型，与逐对调用 valid_types 的结果相同"""
+    if len(sorted_types) < 2:
+        return []
+
+    codes = encode_haplotypes(sorted_types)
+    if codes is None:
+        # 单倍型长度不一致时退回逐对比较
+        for i, type1 in enumerate(sorted_types):
+            for type2 in sorted_types[i+1:]:
+                if valid_types(type1, type2):
+                    return [type1, type2]
+        return []
+
+    # 所有单倍型两两比较，只看上三角（j > i）；取第一个有配对的 i 以及它的第一个 j
+    all_differ = np.triu((codes[:, None, :] != codes[None, :, :]).all(axis=2), 1)
+    has_pair = all_differ.any(axis=1)
+    if not has_pair.any():
+        return []
+    i = int(np.argmax(has_pair))
+    j = int(np.argmax(all_differ[i]))
+    return [sorted_types[i], sorted_types[j]]
+
+def select_patterns(type_counts, parent_type, offspring_count):
+    """选出每个MNP中互补的两种主要单倍型，返回 [(行前两列, {单倍型: 基因型})]"""
+    threshold = offspring_count / 2  # 计算阈值为子代个数的一半
+    selected = []
 
-        headers = next(reader)
-        columns_range = range(6, len(headers) - 1)
+    for key_columns, types_counter in type_counts:
+        count_dict = defaultdict(int)
 
-        new_headers = [headers[0], headers[1]] + headers[6:-1]
-        writer.writerow(new_headers)
+        for type, count in types_counter.items():
+            if '..' not in type:
+                count_dict[type] = int(count)
 
-        group = []
-        for row in reader:
-            group.append(row)
-            if len(group) == 5:
-                first_column = set(r[0] for r in group).pop()
-                second_column = min(int(r[1]) for r in group)
-                remaining_columns = [','.join(r[i] for r in group) for i in columns_range]
-                writer.writerow([first_column, second_column] + remaining_columns)
-                group = []
-
-        if group:
-            first_column = set(r[0] for r in group).pop()
-            second_column = min(int(r[1]) for r in group)
-            remaining_columns = [','.join(r[i] for r in group) for i in columns_range]
-            writer.writerow([first_column, second_column] + remaining_columns)
+        sorted_types = sorted(count_dict, key=count_dict.get, reverse=True)
+        top_types = find_complementary_pair(sorted_types)
 
-def process_step2(input_file, output_file):
-    """Step 2: 统计每种类型的个数"""
-    with open(input_file, mode='r', newline='') as infile, \
-         open(output_file, mode='w', newline='') as outfile:
+        if len(top_types) == 2:
+            top_two_sum = sum(count_dict[typ] for typ in top_types)
+            if top_two_sum > threshold:
+                if parent_type == 'male':
+                    type_dict = {top_types[0]: 'nn', top_types[1]: 'np'}
+                else:
+                    type_dict = {top_types[0]: 'lm', top_types[1]: 'll'}
+                selected.append((key_columns, type_dict))
 
-        reader = csv.reader(infile, delimiter=';')
+    return selected
+
+def fuzzy_match(s, pattern):
+    """模糊匹配函数"""
+    mismatches = sum(1 for a, b in zip(s, pattern) if a != b)
+    return mismatches <= 2
+
+def match_row(input_row, current_pattern_dict):
+    """逐个子代匹配单倍型（单倍型长度不一致时使用）"""
+    output_row = input_row[:2]
+    for value in input_row[2:]:
+        value_list = value.split(',')
+        found_match = False
+        for pattern, match in current_pattern_dict.items():
+            pattern_list = pattern.split(',')
+            if fuzzy_match(value_list, pattern_list):
+                output_row.append(match)
+                found_match = True
+                break
+        if not found_match:
+            output_row.append('--')
+    return output_row
+
+def match_block(rows, pattern_dicts, max_mismatches=2):
+    """
+    一组SNP数相同的MNP一起匹配：单倍型编码为 MNP × 子代 × SNP 的整数数组，
+    与每个MNP的两个单倍型模式广播比较，第一个错配数不超过 max_mismatches 的模式胜出，否则为 '--'。
+    """
+    n_rows = len(rows)
+    n_offspring = len(rows[0]) - 2
+    n_snps = rows[0][2].count(',') + 1 if n_offspring else 0
+    patterns = [list(pattern_dict.items()) for pattern_dict in pattern_dicts]
+    if n_offspring == 0 or any(len(items) != 2 for items in patterns):
+        return [match_row(row, pattern_dict) for row, pattern_dict in zip(rows, pattern_dicts)]
+
+    alleles = ','.join(','.join(row[2:]) for row in rows).split(',')
+    pattern_alleles = ','.join(pattern for items in patterns for pattern, _ in items).split(',')
+    if len(alleles) != n_rows * n_offspring * n_snps or len(pattern_alleles) != n_rows * 2 * n_snps:
+        return [match_row(row, pattern_dict) for row, pattern_dict in zip(rows, pattern_dicts)]
+
+    codes, uniques = pd.factorize(np.array(alleles, dtype=object))
+    codes = codes.reshape(n_rows, n_offspring, n_snps)
+    pattern_codes = pd.Index(uniques).get_indexer(np.array(pattern_alleles, dtype=object)).reshape(n_rows, 2, n_snps)
+
+    # 错配数：MNP × 子代 × 模式
+    mismatches = (codes[:, :, None, :] != pattern_codes[:, None, :, :]).sum(axis=3)
+    matched = mismatches <= max_mismatches
+    labels = np.array([[match for _, match in items] for items in patterns], dtype=object)
+    genotypes = np.where(matched[:, :, 0], labels[:, 0:1],
+                         np.where(matched[:, :, 1], labels[:, 1:2], '--'))
+
+    return [row[:2] + genotype_row for row, genotype_row in zip(rows, genotypes.tolist())]
+
+def assign_genotypes(headers, grouped_rows, pattern_dict, block_size=2000):
+    """根据每个MNP选出的单倍型字典为子代分配基因型，匹配不上的记为 '--'；返回包含表头的行列表"""
+    output_rows = [headers[:2] + headers[2:]]
+    matched_rows = [row for row in grouped_rows if row[1] in pattern_dict]
+
+    # 按块处理以限制内存；块内按SNP个数分组（最后一个MNP可能不足5个SNP）
+    for block_start in range(0, len(matched_rows), block_size):
+        block = matched_rows[block_start:block_start + block_size]
+        block_output = [None] * len(block)
+        groups = defaultdict(list)
+        for index, row in enumerate(block):
+            groups[row[2].count(',') if len(row) > 2 else -1].append(index)
+        for indices in groups.values():
+            rows = [block[index] for index in indices]
+            for index, output_row in zip(indices, match_block(rows, [pattern_dict[row[1]] for row in rows])):
+                block_output[index] = output_row
+        output_rows.extend(block_output)
+
+    return output_rows
+
+def write_step1(output_file, headers, grouped_rows):
+    with open(output_file, mode='w', newline='') as outfile:
         writer = csv.writer(outfile, delimiter=';')
+        writer.writerow(headers)
+        writer.writerows(grouped_rows)
 
-        headers = next(reader)
+def write_step2(output_file, headers, type_counts):
+    with open(output_file, mode='w', newline='') as outfile:
+        writer = csv.writer(outfile, delimiter=';')
         writer.writerow(headers[:2] + ['Types'])
-
-        for row in reader:
-            data_columns = row[2:]
-            types_counter = Counter(data_columns)
+        for key_columns, types_counter in type_counts:
             types_str = ';'.join([f"{t}:{c}" for t, c in types_counter.items()])
-            writer.writerow(row[:2] + [types_str])
+            writer.writerow(key_columns + [types_str])
 
-def valid_types(type1, type2):
-    """检查两种类型在相同位置上的数字是否都不同"""
-    type1_points = type1.split(',')
-    type2_points = type2.split(',')
-    return all(p1 != p2 for p1, p2 in zip(type1_points, type2_points))
-
-def process_step3(input_file, output_file, parent_type, offspring_count):
-    """Step 3: 生成字典并根据条件写入输出文件"""
-    threshold = offspring_count / 2  # 计算阈值为子代个数的一半
+def write_step3(output_file, headers, patterns):
+    with open(output_file, mode='w', newline='', encoding='utf-8') as outfile:
+        writer = csv.writer(outfile, delimiter=';')
+        writer.writerow(headers[:2] + ['Dictionary'])
+        for key_columns, type_dict in patterns:
+            writer.writerow(key_columns + [str(type_dict)])
 
-    with open(input_file, mode='r', newline='', encoding='utf-8') as infile, \
-         open(output_file, mode='w', newline='', encoding='utf-8') as outfile:
+def process_step1(input_file, output_file, fmt='csv', markers_per_mnp=5):
+    """Step 1: 处理CSV文件，重新结构化数据"""
+    headers, grouped_rows = group_haplotypes(genotype_store.iter_rows(input_file, fmt), markers_per_mnp)
+    write_step1(output_file, headers, grouped_rows)
 
+def process_step2(input_file, output_file):
+    """Step 2: 统计每种类型的个数"""
+    with open(input_file, mode='r', newline='') as infile:
         reader = csv.reader(infile, delimiter=';')
-        writer = csv.writer(outfile, delimiter=';')
-
         headers = next(reader)
-        writer.writerow(headers[:2] + ['Dictionary'])
+        type_counts = count_haplotype_types(list(reader))
+    write_step2(output_file, headers, type_counts)
 
+def process_step3(input_file, output_file, parent_type, offspring_count):
+    """Step 3: 生成字典并根据条件写入输出文件"""
+    with open(input_file, mode='r', newline='', encoding='utf-8') as infile:
+        reader = csv.reader(infile, delimiter=';')
+        headers = next(reader)
+        type_counts = []
         for row in reader:
-            type_counts = row[2].split(';')
-            count_dict = defaultdict(int)
-
-            for type_count in type_counts:
+            types_counter = Counter()
+            for type_count in row[2].split(';'):
                 type, count = type_count.split(':')
-                if '..' not in type:
-                    count_dict[type] = int(count)
-
-            sorted_types = sorted(count_dict, key=count_dict.get, reverse=True)
-            top_types = []
-
-            for i, type1 in enumerate(sorted_types):
-                if len(top_types) == 2:
-                    break
-                for type2 in sorted_types[i+1:]:
-                    if valid_types(type1, type2):
-                        top_types.append(type1)
-                        top_types.append(type2)
-                        break
-
-            if len(top_types) == 2:
-                top_two_sum = sum(count_dict[typ] for typ in top_types)
-                if top_two_sum > threshold:
-                    if parent_type == 'male':
-                        type_dict = {top_types[0]: 'nn', top_types[1]: 'np'}
-                    else:
-                        type_dict = {top_types[0]: 'lm', top_types[1]: 'll'}
-                    writer.writerow(row[:2] + [str(type_dict)])
-
-def fuzzy_match(s, pattern):
-    """模糊匹配函数"""
-    mismatches = sum(1 for a, b in zip(s, pattern) if a != b)
-    return mismatches <= 2
+                types_counter[type] = int(count)
+            type_counts.append((row[:2], types_counter))
+    write_step3(output_file, headers, select_patterns(type_counts, parent_type, offspring_count))
 
-def process_step4(input_file1, input_file2, output_file):
+def process_step4(input_file1, input_file2, output_file, fmt='csv', parent_type=None):
     """Step 4: 根据匹配条件生成最终输出文件"""
-    output_rows = []
-
     pattern_dict = {}
     with open(input_file2, mode='r') as pattern_file:
         pattern_reader = csv.reader(pattern_file, delimiter=';')
@@ -119,59 +234,63 @@ def process_step4(input_file1, input_file2, output_file):
     with open(input_file1, mode='r') as input_file:
         input_reader = csv.reader(input_file, delimiter=';')
         input_headers = next(input_reader)
-        output_headers = input_headers[:2] + input_headers[2:]
-        output_rows.append(output_headers)
-
-        for input_row in input_reader:
-            key = input_row[1]
-            if key in pattern_dict:
-                output_row = input_row[:2]
-                current_pattern_dict = pattern_dict[key]
-                for value in input_row[2:]:
-                    value_list = value.split(',')
-                    found_match = False
-                    for pattern, match in current_pattern_dict.items():
-                        pattern_list = pattern.split(',')
-                        if fuzzy_match(value_list, pattern_list):
-                            output_row.append(match)
-                            found_match = True
-                            break
-                    if not found_match:
-                        output_row.append('--')
-                output_rows.append(output_row)
+        output_rows = assign_genotypes(input_headers, list(input_reader), pattern_dict)
 
-    with open(output_file, mode='w', newline='') as outfile:
-        writer = csv.writer(outfile, delimiter=';')
-        writer.writerows(output_rows)
+    # 第1列为染色体，第2列为位置，其后为子代基因型
+    genotype_store.write_table_rows(output_file, fmt, output_rows[0], output_rows[1:], (2, None), 1,
+                                    parent_type=parent_type)
 
-def process_chromosomes(chrom_ids_file, parent_type, offspring_count):
-    with open(chrom_ids_file, mode='r') as infile:
-        chrom_ids = [line.strip() for line in infile.readlines()]
-
-    for chrom_id in chrom_ids:
-        input_file1 = f"{chrom_id}.MNP.range.{parent_type}.csv"
-        step1_output = f"{chrom_id}.step1.csv"
-        step2_output = f"{chrom_id}.step2.csv"
-        step3_output = f"{chrom_id}.step3.csv"
-        final_output = f"{chrom_id}.MNP.genotype.{parent_type}.csv"
+def process_chromosome(chrom_id, parent_type, offspring_count, fmt='csv', markers_per_mnp=5, debug=False):
+    """在内存中依次完成四个步骤，只写出最终的基因型文件；debug 为 True 时同时写出各步骤的中间文件"""
+    input_file = f"{chrom_id}.MNP.range.{parent_type}.csv"
+    final_output = f"{chrom_id}.MNP.genotype.{parent_type}.csv"
 
+    with metrics.stage('MNP_maker_genotype', chrom_id, parent_type) as record:
         # Step 1
-        process_step1(input_file1, step1_output)
+        headers, grouped_rows = group_haplotypes(genotype_store.iter_rows(input_file, fmt), markers_per_mnp)
 
         # Step 2
-        process_step2(step1_output, step2_output)
+        type_counts = count_haplotype_types(grouped_rows)
 
         # Step 3
-        process_step3(step2_output, step3_output, parent_type, offspring_count)
+        patterns = select_patterns(type_counts, parent_type, offspring_count)
+
+        if debug:
+            write_step1(f"{chrom_id}.step1.csv", headers, grouped_rows)
+            write_step2(f"{chrom_id}.step2.csv", headers, type_counts)
+            write_step3(f"{chrom_id}.step3.csv", headers, patterns)
 
         # Step 4
-        process_step4(step1_output, step3_output, final_output)
+        pattern_dict = {key_columns[1]: type_dict for key_columns, type_dict in patterns}
+        output_rows = assign_genotypes(headers, grouped_rows, pattern_dict)
+
+        # 第1列为染色体，第2列为位置，其后为子代基因型
+        genotype_store.write_table_rows(final_output, fmt, output_rows[0], output_rows[1:], (2, None), 1,
+                                        parent_type=parent_type)
+
+        # 行数按合并后的 MNP 计；没有找到两种互补单倍型的 MNP 不输出
+        record.add_rows_in(len(grouped_rows))
+        record.drop('haplotype_pattern', len(grouped_rows) - (len(output_rows) - 1))
+        record.add_rows_out(len(output_rows) - 1)
+
+def process_chromosomes(chrom_ids_file, parent_type, offspring_count, fmt='csv', markers_per_mnp=5, debug=False):
+    with open(chrom_ids_file, mode='r') as infile:
+        chrom_ids = [line.strip() for line in infile.readlines()]
+
+    for chrom_id in chrom_ids:
+        process_chromosome(chrom_id, parent_type, offspring_count, fmt, markers_per_mnp, debug)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Process chromosome data files for MNP genotype.")
     parser.add_argument('chrom_ids_file', type=str, help="Path to the text file containing chromosome IDs.")
     parser.add_argument('parent_type', type=str, choices=['male', 'female'], help="Parent type: 'male' or 'female'.")
     parser.add_argument('offspring_count', type=int, help="The number of offspring.")
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help="Input and output format (default: csv).")
+    parser.add_argument('--markers-per-mnp', type=int, default=5,
+                        help="Number of SNPs per MNP marker; must match MNP_marker_building.py (default: 5).")
+    parser.add_argument('--debug', action='store_true',
+                        help="Also write the intermediate <chrom>.step1/2/3.csv files.")
 
     args = parser.parse_args()
-    process_chromosomes(args.chrom_ids_file, args.parent_type, args.offspring_count)
+    process_chromosomes(args.chrom_ids_file, args.parent_type, args.offspring_count, args.format, args.markers_per_mnp,
+                        args.debug)
@@ -1,5 +1,9 @@
 import csv
 import os
+import argparse
+import numpy as np
+import genotype_store
+import metrics
 
 # 辅助函数：交换基因型
 def swap_genotypes(row, parent_type):
@@ -9,101 +13,245 @@ def swap_genotypes(row, parent_type):
         return ['lm' if val == 'll' else 'll' if val == 'lm' else val for val in row]
     return row
 
-# 辅助函数：计算两行基因型的差异
+# 每种亲本类型中互相交换的两种基因型
+SWAP_CLASSES = {'male': ('nn', 'np'), 'female': ('lm', 'll')}
+
+# 0-255 每个字节中 1 的个数，用于按字节统计位掩码的 popcount
+POPCOUNT_TABLE = np.array([bin(value).count('1') for value in range(256)], dtype=np.int64)
+
+# 辅助函数：计算两行基因型的差异，缺失值（--）不计入
 def calculate_score(row1, row2):
     score = 0
     for a, b in zip(row1, row2):
-        if a != b and a != '-' and b != '-':
+        if a != b and a != '--' and b != '--':
             score += 1
     return score
 
-# 第一步：相邻行逐行比较
-def round1_process(data, parent_type):
-    for i in range(1, len(data)):
-        row_current = data[i][2:]  # 当前行
-        row_previous = data[i - 1][2:]  # 前一行
-        
-        # 原始基因型和交换后的基因型
-        original_row = row_current[:]
-        swapped_row = swap_genotypes(row_current, parent_type)
-
-        # 计算原始基因型与前一行的得分
-        original_score = calculate_score(original_row, row_previous)
-        swapped_score = calculate_score(swapped_row, row_previous)
+def encode_markers(data, parent_type):
+    """
+    将每个标记编码为两个按子代打包的位掩码：
+    is_a 表示该子代为第一种基因型（nn 或 lm），called 表示该子代为两种基因型之一（非缺失）。
+    """
+    class_a, class_b = SWAP_CLASSES[parent_type]
+    genotypes = np.array([row[2:] for row in data], dtype=object).reshape(len(data), -1)
+    is_a = genotypes == class_a
+    called = is_a | (genotypes == class_b)
+    return np.packbits(is_a, axis=1), np.packbits(called, axis=1)
 
+def encode_codes(codes, code_a, code_b):
+    """与 encode_markers 相同的位掩码，直接由二进制存储的 int8 编码得到"""
+    is_a = codes == code_a
+    called = is_a | (codes == code_b)
+    return np.packbits(is_a, axis=1), np.packbits(called, axis=1)
+
+def pair_scores(is_a, called, distance):
+    """
+    标记 i 与标记 i - distance 的差异数（i >= distance）：
+    mismatch 为按原方向比较的差异，swapped 为其中一个标记交换后的差异。
+    """
+    both_called = called[distance:] & called[:-distance]
+    mismatch = POPCOUNT_TABLE[(is_a[distance:] ^ is_a[:-distance]) & both_called].sum(axis=1)
+    swapped = POPCOUNT_TABLE[both_called].sum(axis=1) - mismatch
+    return mismatch, swapped
+
+def round1_flips(is_a, called, flips):
+    """第一步：相邻行逐行比较，前一行按当前方向参与比较"""
+    mismatch, swapped = pair_scores(is_a, called, 1)
+    for i in range(1, len(flips)):
+        if flips[i] == flips[i - 1]:
+            original_score, swapped_score = mismatch[i - 1], swapped[i - 1]
+        else:
+            original_score, swapped_score = swapped[i - 1], mismatch[i - 1]
         # 如果交换后的得分更低，使用交换后的基因型
         if swapped_score < original_score:
-            data[i][2:] = swapped_row
+            flips[i] = not flips[i]
+    return flips
+
+def round2_flips(is_a, called, flips):
+    """第二步：三行一组，与前三行逐行对应比较"""
+    n = len(flips)
+    if n < 6:
+        return flips
+    mismatch, swapped = pair_scores(is_a, called, 3)
+    for i in range(3, n, 3):
+        if i + 3 > n:
+            break
+        original_score = 0
+        swapped_score = 0
+        for j in range(3):
+            pair = i + j - 3
+            if flips[i + j] == flips[i + j - 3]:
+                original_score += mismatch[pair]
+                swapped_score += swapped[pair]
+            else:
+                original_score += swapped[pair]
+                swapped_score += mismatch[pair]
+        # 如果交换得分更低，则整组交换
+        if swapped_score < original_score:
+            flips[i:i + 3] = ~flips[i:i + 3]
+    return flips
+
+def global_flips(is_a, called, window=3):
+    """
+    全局定向：同时选择所有标记的方向，使每个标记与其前 window 个标记的差异总数最小。
+    以最近 window 个标记的方向为状态做动态规划（Viterbi），第一个标记保持原方向。
+    """
+    n = len(is_a)
+    flips = np.zeros(n, dtype=bool)
+    if n < 2:
+        return flips
+
+    n_states = 1 << window
+    state_mask = n_states - 1
+    # 状态的第 k 位表示前第 k+1 个标记（i-1-k）是否交换
+    state_bits = (np.arange(n_states)[:, None] >> np.arange(window)[None, :]) & 1
+    scores = [pair_scores(is_a, called, distance) for distance in range(1, window + 1)]
+
+    cost = np.full(n_states, np.inf)
+    cost[0] = 0
+    backpointers = np.zeros((n, n_states), dtype=np.int64)
+    low_states = np.arange(n_states >> 1)
+    high_states = low_states | (n_states >> 1)
+
+    for i in range(1, n):
+        # 当前标记与前 distance 个标记比较的两种得分
+        same = np.zeros(window)
+        opposite = np.zeros(window)
+        for distance in range(1, min(window, i) + 1):
+            mismatch, swapped = scores[distance - 1]
+            same[distance - 1] = mismatch[i - distance]
+            opposite[distance - 1] = swapped[i - distance]
+
+        new_cost = np.empty(n_states)
+        new_back = np.empty(n_states, dtype=np.int64)
+        for flip in (0, 1):
+            relative = state_bits ^ flip
+            added = np.where(relative == 0, same[None, :], opposite[None, :]).sum(axis=1)
+            candidate = cost + added
+            # 旧状态 low 与 low | top 只差最早的一个标记，转移到同一新状态，取代价较小者（相同时取 low）
+            take_high = candidate[high_states] < candidate[low_states]
+            next_states = ((low_states << 1) & state_mask) | flip
+            new_cost[next_states] = np.where(take_high, candidate[high_states], candidate[low_states])
+            new_back[next_states] = np.where(take_high, high_states, low_states)
+        cost = new_cost
+        backpointers[i] = new_back
+
+    # 回溯得到每个标记的方向
+    state = int(np.argmin(cost))
+    for i in range(n - 1, 0, -1):
+        flips[i] = bool(state & 1)
+        state = int(backpointers[i][state])
+    return flips
+
+def apply_flips(data, flips, parent_type):
+    for i in np.flatnonzero(flips):
+        data[i][2:] = swap_genotypes(data[i][2:], parent_type)
     return data
 
+# 第一步：相邻行逐行比较
+def round1_process(data, parent_type):
+    if len(data) < 2:
+        return data
+    is_a, called = encode_markers(data, parent_type)
+    return apply_flips(data, round1_flips(is_a, called, np.zeros(len(data), dtype=bool)), parent_type)
+
 # 第二步：三行一组进行比较
 def round2_process(data, parent_type):
-    for i in range(3, len(data), 3):
-        if i + 3 > len(data):
-            break
-        
-        block_current = data[i:i+3]  # 后三行
-        block_previous = data[i-3:i]  # 前三行
+    if len(data) < 2:
+        return data
+    is_a, called = encode_markers(data, parent_type)
+    return apply_flips(data, round2_flips(is_a, called, np.zeros(len(data), dtype=bool)), parent_type)
 
-        original_block = [row[2:] for row in block_current]  # 当前三行的原始值
-        swapped_block = [swap_genotypes(row[2:], parent_type) for row in block_current]  # 当前三行的交换值
+def choose_flips(is_a, called, mode='greedy', window=3):
+    """
+    确定每个标记的方向，返回需要交换的行。
+    greedy：与原来相同的两轮比较（相邻行，再三行一组）；global：全局动态规划。
+    """
+    if mode == 'global':
+        return global_flips(is_a, called, window)
+    flips = round1_flips(is_a, called, np.zeros(len(is_a), dtype=bool))
+    return round2_flips(is_a, called, flips)
 
-        # 计算原始值和交换值的得分
-        original_score = sum(calculate_score(original_block[j], block_previous[j][2:]) for j in range(3))
-        swapped_score = sum(calculate_score(swapped_block[j], block_previous[j][2:]) for j in range(3))
+def orient_markers(data, parent_type, mode='greedy', window=3):
+    """确定每个标记的方向并交换需要交换的行"""
+    if len(data) < 2:
+        return data
+    return apply_flips(data, choose_flips(*encode_markers(data, parent_type), mode, window), parent_type)
 
-        # 如果交换得分更低，则使用交换值
-        if swapped_score < original_score:
-            for j in range(3):
-                data[i+j][2:] = swapped_block[j]
-    return data
+def orient_store(input_path, output_path, parent_type, mode='greedy', window=3):
+    """
+    二进制存储的定向：位掩码直接由 int8 编码得到，交换也只是交换两种基因型的编码，不还原为字符串。
+    返回行数。
+    """
+    store = genotype_store.read_store(input_path)
+    codes = np.array(store.codes)
+    alleles = list(store.alleles)
+    class_a, class_b = SWAP_CLASSES[parent_type]
+    code_a = genotype_store.allele_code(alleles, class_a)
+    code_b = genotype_store.allele_code(alleles, class_b)
+    if len(codes) >= 2:
+        flips = choose_flips(*encode_codes(codes, code_a, code_b), mode, window)
+        flipped = codes[flips]
+        codes[flips] = np.where(flipped == code_a, code_b, np.where(flipped == code_b, code_a, flipped))
+    genotype_store.write_codes(output_path, codes, alleles, store.positions, store.metadata['position_column'],
+                               store.genotype_columns, store.metadata['n_columns'], store.columns,
+                               store.other_columns(), chrom=store.chrom, parent_type=parent_type)
+    return len(codes)
 
 # 主函数：处理文件的主要逻辑
-def process_file(chrom_id, parent_type):
+def process_file(chrom_id, parent_type, fmt='csv', mode='greedy', window=3):
     input_file = f"{chrom_id}.MNP.genotype.filted.{parent_type}.csv"
     output_file = f"{chrom_id}.MNP.genotype.swap.{parent_type}.csv"
 
-    if not os.path.exists(input_file):
+    if not os.path.exists(genotype_store.data_path(input_file, fmt)):
         print(f"文件 {input_file} 不存在，跳过该染色体。")
         return
 
-    with open(input_file, mode='r') as infile:
-        reader = csv.reader(infile, delimiter=';')
+    with metrics.stage('MNP_maker_swap', chrom_id, parent_type) as record:
+        if fmt == 'store':
+            n_rows = orient_store(genotype_store.store_path(input_file), genotype_store.store_path(output_file),
+                                  parent_type, mode, window)
+            record.add_rows_in(n_rows)
+            record.add_rows_out(n_rows)
+            print(f"处理完成，结果已保存至: {output_file}")
+            return
+
+        reader = genotype_store.iter_rows(input_file, fmt)
         headers = next(reader)
         data = [row for row in reader]
+        record.add_rows_in(len(data))
 
-    # 第一轮处理：相邻行的比较
-    data = round1_process(data, parent_type)
+        # 确定每个标记的方向：相邻行比较和三行一组比较，或全局定向
+        data = orient_markers(data, parent_type, mode, window)
 
-    # 第二轮处理：三行一组的比较
-    data = round2_process(data, parent_type)
-
-    # 写入最终结果到输出文件
-    with open(output_file, mode='w', newline='') as outfile:
-        writer = csv.writer(outfile, delimiter=';')
-        writer.writerow(headers)
-        writer.writerows(data)
+        # 写入最终结果到输出文件
+        with open(output_file, mode='w', newline='') as outfile:
+            writer = csv.writer(outfile, delimiter=';')
+            writer.writerow(headers)
+            writer.writerows(data)
+        record.add_rows_out(len(data))
 
     print(f"处理完成，结果已保存至: {output_file}")
 
 # 主函数：根据输入文件处理多个染色体
-def main(chrom_id_file, parent_type):
+def main(chrom_id_file, parent_type, fmt='csv', mode='greedy', window=3):
     # 读取染色体ID
     with open(chrom_id_file, 'r') as f:
         chrom_ids = [line.strip() for line in f.readlines()]
 
     # 对每个染色体进行处理
     for chrom_id in chrom_ids:
-        process_file(chrom_id, parent_type)
+        process_file(chrom_id, parent_type, fmt, mode, window)
 
 if __name__ == '__main__':
-    import sys
-    if len(sys.argv) != 3:
-        print("Usage: python swap.py <chrom_id_file> <parent_type>")
-    else:
-        chrom_id_file = sys.argv[1]
-        parent_type = sys.argv[2]
-        if parent_type not in ['male', 'female']:
-            print("亲本类型应为 'male' 或 'female'")
-        else:
-            main(chrom_id_file, parent_type)
+    parser = argparse.ArgumentParser(description="Swap MNP genotypes so that adjacent markers share the same phase.")
+    parser.add_argument('chrom_id_file', type=str, help="Path to the text file containing chromosome IDs.")
+    parser.add_argument('parent_type', type=str, choices=['male', 'female'], help="Parent type: 'male' or 'female'.")
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help="Input and output format (default: csv).")
+    parser.add_argument('--mode', choices=['greedy', 'global'], default='greedy',
+                        help="greedy: adjacent rows, then blocks of three (default); global: choose all phases together.")
+    parser.add_argument('--window', type=int, default=3,
+                        help="In global mode, each marker is compared with this many preceding markers (default: 3).")
+
+    args = parser.parse_args()
+    main(args.chrom_id_file, args.parent_type, args.format, args.mode, args.window)
@@ -1,81 +1,144 @@
 import pandas as pd
+import numpy as np
 import csv
 import argparse
+import genotype_store
+import metrics
 
 def filter_rows_by_type_ratio(df, start_col):
     df_copy = df.copy()
-    
-    ratios = []
-    for index, row in df_copy.iterrows():
-        type_counts = row[start_col:].value_counts()
-        type_counts = type_counts.drop('..', errors='ignore')
-        
-        if len(type_counts) >= 2:
-            max_count = type_counts.iloc[0]
-            second_max_count = type_counts.iloc[1]
+
+    # 将子代基因型列编码为整数，缺失值（NaN）编码为 -1，'..' 不参与计数
+    values = df_copy.iloc[:, start_col:].to_numpy(dtype=object)
+    n_rows = values.shape[0]
+    codes, types = pd.factorize(values.ravel())
+    codes = codes.reshape(values.shape)
+    n_types = len(types)
+    valid = codes >= 0
+    for dot_code in np.flatnonzero(types == '..'):
+        valid &= codes != dot_code
+
+    # 每行每种类型的个数：行号 × 类型数 + 类型编码，一次 bincount 完成
+    row_ids = np.broadcast_to(np.arange(n_rows)[:, None], codes.shape)
+    flat_index = (row_ids * n_types + codes)[valid]
+    type_counts = np.bincount(flat_index, minlength=n_rows * n_types).reshape(n_rows, n_types)
+
+    # 出现次数最多和第二多的两种类型，比值在 1 到 1.5 之间的行保留
+    if n_types >= 2:
+        top_two = -np.partition(-type_counts, 1, axis=1)[:, :2]
+        max_count = top_two[:, 0]
+        second_max_count = top_two[:, 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
             ratio = max_count / second_max_count
-            ratios.append(1 <= ratio <= 1.5)
-        else:
-            ratios.append(False)
+        ratios = (second_max_count > 0) & (ratio >= 1) & (ratio <= 1.5)
+    else:
+        ratios = np.zeros(n_rows, dtype=bool)
 
     df_copy = df_copy[ratios]
 
     return df_copy
 
-def count_dots_and_filter(input_file, start_col):
+def count_dots_and_filter(input_file, start_col, fmt='csv', record=None):
     # 读取CSV文件，不指定列名，直接使用位置索引
-    df = pd.read_csv(input_file, sep=';', header=None, dtype=str)
+    df = genotype_store.read_frame(input_file, fmt, header=None, dtype=str)
     
     filtered_df = filter_rows_by_type_ratio(df, start_col)
+    if record is not None:
+        record.add_rows_in(len(df))
+        record.drop('type_ratio', len(df) - len(filtered_df))
     # 添加一列计算每行中包含'..'的数量
-    filtered_df['dot_counts'] = filtered_df.iloc[:, start_col:].apply(lambda x: (x == '..').sum(), axis=1)
+    filtered_df['dot_counts'] = (filtered_df.iloc[:, start_col:].to_numpy(dtype=object) == '..').sum(axis=1)
     return filtered_df
 
-def sort_and_output(df, output_file):
-    max_position = df.iloc[:, 1].astype(int).max()  # 使用索引1来代替列名'position'
-    number_of_bins = (max_position - 5000) // 5000
-    bins = [[] for _ in range(number_of_bins + 1)]
-    
-    for index, row in df.iterrows():
-        position = int(row.iloc[1])  # 使用索引1来代替列名'position'
-        dot_counts = int(row['dot_counts'])
-        
-        if 5000 <= position <= max_position:
-            bin_index = (position - 5000) // 5000
-            bins[bin_index].append((position, dot_counts, row))
-    
+def select_window_markers(df, window_size=5000, window_offset=5000, markers_per_mnp=5):
+    """
+    按物理位置将位点划分到窗口中：窗口编号为 (位置 - window_offset) // window_size。
+    每个窗口内按 '..' 个数稳定排序，位点数不少于 markers_per_mnp 的窗口取前 markers_per_mnp 个位点。
+    """
+    positions = df.iloc[:, 1].astype(np.int64).to_numpy()  # 使用索引1来代替列名'position'
+    dot_counts = df['dot_counts'].to_numpy(dtype=np.int64)
+
+    # 位置小于窗口起点的位点不参与分组
+    in_range = np.flatnonzero(positions >= window_offset)
+    bin_ids = (positions[in_range] - window_offset) // window_size
+
+    # 先按窗口编号、再按缺失个数排序；lexsort 是稳定排序，相同缺失个数保持原有顺序
+    order = in_range[np.lexsort((dot_counts[in_range], bin_ids))]
+    sorted_bins = (positions[order] - window_offset) // window_size
+
+    # 每个位点在所属窗口中的名次以及窗口的位点数
+    bin_starts = np.flatnonzero(np.r_[True, sorted_bins[1:] != sorted_bins[:-1]]) if len(order) else np.zeros(0, dtype=np.int64)
+    bin_sizes = np.diff(np.r_[bin_starts, len(order)])
+    rank_in_bin = np.arange(len(order)) - np.repeat(bin_starts, bin_sizes)
+    size_of_bin = np.repeat(bin_sizes, bin_sizes)
+
+    selected = order[(size_of_bin >= markers_per_mnp) & (rank_in_bin < markers_per_mnp)]
+    return df.iloc[selected]
+
+def sort_and_output(df, output_file, fmt='csv', start_col=6, parent_type=None,
+                    window_size=5000, window_offset=5000, markers_per_mnp=5):
+    selected_df = select_window_markers(df, window_size, window_offset, markers_per_mnp)
+    rows = selected_df.values.tolist()
+
+    if fmt == 'store':
+        # 基因型列为第 start_col 列到 dot_counts 之前，第2列为位置
+        genotype_store.write_table_rows(output_file, fmt, [str(column) for column in df.columns], rows,
+                                        (start_col, df.shape[1] - 1), 1, parent_type=parent_type)
+        return len(rows)
+
     with open(output_file, 'w', newline='') as file:
         writer = csv.writer(file, delimiter=';')
         writer.writerow(df.columns)  # 写入表头
-        for bin_data in bins:
-            if len(bin_data) >= 5:
-                bin_data.sort(key=lambda x: x[1])
-                for data in bin_data[:5]:
-                    writer.writerow(data[2].values)
+        writer.writerows(rows)
+    return len(rows)
+
+def process_chromosome(chrom_id, parent_type, fmt='csv', window_sizes=(5000,), window_offset=5000, markers_per_mnp=5):
+    input_file = f"{chrom_id}.merged.variant.{parent_type}.csv"
+
+    print(f"Processing {input_file}...")
+
+    with metrics.stage('MNP_marker_building', chrom_id, parent_type) as record:
+        filtered_df = count_dots_and_filter(input_file, start_col=6, fmt=fmt, record=record)
+
+        # 同一次运行可以尝试多个窗口大小；多个窗口时输出文件名中加上窗口大小
+        for window_size in window_sizes:
+            if len(window_sizes) == 1:
+                output_file = f"{chrom_id}.MNP.range.{parent_type}.csv"
+                rule = 'window_size'
+            else:
+                output_file = f"{chrom_id}.MNP.range.{parent_type}.w{window_size}.csv"
+                rule = f'window_size_{window_size}'
 
-def process_chromosomes(chromosome_file, parent_type):
+            n_selected = sort_and_output(filtered_df, output_file, fmt=fmt, start_col=6, parent_type=parent_type,
+                                         window_size=window_size, window_offset=window_offset,
+                                         markers_per_mnp=markers_per_mnp)
+            record.drop(rule, len(filtered_df) - n_selected)
+            record.add_rows_out(n_selected)
+
+            print(f"Output saved to {output_file}.")
+
+def process_chromosomes(chromosome_file, parent_type, fmt='csv', window_sizes=(5000,), window_offset=5000,
+                        markers_per_mnp=5):
     with open(chromosome_file, 'r') as file:
         chromosome_ids = file.read().splitlines()
     
     for chrom_id in chromosome_ids:
-        input_file = f"{chrom_id}.merged.variant.{parent_type}.csv"
-        output_file = f"{chrom_id}.MNP.range.{parent_type}.csv"
-
-        print(f"Processing {input_file}...")
-
-        filtered_df = count_dots_and_filter(input_file, start_col=6)
-        sort_and_output(filtered_df, output_file)
-
-        print(f"Output saved to {output_file}.")
+        process_chromosome(chrom_id, parent_type, fmt, window_sizes, window_offset, markers_per_mnp)
 
 def main():
     parser = argparse.ArgumentParser(description='Process chromosome data by type and filter criteria.')
     parser.add_argument('parent_type', type=str, choices=['male', 'female'], help='Parent type (male or female)')
     parser.add_argument('chromosome_file', type=str, help='Chromosome ID file (txt file with one chromosome ID per line)')
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help='Input and output format (default: csv)')
+    parser.add_argument('--window-size', type=int, nargs='+', default=[5000],
+                        help='Window size in bp (default: 5000); with several sizes, one output per size is written as *.MNP.range.<parent>.w<size>.csv')
+    parser.add_argument('--window-offset', type=int, default=5000, help='Position where the first window starts (default: 5000)')
+    parser.add_argument('--markers-per-mnp', type=int, default=5, help='Number of SNPs combined into one MNP marker (default: 5)')
     
     args = parser.parse_args()
 
-    process_chromosomes(args.chromosome_file, args.parent_type)
+    process_chromosomes(args.chromosome_file, args.parent_type, args.format, args.window_size, args.window_offset,
+                        args.markers_per_mnp)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1 @@
+# 性能测试：synthetic_f1 模拟 F1 群体数据，bench_stages 在不同规模下测量流程各步骤的耗时和内存。
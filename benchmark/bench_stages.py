@@ -0,0 +1,124 @@
+import argparse
+import itertools
+import json
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import run_pipeline
+from . import synthetic_f1
+
+# 在不同规模（子代数 × 位点数）的模拟数据上依次运行流程的每个任务，
+# 每个任务在新启动的进程中运行，记录墙钟时间、CPU 时间、峰值内存（RSS）和每秒处理的行数。
+
+def measure_task(workdir, script, function, args):
+    """在子进程中运行一个任务，返回 (墙钟时间, CPU 时间, 峰值 RSS MB)"""
+    run_pipeline.load_script(script)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    run_pipeline.run_function(workdir, script, function, args)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    # Linux 下 ru_maxrss 的单位为 KB
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return wall, cpu, peak_rss
+
+def count_rows(path):
+    """输入文件的数据行数：VCF 不计表头，MNP 和 bins 文件有一行表头，存储目录读取 header.json"""
+    if path.endswith('.gstore'):
+        with open(os.path.join(path, 'header.json'), 'r') as f:
+            return json.load(f)['n_rows']
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as f:
+        if path.endswith('.vcf'):
+            return sum(1 for line in f if not line.startswith(b'#'))
+        rows = sum(1 for _ in f)
+    has_header = '.MNP.' in path or '.bins.' in path
+    return max(rows - 1, 0) if has_header else rows
+
+def pipeline_args(workdir, offspring, fmt='csv', bin_size=50000):
+    """与 run_pipeline.py 默认参数相同的任务参数；子代缺失阈值取子代数的 25%"""
+    return argparse.Namespace(
+        parents_vcf=os.path.join(workdir, 'parents.vcf'), offsprings_vcf=os.path.join(workdir, 'offsprings.vcf'),
+        male_id='M', female_id='F', parent_dp=6, offspring_dp=3, missing_threshold=int(offspring * 0.25),
+        chromosomes='chromosome_ids.txt', parent_types=['male', 'female'], format=fmt, bin_size=bin_size,
+        window_size=5000, window_offset=5000, markers_per_mnp=5, max_missing_rate=0.25, min_p_value=0.01,
+        swap_mode='greedy', swap_window=3, majority=0.51)
+
+def bench_scale(workdir, offspring, sites, chromosomes=2, snp_density=5.0, fmt='csv', bin_size=50000, seed=1):
+    """模拟一个规模的数据并依次运行所有任务，按步骤汇总各染色体和亲本类型的结果"""
+    chromosome_length = max(1, int(sites / chromosomes / snp_density * 1000))
+    simulate_start = time.perf_counter()
+    n_sites = synthetic_f1.simulate_f1(workdir, offspring, chromosomes, chromosome_length, snp_density, seed=seed)
+    print(f"模拟 {offspring} 个子代 × {n_sites} 个位点用时 {time.perf_counter() - simulate_start:.1f} s")
+
+    args = pipeline_args(workdir, offspring, fmt, bin_size)
+    with open(os.path.join(workdir, 'chromosome_ids.txt'), 'r') as f:
+        chrom_ids = [line.strip() for line in f if line.strip()]
+    tasks = run_pipeline.front_tasks(args) + run_pipeline.chromosome_tasks(args, chrom_ids, offspring)
+
+    stages = {}
+    context = multiprocessing.get_context('spawn')
+    for task in tasks:
+        rows = sum(count_rows(os.path.join(workdir, path)) for path in task.inputs if not path.endswith('.txt'))
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            wall, cpu, peak_rss = pool.submit(measure_task, workdir, task.script, task.function, task.args).result()
+
+        stage = task.name.split(':')[0]
+        record = stages.setdefault(stage, {'offspring': offspring, 'sites': n_sites, 'stage': stage, 'tasks': 0,
+                                           'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_mb': 0.0, 'input_rows': 0})
+        record['tasks'] += 1
+        record['wall_s'] += wall
+        record['cpu_s'] += cpu
+        record['peak_rss_mb'] = max(record['peak_rss_mb'], peak_rss)
+        record['input_rows'] += rows
+
+    for record in stages.values():
+        record['rows_per_s'] = record['input_rows'] / record['wall_s'] if record['wall_s'] > 0 else 0.0
+    return list(stages.values())
+
+def print_table(records):
+    print(f"{'offspring':>9} {'sites':>9} {'stage':<24} {'tasks':>5} {'wall_s':>9} {'cpu_s':>9} "
+          f"{'peak_MB':>8} {'rows':>10} {'rows/s':>11}")
+    for r in records:
+        print(f"{r['offspring']:>9} {r['sites']:>9} {r['stage']:<24} {r['tasks']:>5} {r['wall_s']:>9.2f} "
+              f"{r['cpu_s']:>9.2f} {r['peak_rss_mb']:>8.1f} {r['input_rows']:>10} {r['rows_per_s']:>11.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Time every pipeline stage on simulated F1 data at several scales.')
+    parser.add_argument('--offspring', type=int, nargs='+', default=[100], help='Offspring counts to test (default: 100).')
+    parser.add_argument('--sites', type=int, nargs='+', default=[10000], help='Total SNP counts to test (default: 10000).')
+    parser.add_argument('--chromosomes', type=int, default=2, help='Number of simulated chromosomes (default: 2).')
+    parser.add_argument('--snp-density', type=float, default=5.0, help='SNPs per kb; sets the chromosome length (default: 5).')
+    parser.add_argument('--bin-size', type=int, default=50000, help='Bin size for bin_maker_genotype (default: 50000).')
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help='Per-chromosome file format (default: csv).')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed of the simulation (default: 1).')
+    parser.add_argument('--workdir', help='Keep the simulated data and outputs in this directory (default: a temporary directory).')
+    parser.add_argument('--output', help='Also write the results to this JSON file.')
+    args = parser.parse_args()
+
+    records = []
+    for offspring, sites in itertools.product(args.offspring, args.sites):
+        if args.workdir:
+            workdir = os.path.abspath(os.path.join(args.workdir, f'o{offspring}_s{sites}'))
+            os.makedirs(workdir, exist_ok=True)
+        else:
+            workdir = tempfile.mkdtemp(prefix='bench_f1_')
+        try:
+            records += bench_scale(workdir, offspring, sites, args.chromosomes, args.snp_density, args.format,
+                                   args.bin_size, args.seed)
+        finally:
+            if not args.workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(records)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(records, f, indent=1)
+
+if __name__ == '__main__':
+    main()
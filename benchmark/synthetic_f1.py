@@ -0,0 +1,186 @@
+import argparse
+import os
+import numpy as np
+
+# 模拟高度杂合的葡萄 F1 群体：两个亲本各有两条单倍型，子代从每个亲本各继承一条重组后的单倍型。
+# 输出亲本和子代 VCF，以及流程各步骤需要的 merged.variant.csv、samples_header.txt 和 chromosome_ids.txt。
+
+# 位点的亲本类型及默认比例：母本杂合（lmxll）、父本杂合（nnxnp）、双亲杂合（hkxhk）、双亲纯合（aaxbb，亲本过滤时去除）
+SITE_CLASSES = ('lmxll', 'nnxnp', 'hkxhk', 'aaxbb')
+DEFAULT_PROPORTIONS = (0.35, 0.35, 0.2, 0.1)
+
+BASES = np.array(list('ACGT'))
+# 基因型编码：0 = 0/0，1 = 0/1，2 = 1/1，3 = ./.
+GT_STRINGS = np.array([b'0/0', b'0/1', b'1/1', b'./.'], dtype='S3').view(np.uint8).reshape(4, 3)
+MISSING_GT = 3
+
+# 写文件时每块的位点数
+BLOCK_SIZE = 20000
+
+def crossover_haplotypes(positions, n_meioses, length, cm_per_mb, rng):
+    """
+    每次减数分裂的交换次数服从 Poisson(遗传长度)，交换位置均匀分布（Haldane 模型）。
+    返回 位点 × 减数分裂 的单倍型编号（0 或 1）。
+    """
+    morgans = length / 1e6 * cm_per_mb / 100
+    haplotypes = np.empty((len(positions), n_meioses), dtype=np.uint8)
+    for meiosis in range(n_meioses):
+        crossovers = np.sort(rng.uniform(0, length, rng.poisson(morgans)))
+        start = rng.integers(2)
+        haplotypes[:, meiosis] = (start + np.searchsorted(crossovers, positions)) % 2
+    return haplotypes
+
+def parent_haplotypes(site_classes, rng):
+    """由位点类型生成两个亲本的单倍型（位点 × 2），杂合位点的连锁相随机"""
+    n_sites = len(site_classes)
+    female = np.zeros((n_sites, 2), dtype=np.uint8)
+    male = np.zeros((n_sites, 2), dtype=np.uint8)
+    female_het = (site_classes == 0) | (site_classes == 2)
+    male_het = (site_classes == 1) | (site_classes == 2)
+
+    # 杂合：两条单倍型分别为 0 和 1，相随机；纯合：随机为 0/0 或 1/1
+    for haplotypes, het in ((female, female_het), (male, male_het)):
+        phase = rng.integers(2, size=n_sites).astype(np.uint8)
+        homozygous = rng.integers(2, size=n_sites).astype(np.uint8)
+        haplotypes[:, 0] = np.where(het, phase, homozygous)
+        haplotypes[:, 1] = np.where(het, 1 - phase, homozygous)
+
+    # 双亲纯合的位点：两个亲本纯合且不同
+    both_hom = site_classes == 3
+    male[both_hom] = 1 - female[both_hom]
+    return female, male
+
+def genotype_cells(codes, separator, depths=None):
+    """将基因型编码矩阵（位点 × 样本）转为定宽字节矩阵，每个单元格后接分隔符，行末为换行"""
+    n_sites, n_samples = codes.shape
+    width = 4 if depths is None else 7
+    cells = np.empty((n_sites, n_samples, width), dtype=np.uint8)
+    cells[..., :3] = GT_STRINGS[codes]
+    if depths is not None:
+        cells[..., 3] = ord(':')
+        cells[..., 4] = ord('0') + depths // 10
+        cells[..., 5] = ord('0') + depths % 10
+    cells[..., -1] = ord(separator)
+    cells[:, -1, -1] = ord('\n')
+    return cells.reshape(n_sites, -1)
+
+def simulate_chromosome(length, offspring, snp_density, proportions, cm_per_mb, rng):
+    """模拟一条染色体：返回位置、REF/ALT、位点类型、亲本基因型（位点 × 2）和子代基因型（位点 × 子代）"""
+    n_sites = max(1, int(round(length / 1000 * snp_density)))
+    positions = np.unique(rng.integers(1, length + 1, size=n_sites))
+    site_classes = rng.choice(len(SITE_CLASSES), size=len(positions), p=proportions)
+    female, male = parent_haplotypes(site_classes, rng)
+
+    # 子代：母本和父本的配子各经过一次减数分裂
+    maternal = crossover_haplotypes(positions, offspring, length, cm_per_mb, rng)
+    paternal = crossover_haplotypes(positions, offspring, length, cm_per_mb, rng)
+    rows = np.arange(len(positions))[:, None]
+    offspring_gt = female[rows, maternal] + male[rows, paternal]
+    parent_gt = np.stack([female.sum(axis=1), male.sum(axis=1)], axis=1)
+
+    ref = rng.integers(4, size=len(positions))
+    alt = (ref + rng.integers(1, 4, size=len(positions))) % 4
+    return positions, BASES[ref], BASES[alt], site_classes, parent_gt.astype(np.uint8), offspring_gt.astype(np.uint8)
+
+def observe(genotypes, depth, missing_rate, error_rate, rng):
+    """加入测序深度、基因型错误和缺失：返回观测到的基因型编码和 DP（0-99）"""
+    depths = np.minimum(rng.poisson(depth, size=genotypes.shape), 99).astype(np.uint8)
+    observed = genotypes.copy()
+    errors = rng.random(genotypes.shape) < error_rate
+    observed[errors] = (observed[errors] + rng.integers(1, 3, size=errors.sum())) % 3
+    observed[(rng.random(genotypes.shape) < missing_rate) | (depths == 0)] = MISSING_GT
+    return observed, depths
+
+def vcf_header(contigs, samples):
+    lines = ['##fileformat=VCFv4.2', '##source=synthetic_f1']
+    lines += [f'##contig=<ID={chrom},length={length}>' for chrom, length in contigs]
+    lines += ['##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">',
+              '##FORMAT=<ID=DP,Number=1,Type=Integer,Description="Read depth">',
+              '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t' + '\t'.join(samples)]
+    return '\n'.join(lines) + '\n'
+
+def simulate_f1(output_dir, offspring=100, chromosomes=2, chromosome_length=1000000, snp_density=5.0,
+                missing_rate=0.05, error_rate=0.01, cm_per_mb=3.0, parent_depth=20, offspring_depth=10,
+                parent_min_dp=6, offspring_min_dp=3, proportions=DEFAULT_PROPORTIONS, seed=1):
+    """
+    在 output_dir 中写出：
+      parents.vcf、offsprings.vcf       亲本（母本 F 在前，父本 M 在后）和子代的 VCF
+      merged.variant.csv               与 vcf_to_merged_variant.py 处理过滤后 VCF 的结果相同（亲本按 parent_min_dp 过滤，
+                                       子代 DP 低于 offspring_min_dp 的基因型记为缺失）
+      samples_header.txt、chromosome_ids.txt
+    返回位点总数。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    proportions = np.asarray(proportions, dtype=float) / np.sum(proportions)
+    contigs = [(f'chr{index:02d}', chromosome_length) for index in range(1, chromosomes + 1)]
+    samples = [f'F1_{index:04d}' for index in range(1, offspring + 1)]
+
+    n_sites = 0
+    with open(os.path.join(output_dir, 'parents.vcf'), 'wb') as parents_out, \
+            open(os.path.join(output_dir, 'offsprings.vcf'), 'wb') as offsprings_out, \
+            open(os.path.join(output_dir, 'merged.variant.csv'), 'wb') as merged_out:
+        parents_out.write(vcf_header(contigs, ['F', 'M']).encode())
+        offsprings_out.write(vcf_header(contigs, samples).encode())
+
+        for chrom, length in contigs:
+            positions, ref, alt, _, parent_gt, offspring_gt = simulate_chromosome(
+                length, offspring, snp_density, proportions, cm_per_mb, rng)
+            n_sites += len(positions)
+
+            for start in range(0, len(positions), BLOCK_SIZE):
+                block = slice(start, start + BLOCK_SIZE)
+                parents_obs, parents_dp = observe(parent_gt[block], parent_depth, 0, 0, rng)
+                offspring_obs, offspring_dp = observe(offspring_gt[block], offspring_depth, missing_rate, error_rate, rng)
+                parent_cells = genotype_cells(parents_obs, '\t', parents_dp)
+                offspring_cells = genotype_cells(offspring_obs, '\t', offspring_dp)
+
+                # 与 parents_vcf_filter.py 和 offsprings_vcf_filter.py 相同的过滤
+                parent_pass = ((parents_dp >= parent_min_dp).all(axis=1) &
+                               ~((parents_obs != 1).all(axis=1)) & (parents_obs != MISSING_GT).all(axis=1))
+                masked = np.where(offspring_dp < offspring_min_dp, MISSING_GT, offspring_obs)
+                merged_parent_cells = genotype_cells(parents_obs, ';')
+                merged_offspring_cells = genotype_cells(masked, ';')
+
+                for row, position in enumerate(positions[block]):
+                    prefix = f'{chrom}\t{position}\t.\t{ref[start + row]}\t{alt[start + row]}\t50\tPASS\t.\tGT:DP\t'.encode()
+                    parents_out.write(prefix)
+                    parents_out.write(parent_cells[row].tobytes())
+                    offsprings_out.write(prefix)
+                    offsprings_out.write(offspring_cells[row].tobytes())
+                    if parent_pass[row]:
+                        merged_out.write(f'{chrom};{position};{ref[start + row]};{alt[start + row]};'.encode())
+                        merged_out.write(merged_parent_cells[row, :-1].tobytes() + b';')
+                        merged_out.write(merged_offspring_cells[row].tobytes())
+
+    with open(os.path.join(output_dir, 'samples_header.txt'), 'w') as f:
+        f.writelines(f'{sample}\n' for sample in samples)
+    with open(os.path.join(output_dir, 'chromosome_ids.txt'), 'w') as f:
+        f.writelines(f'{chrom}\n' for chrom, _ in contigs)
+    return n_sites
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate a heterozygous F1 cross as parent/offspring VCFs and pipeline input files.')
+    parser.add_argument('output_dir', help='Directory for the simulated files.')
+    parser.add_argument('--offspring', type=int, default=100, help='Number of offspring (default: 100).')
+    parser.add_argument('--chromosomes', type=int, default=2, help='Number of chromosomes (default: 2).')
+    parser.add_argument('--chromosome-length', type=int, default=1000000, help='Length of each chromosome in bp (default: 1000000).')
+    parser.add_argument('--snp-density', type=float, default=5.0, help='SNPs per kb (default: 5).')
+    parser.add_argument('--missing-rate', type=float, default=0.05, help='Fraction of missing offspring genotypes (default: 0.05).')
+    parser.add_argument('--error-rate', type=float, default=0.01, help='Fraction of wrong offspring genotypes (default: 0.01).')
+    parser.add_argument('--cm-per-mb', type=float, default=3.0, help='Recombination rate in cM/Mb (default: 3).')
+    parser.add_argument('--parent-depth', type=float, default=20, help='Mean parent read depth (default: 20).')
+    parser.add_argument('--offspring-depth', type=float, default=10, help='Mean offspring read depth (default: 10).')
+    parser.add_argument('--proportions', type=float, nargs=4, default=list(DEFAULT_PROPORTIONS),
+                        metavar=('LMXLL', 'NNXNP', 'HKXHK', 'AAXBB'),
+                        help='Proportions of the site classes (default: 0.35 0.35 0.2 0.1).')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1).')
+    args = parser.parse_args()
+
+    n_sites = simulate_f1(args.output_dir, args.offspring, args.chromosomes, args.chromosome_length, args.snp_density,
+                          args.missing_rate, args.error_rate, args.cm_per_mb, args.parent_depth, args.offspring_depth,
+                          proportions=args.proportions, seed=args.seed)
+    print(f"模拟完成：{args.offspring} 个子代，{n_sites} 个位点，结果已保存至: {args.output_dir}")
+
+if __name__ == '__main__':
+    main()
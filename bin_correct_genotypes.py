@@ -1,84 +1,193 @@
 import csv
-import sys
-from collections import Counter
+import argparse
+import numpy as np
+import pandas as pd
+import genotype_store
+import metrics
+
+# 默认的六轮校正：(窗口大小, 允许的最大差异数)
+CORRECTION_SCHEDULE = [(5, 1), (7, 2), (9, 3), (11, 4), (13, 5), (15, 5)]
+
+MISSING = '--'
+
+def encode_rows(data):
+    """
+    将表头和数据行的第3列起编码为整数矩阵（第1行为表头），返回 (编码矩阵, 编码表)。
+    只在表头中出现的值合并为同一个编码：每列只有一个表头值，合并不影响按列的统计。
+    """
+    values = np.array([row[2:] for row in data], dtype=object).reshape(len(data), -1)
+    codes, classes = pd.factorize(values.ravel())
+    codes = codes.reshape(values.shape)
+    classes = list(classes)
+
+    header_only = np.ones(len(classes), dtype=bool)
+    header_only[np.unique(codes[1:])] = False
+    if header_only.any():
+        remap = np.arange(len(classes))
+        header_code = int(np.flatnonzero(header_only)[0])
+        remap[header_only] = header_code
+        kept = np.unique(remap)
+        codes = np.searchsorted(kept, remap[codes])
+        classes = [classes[i] for i in kept]
+    return codes, classes
+
+def encode_store(store):
+    """
+    与 encode_rows 相同的编码矩阵，直接由二进制存储的 int8 编码得到：
+    编码表为存储的编码表，之后是空值（编码 -1）和表头（第1行，各列的样本名合并为一个编码）。
+    只取第3列起，即第2个基因型列起的各列。
+    """
+    codes = np.asarray(store.codes[:, 1:], dtype=np.int64)
+    empty_code, header_code = len(store.alleles), len(store.alleles) + 1
+    codes = np.vstack([np.full((1, codes.shape[1]), header_code), np.where(codes < 0, empty_code, codes)])
+    return codes, list(store.alleles) + ['', None]
+
+def next_occurrence(mask):
+    """每一行向下（含本行）第一个 mask 为真的行号，没有时为行数"""
+    n_rows = mask.shape[0]
+    index = np.where(mask, np.arange(n_rows)[:, None], n_rows)
+    return np.minimum.accumulate(index[::-1], axis=0)[::-1]
+
+def correct_codes(codes, window_size, max_differences, type_codes, missing_code):
+    """
+    对编码矩阵执行一轮校正（第1行为表头，不校正），与 perform_correction 的规则相同：
+    窗口为当前行及其前 window_size - 1 行（含表头），去掉缺失值后首尾基因型一致，
+    且非最多基因型的个数不超过 max_differences 时，将当前值改为窗口内最多的基因型（个数相同时取先出现的）。
+    每种基因型按列的前缀和使每个窗口的计数为常数时间，所有样本一次计算。
+    """
+    n_rows, n_samples = codes.shape
+    n_classes = int(codes.max()) + 1 if codes.size else 0
+    rows = np.arange(n_rows)
+    starts = np.maximum(0, rows - window_size + 1)
+    columns = np.arange(n_samples)[None, :]
+
+    # 每种基因型在窗口内的个数，以及在窗口内第一次出现的行号
+    counts = np.zeros((n_classes, n_rows, n_samples), dtype=np.int64)
+    first_seen = np.empty((n_classes, n_rows, n_samples), dtype=np.int64)
+    for code in range(n_classes):
+        is_code = codes == code
+        prefix = np.zeros((n_rows + 1, n_samples), dtype=np.int64)
+        np.cumsum(is_code, axis=0, out=prefix[1:])
+        counts[code] = prefix[rows + 1] - prefix[starts]
+        first_seen[code] = next_occurrence(is_code)[starts]
+
+    if missing_code is not None and missing_code < n_classes:
+        counts[missing_code] = 0
+        first_seen[missing_code] = n_rows
+    non_missing = counts.sum(axis=0)
+
+    # 最多的基因型：个数最多，个数相同时取窗口内先出现的
+    most_common_count = counts.max(axis=0)
+    tie_order = np.where(counts == most_common_count[None], first_seen, n_rows + 1)
+    most_common = tie_order.argmin(axis=0)
+
+    # 窗口内第一个非缺失值；最后一个非缺失值即当前值（只校正非缺失的基因型）
+    if missing_code is not None:
+        first_row = next_occurrence(codes != missing_code)[starts]
+    else:
+        first_row = np.broadcast_to(starts[:, None], codes.shape)
+    first_code = codes[np.minimum(first_row, n_rows - 1), columns]
+
+    correctable = np.isin(codes, type_codes) & (first_code == codes) & \
+        (non_missing - most_common_count <= max_differences)
+    correctable[0] = False
+    return np.where(correctable, most_common, codes)
 
 # 辅助函数：执行一轮校正
 def perform_correction(data, window_size, max_differences, genotype_types):
-    num_columns = len(data[0])  # 样品数
-    corrected_data = [data[0]]  # 保留表头
-
-    for row_index in range(1, len(data)):
-        corrected_row = data[row_index][:2]  # 保留样本ID和位点ID
-        for col_index in range(2, num_columns):
-            genotype = data[row_index][col_index]
-            # 仅对指定的基因型进行校正
-            if genotype in genotype_types:
-                # 选取当前样品的当前列
-                group = [data[i][col_index] for i in range(max(0, row_index - window_size + 1), min(len(data), row_index + 1))]
-                
-                # 过滤掉缺失值（--）
-                non_missing_genotypes = [g for g in group if g != '--']
-                
-                if len(non_missing_genotypes) > 0:
-                    first_genotype = non_missing_genotypes[0]
-                    last_genotype = non_missing_genotypes[-1]
-
-                    # 仅当首尾基因型一致时才继续校正
-                    if first_genotype == last_genotype:
-                        # 统计每个基因型的出现次数
-                        genotype_counts = Counter(non_missing_genotypes)
-                        most_common_genotype, most_common_count = genotype_counts.most_common(1)[0]
-
-                        # 如果不同基因型或缺失值数量小于等于max_differences，则进行校正
-                        if len(non_missing_genotypes) - most_common_count <= max_differences:
-                            corrected_row.append(most_common_genotype)
-                        else:
-                            corrected_row.append(data[row_index][col_index])
-                    else:
-                        corrected_row.append(data[row_index][col_index])
-                else:
-                    corrected_row.append('--')
-            else:
-                corrected_row.append(data[row_index][col_index])
-
-        corrected_data.append(corrected_row)
-    
+    return run_schedule(data, [(window_size, max_differences)], genotype_types)
+
+def correct_schedule(codes, classes, schedule, genotype_types):
+    """对编码矩阵按 schedule 依次执行各轮校正"""
+    type_codes = [classes.index(genotype) for genotype in genotype_types if genotype in classes]
+    missing_code = classes.index(MISSING) if MISSING in classes else None
+    for window_size, max_differences in schedule:
+        codes = correct_codes(codes, window_size, max_differences, type_codes, missing_code)
+    return codes
+
+def run_schedule(data, schedule, genotype_types):
+    """按 schedule 依次执行各轮校正；前两列（区间位置和第一个样本）保持不变"""
+    if len(data) < 2 or len(data[0]) <= 2:
+        return data
+    codes, classes = encode_rows(data)
+    codes = correct_schedule(codes, classes, schedule, genotype_types)
+
+    lookup = np.array(classes, dtype=object)
+    corrected = lookup[codes]
+    corrected_data = [data[0]]
+    for row, values in zip(data[1:], corrected[1:]):
+        corrected_data.append(list(row[:2]) + values.tolist())
     return corrected_data
 
+def correct_store(input_path, output_path, schedule, genotype_types, chrom=None, parent_type=None):
+    """
+    二进制存储的校正：编码矩阵直接由存储得到，校正后的编码直接写出，不还原为字符串。
+    返回行数。
+    """
+    store = genotype_store.read_store(input_path)
+    codes = np.array(store.codes)
+    if len(codes) >= 1 and codes.shape[1] > 1:
+        corrected, classes = encode_store(store)
+        corrected = correct_schedule(corrected, classes, schedule, genotype_types)[1:]
+        # 空值还原为 -1；表头编码只出现在第1行，校正不会把它写入数据行
+        codes[:, 1:] = np.where(corrected == classes.index(''), genotype_store.MISSING_CODE, corrected)
+    genotype_store.write_codes(output_path, codes, store.alleles, store.positions, store.metadata['position_column'],
+                               store.genotype_columns, store.metadata['n_columns'], store.columns,
+                               store.other_columns(), chrom=chrom, parent_type=parent_type)
+    return len(codes)
+
+def parse_schedule(text):
+    """解析 '5:1' 形式的 (窗口大小, 最大差异数)"""
+    window_size, max_differences = text.split(':')
+    return int(window_size), int(max_differences)
+
+# 每种亲本类型需要校正的基因型
+GENOTYPE_TYPES = {'male': ['nn', 'np'], 'female': ['lm', 'll']}
+
+def correct_chromosome(chrom_id, parent_type, fmt='csv', schedule=CORRECTION_SCHEDULE):
+    genotype_types = GENOTYPE_TYPES[parent_type]
+    input_file = f'{chrom_id}.bins.genotype.{parent_type}.csv'
+    output_file = f'{chrom_id}.bins.genotype.{parent_type}.correction.csv'
+
+    with metrics.stage('bin_correct_genotypes', chrom_id, parent_type) as record:
+        if fmt == 'store':
+            n_rows = correct_store(genotype_store.store_path(input_file), genotype_store.store_path(output_file),
+                                   schedule, genotype_types, chrom_id, parent_type)
+            record.add_rows_in(n_rows)
+            record.add_rows_out(n_rows)
+            print(f"{len(schedule)} 轮校正完成，结果已保存至: {output_file}")
+            return
+
+        # 读取输入文件
+        data = list(genotype_store.iter_rows(input_file, fmt))
+        record.add_rows_in(max(len(data) - 1, 0))
+
+        # 执行各轮校正（默认六轮），只输出最后一轮的结果
+        data = run_schedule(data, schedule, genotype_types)
+        with open(output_file, mode='w', newline='') as outfile:
+            writer = csv.writer(outfile, delimiter=';')
+            writer.writerows(data)
+        record.add_rows_out(max(len(data) - 1, 0))
+    print(f"{len(schedule)} 轮校正完成，结果已保存至: {output_file}")
+
 # 主函数：处理所有染色体文件
-def main(chromosome_file, parent_type):
+def main(chromosome_file, parent_type, fmt='csv', schedule=CORRECTION_SCHEDULE):
     with open(chromosome_file, 'r') as chrom_file:
         chromosome_ids = chrom_file.read().splitlines()
 
-    if parent_type == 'male':
-        genotype_types = ['nn', 'np']
-    elif parent_type == 'female':
-        genotype_types = ['lm', 'll']
-    else:
+    if parent_type not in GENOTYPE_TYPES:
         raise ValueError("亲本类型只能是 'male' 或 'female'")
 
     for chrom_id in chromosome_ids:
-        input_file = f'{chrom_id}.bins.genotype.{parent_type}.csv'
-        output_file = f'{chrom_id}.bins.genotype.{parent_type}.correction.csv'
-
-        # 读取输入文件
-        with open(input_file, mode='r') as infile:
-            reader = csv.reader(infile, delimiter=';')
-            data = [row for row in reader]
-
-        # 执行六轮校正
-        for round_num, (window_size, max_differences) in enumerate([(5, 1), (7, 2), (9, 3), (11, 4), (13, 5), (15, 5)], start=1):
-            data = perform_correction(data, window_size, max_differences, genotype_types)
-            if round_num == 6:  # 仅在第六轮校正后输出结果
-                with open(output_file, mode='w', newline='') as outfile:
-                    writer = csv.writer(outfile, delimiter=';')
-                    writer.writerows(data)
-                print(f"第六轮校正完成，结果已保存至: {output_file}")
+        correct_chromosome(chrom_id, parent_type, fmt, schedule)
 
 if __name__ == '__main__':
-    if len(sys.argv) != 3:
-        print("Usage: python correct_genotypes.py <chromosome_file> <parent_type>")
-    else:
-        chromosome_file = sys.argv[1]
-        parent_type = sys.argv[2]
-        main(chromosome_file, parent_type)
+    parser = argparse.ArgumentParser(description="Correct bin genotypes with six rounds of sliding-window smoothing.")
+    parser.add_argument('chromosome_file', type=str, help="Path to the text file containing chromosome IDs.")
+    parser.add_argument('parent_type', type=str, help="Parent type: 'male' or 'female'.")
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help="Input and output format (default: csv).")
+    parser.add_argument('--schedule', type=parse_schedule, nargs='+', default=CORRECTION_SCHEDULE,
+                        help="Correction rounds as WINDOW:MAX_DIFFERENCES (default: 5:1 7:2 9:3 11:4 13:5 15:5).")
+
+    args = parser.parse_args()
+    main(args.chromosome_file, args.parent_type, args.format, args.schedule)
@@ -2,94 +2,150 @@ import argparse
 import os
 import pandas as pd
 import numpy as np
+import genotype_store
+import metrics
 
-def process_intervals(input_file, output_file, step_size, max_interval, parent_type):
-    # 1. 读取输入文件，使用 `;` 作为分隔符
-    data = pd.read_csv(input_file, sep=';')
-
-    # 2. 建立区间
-    intervals = list(range(0, max_interval + step_size, step_size))
-
-    # 这里我们创建一个列表来保存结果
-    results = []
-
-    # 3. 遍历区间，处理数据
-    for i in range(len(intervals) - 1):
-        start = intervals[i]
-        end = intervals[i + 1]
-        
-        # 选择在当前区间内的行
-        mask = (data.iloc[:, 1] >= start) & (data.iloc[:, 1] < end)
-        segment = data[mask]
-        
-        # 如果区间内没有数据，跳过该区间
-        if segment.empty:
-            continue
-        
-        # 初始化计数器
-        count_1 = np.zeros(segment.shape[1] - 2)
-        count_2 = np.zeros(segment.shape[1] - 2)
-        
-        # 4. 统计 nn 和 np 或 ll 和 lm 的个数
-        for col in range(2, segment.shape[1]):
-            if parent_type == 'male':
-                count_1[col - 2] = (segment.iloc[:, col] == 'nn').sum()
-                count_2[col - 2] = (segment.iloc[:, col] == 'np').sum()
-            elif parent_type == 'female':
-                count_1[col - 2] = (segment.iloc[:, col] == 'll').sum()
-                count_2[col - 2] = (segment.iloc[:, col] == 'lm').sum()
-        
-        # 计算比例
-        total_count = count_1 + count_2
-        with np.errstate(divide='ignore', invalid='ignore'):
-            ratio_1 = np.where(total_count != 0, count_1 / total_count, 0)
-            ratio_2 = np.where(total_count != 0, count_2 / total_count, 0)
-        
-        # 5. 根据比例判断结果
-        conditions = [
-            ratio_1 >= 0.51,
-            ratio_2 >= 0.51
-        ]
-        choices = ['nn' if parent_type == 'male' else 'll', 
-                   'np' if parent_type == 'male' else 'lm']
-        result = np.select(conditions, choices, default="--")
-        
-        # 将区间起始数值作为新的第一元素并加入结果
-        interval_results = [start] + result.tolist()
-        results.append(interval_results)
-
-    # 6. 写入结果到 CSV 文件
-    max_cols = max(len(r) for r in results)
-    columns = ['Interval_Start'] + [f'Result_{i}' for i in range(1, max_cols)]
-    result_df = pd.DataFrame(results, columns=columns)
-    result_df.to_csv(output_file, index=False, sep=';')
+# 每种亲本类型的两种基因型
+GENOTYPE_CLASSES = {'male': ('nn', 'np'), 'female': ('ll', 'lm')}
+
+def bin_counts(positions, genotypes, step_size, parent_type):
+    """
+    一次计算所有区间的计数：位置整除区间大小得到区间序号，按区间序号排序后分段求和。
+    返回 (有数据的区间序号, 第一种基因型计数, 第二种基因型计数)，计数为 区间 × 样本 的矩阵。
+    """
+    if parent_type in GENOTYPE_CLASSES:
+        class1, class2 = GENOTYPE_CLASSES[parent_type]
+        is_1, is_2 = genotypes == class1, genotypes == class2
+    else:
+        is_1 = is_2 = np.zeros(np.shape(genotypes), dtype=bool)
+    return bin_mask_counts(positions, is_1, is_2, step_size)
+
+def bin_mask_counts(positions, is_1, is_2, step_size):
+    """与 bin_counts 相同，输入为两种基因型的布尔矩阵（可由二进制存储的 int8 编码直接得到）"""
+    bins = np.asarray(positions, dtype=np.int64) // step_size
+    order = np.argsort(bins, kind='stable')
+    bins = bins[order]
+    if len(bins) == 0:
+        empty = np.zeros((0, is_1.shape[1]))
+        return bins, empty, empty
+
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]])
+    count_1 = np.add.reduceat(is_1[order].astype(np.int64), starts, axis=0).astype(float)
+    count_2 = np.add.reduceat(is_2[order].astype(np.int64), starts, axis=0).astype(float)
+    return bins[starts], count_1, count_2
+
+def bin_call_codes(count_1, count_2, majority=0.51):
+    """对所有区间同时按多数规则判定：某一基因型的比例不低于 majority 时为 1 或 2，否则为 0（--）"""
+    total_count = count_1 + count_2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio_1 = np.where(total_count != 0, count_1 / total_count, 0)
+        ratio_2 = np.where(total_count != 0, count_2 / total_count, 0)
+
+    conditions = [
+        ratio_1 >= majority,
+        ratio_2 >= majority
+    ]
+    return np.select(conditions, [1, 2], default=0).astype(np.int8)
+
+def bin_alleles(parent_type):
+    """bin_call_codes 的编码表：0 为 --，1、2 为两种基因型"""
+    return ['--', 'nn' if parent_type == 'male' else 'll', 'np' if parent_type == 'male' else 'lm']
+
+def call_bins(count_1, count_2, parent_type, majority=0.51):
+    """与 bin_call_codes 相同，结果为基因型字符串"""
+    return np.array(bin_alleles(parent_type), dtype=object)[bin_call_codes(count_1, count_2, majority)]
+
+def process_intervals(input_file, output_file, step_size, max_interval, parent_type, fmt='csv', majority=0.51,
+                      record=None):
+    if fmt == 'store':
+        process_store_intervals(input_file, output_file, step_size, max_interval, parent_type, majority, record)
+        return
+
+    # 1. 读取输入文件（只读取一次）；max_interval 为 None 时取最大位置
+    data = genotype_store.read_frame(input_file, fmt)
+    positions = data.iloc[:, 1].to_numpy(dtype=np.int64)
+    genotypes = data.iloc[:, 2:].to_numpy(dtype=object)
+
+    # 2. 只保留不超过 max_interval 所在区间的位点
+    if max_interval is not None:
+        keep = positions // step_size <= max_interval // step_size
+        positions = positions[keep]
+        genotypes = genotypes[keep]
+
+    # 3. 统计每个区间每个样本中 nn 和 np 或 ll 和 lm 的个数，没有数据的区间不输出
+    bins, count_1, count_2 = bin_counts(positions, genotypes, step_size, parent_type)
+
+    # 4. 根据比例判断结果
+    result = call_bins(count_1, count_2, parent_type, majority)
+
+    # 5. 区间起始数值作为第一列，写入结果文件
+    columns = ['Interval_Start'] + [f'Result_{i}' for i in range(1, genotypes.shape[1] + 1)]
+    result_df = pd.DataFrame(result, columns=columns[1:])
+    result_df.insert(0, 'Interval_Start', bins * step_size)
+    genotype_store.write_frame(result_df, output_file, fmt, (1, None), 0, parent_type=parent_type)
+    if record is not None:
+        record.add_rows_in(len(data))
+        record.add_rows_out(len(result_df))
 
     print(f'Results written to {output_file}')
 
-def process_chromosomes(chrom_ids_file, parent_type, bin_size):
-    with open(chrom_ids_file, mode='r') as infile:
-        chrom_ids = [line.strip() for line in infile.readlines()]
+def process_store_intervals(input_file, output_file, step_size, max_interval, parent_type, majority=0.51, record=None):
+    """二进制存储的 process_intervals：计数和判定都在 int8 编码上进行，结果直接以编码写出"""
+    store = genotype_store.read_store(genotype_store.store_path(input_file))
+    positions = np.asarray(store.positions, dtype=np.int64)
+    class1, class2 = GENOTYPE_CLASSES[parent_type]
+    # 与 CSV 相同：位置列之后的每一列都作为一个样本，基因型列以外的列（如 MNP_maker_filter.py 追加的计数列）判定为 --
+    start, stop = store.genotype_columns
+    width = max(store.metadata['n_columns'] - 2, 0)
+    is_1 = np.zeros((len(positions), width), dtype=bool)
+    is_2 = np.zeros((len(positions), width), dtype=bool)
+    is_1[:, start - 2:stop - 2] = store.genotype_mask(class1)
+    is_2[:, start - 2:stop - 2] = store.genotype_mask(class2)
 
-    for chrom_id in chrom_ids:
-        input_file = f"{chrom_id}.MNP.genotype.swap.{parent_type}.csv"
-        output_file = f"{chrom_id}.bins.genotype.{parent_type}.csv"
+    if max_interval is not None:
+        keep = positions // step_size <= max_interval // step_size
+        positions, is_1, is_2 = positions[keep], is_1[keep], is_2[keep]
+
+    bins, count_1, count_2 = bin_mask_counts(positions, is_1, is_2, step_size)
+    codes = bin_call_codes(count_1, count_2, majority)
+    n_samples = is_1.shape[1]
+    columns = ['Interval_Start'] + [f'Result_{i}' for i in range(1, n_samples + 1)]
+    genotype_store.write_codes(genotype_store.store_path(output_file), codes, bin_alleles(parent_type),
+                               bins * step_size, 0, (1, n_samples + 1), n_samples + 1, columns,
+                               parent_type=parent_type)
+    if record is not None:
+        record.add_rows_in(len(store.positions))
+        record.add_rows_out(len(bins))
+
+    print(f'Results written to {output_file}')
+
+def bin_chromosome(chrom_id, parent_type, bin_size, fmt='csv', majority=0.51):
+    input_file = f"{chrom_id}.MNP.genotype.swap.{parent_type}.csv"
+    output_file = f"{chrom_id}.bins.genotype.{parent_type}.csv"
+
+    if not os.path.exists(genotype_store.data_path(input_file, fmt)):
+        print(f"文件 {input_file} 不存在，跳过该染色体。")
+        return
 
-        if not os.path.exists(input_file):
-            print(f"文件 {input_file} 不存在，跳过该染色体。")
-            continue
+    # 调用处理函数，区间范围由位点的最大位置决定
+    with metrics.stage('bin_maker_genotype', chrom_id, parent_type) as record:
+        process_intervals(input_file, output_file, bin_size, None, parent_type, fmt, majority, record)
 
-        # 读取数据文件获取最大区间
-        data = pd.read_csv(input_file, sep=';')
-        max_interval = data.iloc[:, 1].max()
+def process_chromosomes(chrom_ids_file, parent_type, bin_size, fmt='csv', majority=0.51):
+    with open(chrom_ids_file, mode='r') as infile:
+        chrom_ids = [line.strip() for line in infile.readlines()]
 
-        # 调用处理函数
-        process_intervals(input_file, output_file, bin_size, max_interval, parent_type)
+    for chrom_id in chrom_ids:
+        bin_chromosome(chrom_id, parent_type, bin_size, fmt, majority)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Process genotype intervals from a CSV file and output results.")
     parser.add_argument('chrom_ids_file', type=str, help="Path to the text file containing chromosome IDs.")
     parser.add_argument('parent_type', type=str, choices=['male', 'female'], help="The parent type, either 'male' or 'female'.")
     parser.add_argument('bin_size', type=int, help="The bin size for interval processing.")
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help="Input and output format (default: csv).")
+    parser.add_argument('--majority', type=float, default=0.51,
+                        help="Minimum fraction of called markers in a bin that one genotype needs to be assigned to the bin (default: 0.51).")
     
     args = parser.parse_args()
-    process_chromosomes(args.chrom_ids_file, args.parent_type, args.bin_size)
+    process_chromosomes(args.chrom_ids_file, args.parent_type, args.bin_size, args.format, args.majority)
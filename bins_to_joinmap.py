@@ -0,0 +1,144 @@
+import argparse
+import os
+from openpyxl import load_workbook
+import genotype_store
+
+# 各群体类型下基因型的写法：BC1 按回交群体编码（纯合 a，杂合 h），CP 保留原始基因型
+POPULATION_CODES = {
+    'BC1': {'nn': 'a', 'np': 'h', 'll': 'a', 'lm': 'h'},
+    'CP': {},
+}
+
+# CP 群体中已定向标记的连锁相（与 2021A_CP.loc.xlsx 相同的写法）
+PHASES = {'<nnxnp>': '{-1}', '<lmxll>': '{1-}'}
+
+# 写文件时每次批量写出的行数
+WRITE_BLOCK = 10000
+
+def write_lines(outfile, lines):
+    """按块批量写出行"""
+    for start in range(0, len(lines), WRITE_BLOCK):
+        outfile.write('\n'.join(lines[start:start + WRITE_BLOCK]) + '\n')
+
+def iter_correction_markers(chrom_ids, parent_type, fmt='csv'):
+    """
+    逐个读取各染色体的 *.bins.genotype.<parent>.correction.csv，
+    依次返回 (染色体, 区间起始位置, 分离类型, 基因型列表)。
+    """
+    segregation_type = genotype_store.SEGREGATION_TYPES[parent_type]
+    for chrom_id in chrom_ids:
+        input_file = f'{chrom_id}.bins.genotype.{parent_type}.correction.csv'
+        if not os.path.exists(genotype_store.data_path(input_file, fmt)):
+            print(f"文件 {input_file} 不存在，跳过该染色体。")
+            continue
+        reader = genotype_store.iter_rows(input_file, fmt)
+        next(reader, None)  # 跳过表头
+        for row in reader:
+            yield chrom_id, row[0], segregation_type, row[1:]
+
+def iter_workbook_markers(input_file):
+    """
+    以只读方式逐行读取 output_to_xlsx.py 输出的工作簿（每个染色体一个工作表，
+    第1列为区间位置，第2列为分离类型，第3列起为样本基因型），返回值与 iter_correction_markers 相同。
+    """
+    workbook = load_workbook(input_file, read_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            n_columns = len(header)
+            for row in rows:
+                if all(value is None for value in row):
+                    continue
+                row = tuple(row) + (None,) * (n_columns - len(row))
+                genotypes = ['--' if value is None else str(value) for value in row[2:n_columns]]
+                yield sheet.title, row[0], row[1], genotypes
+    finally:
+        workbook.close()
+
+def write_loc(markers, output_file, popt='BC1', name='population', phase=False):
+    """
+    写出 JoinMap .loc 文件，标记依次命名为 m1、m2……
+    BC1：nn/ll 写为 a，np/lm 写为 h；CP：每个标记写出分离类型（phase 为真时再写出连锁相）和原始基因型。
+    """
+    codes = POPULATION_CODES[popt]
+    lines = []
+    nind = 0
+    for index, (_, _, segregation_type, genotypes) in enumerate(markers, start=1):
+        nind = max(nind, len(genotypes))
+        fields = [f'm{index}']
+        if popt == 'CP':
+            fields.append(segregation_type)
+            if phase:
+                fields.append(PHASES.get(segregation_type, '{--}'))
+        fields.extend(codes.get(genotype, genotype) for genotype in genotypes)
+        lines.append(' '.join(fields))
+
+    with open(output_file, 'w') as file:
+        file.write(f"name = {name}\n")
+        file.write(f"popt = {popt}\n")
+        file.write(f"nloc = {len(lines)}\n")
+        file.write(f"nind = {nind}\n")
+        write_lines(file, lines)
+
+    print(f"转换完成，生成的.loc文件已保存为{output_file}")
+
+def format_position(value, scale):
+    """位置乘以 scale 后写出，去掉多余的小数位"""
+    if scale == 1:
+        return str(value)
+    return f'{float(value) * scale:.6f}'.rstrip('0').rstrip('.')
+
+def write_map(markers, output_file, scale=1e-6):
+    """
+    写出 MapQTL .map 文件：每个染色体一个 group，标记命名与 write_loc 相同，
+    位置为区间起始位置乘以 scale（默认换算为 Mb）。
+    """
+    lines = []
+    current_group = None
+    for index, (group, position, _, _) in enumerate(markers, start=1):
+        if group != current_group:
+            lines.append(f"group {group}")
+            current_group = group
+        lines.append(f"m{index} {format_position(position, scale)}")
+
+    with open(output_file, 'w') as file:
+        write_lines(file, lines)
+
+    print(f"转换完成，生成的.map文件已保存为{output_file}")
+
+def export_bins(chromosome_file, parent_type, loc_file=None, map_file=None, popt='BC1', fmt='csv',
+                scale=1e-6, name='population', phase=False):
+    """由各染色体的校正结果直接写出 .loc 和 .map，每个输入文件只读取一次"""
+    with open(chromosome_file, 'r') as f:
+        chrom_ids = [line.strip() for line in f if line.strip()]
+
+    markers = list(iter_correction_markers(chrom_ids, parent_type, fmt))
+    if loc_file:
+        write_loc(markers, loc_file, popt, name, phase)
+    if map_file:
+        write_map(markers, map_file, scale)
+
+def main():
+    parser = argparse.ArgumentParser(description='Write JoinMap .loc and MapQTL .map files directly from the corrected bin genotypes.')
+    parser.add_argument('chromosome_file', help='Chromosome ID file, e.g. chromosome_ids.txt.')
+    parser.add_argument('parent_type', choices=['male', 'female'], help="Parent type: 'male' or 'female'.")
+    parser.add_argument('--loc', dest='loc_file', help='Output .loc file.')
+    parser.add_argument('--map', dest='map_file', help='Output .map file with physical bin positions.')
+    parser.add_argument('--popt', choices=sorted(POPULATION_CODES), default='BC1', help='Population type (default: BC1).')
+    parser.add_argument('--phase', action='store_true', help='With --popt CP, also write the linkage phase of each marker.')
+    parser.add_argument('--name', default='population', help='Population name written to the .loc file (default: population).')
+    parser.add_argument('--scale', type=float, default=1e-6,
+                        help='Factor applied to bin positions in the .map file (default: 1e-6, i.e. Mb).')
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help='Input format (default: csv).')
+    args = parser.parse_args()
+
+    if not args.loc_file and not args.map_file:
+        parser.error('at least one of --loc and --map is required')
+    export_bins(args.chromosome_file, args.parent_type, args.loc_file, args.map_file, args.popt, args.format,
+                args.scale, args.name, args.phase)
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,41 @@
 import pandas as pd
 import sys
 import argparse
+import metrics
 
 def filter_data(input_file, parent_type):
     """
     Filter genetic data based on parent type.
     """
-    # 读取 CSV 文件
-    data = pd.read_csv(input_file, sep=';', header=None, dtype=str)  # 确保所有数据都作为字符串读取
+    with metrics.stage('filter_by_parent_type', parent_type=parent_type) as record:
+        # 读取 CSV 文件
+        data = pd.read_csv(input_file, sep=';', header=None, dtype=str)  # 确保所有数据都作为字符串读取
 
-    # 根据父本类型选择适当的列
-    if parent_type == 'male':
-        # 父本条件过滤
-        condition = data.iloc[:, 4].str[0] == data.iloc[:, 4].str[2]
-        output_file = 'merged.variant.nnxnp.csv'
-    elif parent_type == 'female':
-        # 母本条件过滤
-        condition = data.iloc[:, 5].str[0] == data.iloc[:, 5].str[2]
-        output_file = 'merged.variant.lmxll.csv'
-    else:
-        print("Error: Invalid parent type. Choose 'male' or 'female'.")
-        sys.exit(1)
+        # 根据父本类型选择适当的列
+        if parent_type == 'male':
+            # 父本条件过滤
+            condition = data.iloc[:, 4].str[0] == data.iloc[:, 4].str[2]
+            output_file = 'merged.variant.nnxnp.csv'
+        elif parent_type == 'female':
+            # 母本条件过滤
+            condition = data.iloc[:, 5].str[0] == data.iloc[:, 5].str[2]
+            output_file = 'merged.variant.lmxll.csv'
+        else:
+            print("Error: Invalid parent type. Choose 'male' or 'female'.")
+            sys.exit(1)
 
-    # 过滤数据
-    filtered_data = data[condition].copy()
+        # 过滤数据
+        filtered_data = data[condition].copy()
+        record.add_rows_in(len(data))
+        record.drop('parent_type', len(data) - len(filtered_data))
+        record.add_rows_out(len(filtered_data))
 
-    # 去除基因型分隔符 '/' 和 '|'
-    filtered_data = filtered_data.replace({'/': '', '\|': ''}, regex=True)  # 使用 '\|' 以避免误解为正则表达式中的 '或' 操作符
+        # 去除基因型分隔符 '/' 和 '|'
+        filtered_data = filtered_data.replace({'/': '', '\|': ''}, regex=True)  # 使用 '\|' 以避免误解为正则表达式中的 '或' 操作符
 
-    # 将处理后的数据保存到最终的 CSV 文件
-    filtered_data.to_csv(output_file, sep=';', header=None, index=False)
-    print(f"Final filtered data saved to {output_file}")
+        # 将处理后的数据保存到最终的 CSV 文件
+        filtered_data.to_csv(output_file, sep=';', header=None, index=False)
+        print(f"Final filtered data saved to {output_file}")
 
 if __name__ == "__main__":
     # 创建解析器
@@ -1,21 +1,42 @@
 import pandas as pd
-import sys
+import argparse
+import metrics
 
-def filter_csv(input_file, output_file, missing_threshold):
-    # 读取 CSV 文件
-    data = pd.read_csv(input_file, sep=',', dtype=str)
+def filter_chunk(data, missing_threshold, record=None):
+    # 计算每行第6列之后（子代基因型）的缺失值个数，并与阈值进行比较
+    missing_counts = (data.iloc[:, 6:].to_numpy() == './.').sum(axis=1)
+    kept = data[missing_counts <= missing_threshold]
+    if record is not None:
+        record.add_rows_in(len(data))
+        record.drop('missing', len(data) - len(kept))
+        record.add_rows_out(len(kept))
+    return kept
 
-    # 根据条件删除行，计算每行第6列之后的缺失值个数，并与阈值进行比较
-    data = data[~data.iloc[:, 6:].apply(lambda x: (x == './.').sum(), axis=1).gt(missing_threshold)]
+def filter_csv(input_file, output_file, missing_threshold, chunksize=None):
+    # merged.variant.csv 以 ';' 分隔且没有表头，所有值按原样作为字符串读取
+    read_options = dict(sep=';', header=None, dtype=str, keep_default_na=False)
 
-    # 将结果保存到新的 CSV 文件
-    data.to_csv(output_file, sep=',', index=False, header=False)
+    with metrics.stage('filtered.merged.variant') as record:
+        if chunksize is None:
+            # 读取整个 CSV 文件
+            data = pd.read_csv(input_file, **read_options)
+            filter_chunk(data, missing_threshold, record).to_csv(output_file, sep=';', index=False, header=False)
+            return
+
+        # 流式模式：按固定行数分块读取，过滤后追加写入，内存占用只取决于块大小
+        with open(output_file, 'w', newline='') as outfile:
+            for chunk in pd.read_csv(input_file, chunksize=chunksize, **read_options):
+                filter_chunk(chunk, missing_threshold, record).to_csv(outfile, sep=';', index=False, header=False)
 
 if __name__ == "__main__":
     # 从命令行获取参数
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    missing_threshold = int(sys.argv[3])
+    parser = argparse.ArgumentParser(description='Filter merged variant sites with too many missing offspring genotypes.')
+    parser.add_argument('input_file', help='The merged variant file, e.g. merged.variant.csv.')
+    parser.add_argument('output_file', help='The filtered output file.')
+    parser.add_argument('missing_threshold', type=int, help='Maximum number of missing (./.) offspring genotypes per site.')
+    parser.add_argument('--chunksize', type=int, default=100000,
+                        help='Number of rows read and filtered at a time (default: 100000); 0 loads the whole file.')
+    args = parser.parse_args()
 
     # 过滤 CSV 文件
-    filter_csv(input_file, output_file, missing_threshold)
+    filter_csv(args.input_file, args.output_file, args.missing_threshold, args.chunksize or None)
@@ -0,0 +1,86 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+# 拟测交（nn×np、lm×ll）群体的隐马尔可夫模型：每个子代在连锁群上的基因型为 A 或 H 两种状态，
+# 相邻位置间以 Haldane 重组率 r 转换，标记处的观测以错误率 error_rate 偏离真实基因型，缺失（--）不提供信息。
+# 前向–后向算法沿位置逐个递推，每一步对所有子代一起计算，得到每个扫描位置（含伪标记）为 A 的条件概率。
+# 基因型按 qtl_scan.encode_calls 编码：1 = A，0 = H，其余为缺失。
+DEFAULT_ERROR_RATE = 1e-4
+
+def haldane_r(distance_cm):
+    """Haldane 作图函数的反函数：cM 转为重组率"""
+    return 0.5 * (1 - np.exp(-2 * np.asarray(distance_cm, dtype=float) / 100))
+
+def emission_probabilities(calls, loci, error_rate):
+    """每个位置每个子代在 A、H 两种状态下的观测概率（位置 × 子代）；伪标记和缺失为 1"""
+    observed = np.where(loci[:, None] >= 0, calls[np.maximum(loci, 0)], -1)
+    emit_a = np.where(observed == 1, 1 - error_rate, np.where(observed == 0, error_rate, 1.0))
+    emit_h = np.where(observed == 1, error_rate, np.where(observed == 0, 1 - error_rate, 1.0))
+    return emit_a, emit_h
+
+def hmm_probabilities(calls, positions, loci, error_rate=DEFAULT_ERROR_RATE):
+    """
+    前向–后向算法：calls 为一个连锁群的标记 × 子代基因型，positions 为扫描位置（cM，递增），
+    loci 为每个位置对应的标记序号（伪标记为 -1，与 qtl_scan.scan_positions 的输出相同）。
+    两种状态的转换矩阵对称，前向和后向各只保存一个归一化后的量。返回为 A 的概率（位置 × 子代）。
+    """
+    emit_a, emit_h = emission_probabilities(calls, loci, error_rate)
+    r = haldane_r(np.diff(positions))[:, None]
+    n_positions, n_individuals = emit_a.shape
+
+    # 前向：forward[t] = P(Q_t = A | 位置 t 及之前的观测)，初始为 0.5
+    forward = np.empty((n_positions, n_individuals))
+    prior = np.full(n_individuals, 0.5)
+    for t in range(n_positions):
+        if t > 0:
+            prior = forward[t - 1] * (1 - r[t - 1]) + (1 - forward[t - 1]) * r[t - 1]
+        weight_a = prior * emit_a[t]
+        forward[t] = weight_a / (weight_a + (1 - prior) * emit_h[t])
+
+    # 后向：backward_a[t] ∝ P(位置 t 之后的观测 | Q_t = A)，与 backward_h 归一化为和为 1
+    probabilities = np.empty_like(forward)
+    backward_a = np.full(n_individuals, 0.5)
+    for t in range(n_positions - 1, -1, -1):
+        if t < n_positions - 1:
+            next_a, next_h = backward_a * emit_a[t + 1], (1 - backward_a) * emit_h[t + 1]
+            stay_a = (1 - r[t]) * next_a + r[t] * next_h
+            stay_h = r[t] * next_a + (1 - r[t]) * next_h
+            backward_a = stay_a / (stay_a + stay_h)
+        weight_a = forward[t] * backward_a
+        probabilities[t] = weight_a / (weight_a + (1 - forward[t]) * (1 - backward_a))
+    return probabilities
+
+def cache_key(map_groups, marker_names, calls, step, method, error_rate):
+    """缓存文件的键：由 .map 内容、基因型、扫描步长和计算方法决定"""
+    digest = hashlib.sha256()
+    digest.update(repr((map_groups, step, method, error_rate if method == 'hmm' else None)).encode())
+    digest.update('\n'.join(marker_names).encode())
+    digest.update(np.ascontiguousarray(calls).tobytes())
+    return digest.hexdigest()[:16]
+
+def cache_paths(cache_dir, key):
+    return os.path.join(cache_dir, f'{key}.positions.csv'), os.path.join(cache_dir, f'{key}.genoprob.npy')
+
+def load_cache(cache_dir, key):
+    """读取缓存的位置表和概率矩阵（内存映射）；没有缓存时返回 None"""
+    positions_file, probabilities_file = cache_paths(cache_dir, key)
+    if not (os.path.exists(positions_file) and os.path.exists(probabilities_file)):
+        return None
+    positions = pd.read_csv(positions_file, sep=';', dtype={'Group': str, 'Locus': str})
+    positions['Locus'] = positions['Locus'].astype(object).where(positions['Locus'].notna(), None)
+    return positions, np.load(probabilities_file, mmap_mode='r')
+
+def store_cache(cache_dir, key, positions, probabilities):
+    """写出位置表和概率矩阵（float32 内存映射 .npy），返回只读的内存映射"""
+    os.makedirs(cache_dir, exist_ok=True)
+    positions_file, probabilities_file = cache_paths(cache_dir, key)
+    output = np.lib.format.open_memmap(probabilities_file + '.tmp', mode='w+', dtype=np.float32,
+                                       shape=probabilities.shape)
+    output[:] = probabilities
+    output.flush()
+    del output
+    os.replace(probabilities_file + '.tmp', probabilities_file)
+    positions.to_csv(positions_file, sep=';', index=False)
+    return np.load(probabilities_file, mmap_mode='r')
@@ -0,0 +1,246 @@
+import csv
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# 二进制基因型存储：每条染色体一个目录，替代各步骤之间传递的 ';' 分隔 CSV
+#   header.json    表头、样本名、分离类型、基因型编码表等元数据
+#   positions.npy  位置（int64）
+#   genotypes.npy  基因型编码（int8，行 × 样本），可用内存映射方式打开
+#   column_<i>.npy 其余非基因型列（如 REF、ALT、计数列），以定长字符串保存
+STORE_VERSION = 1
+STORE_SUFFIX = '.gstore'
+MISSING_CODE = -1
+
+SEGREGATION_TYPES = {'male': '<nnxnp>', 'female': '<lmxll>'}
+
+def store_path(csv_path):
+    """由 CSV 文件名得到对应的存储目录名，例如 chr1.MNP.genotype.male.csv -> chr1.MNP.genotype.male.gstore"""
+    if csv_path.endswith('.csv'):
+        csv_path = csv_path[:-4]
+    return csv_path + STORE_SUFFIX
+
+def data_path(csv_path, fmt):
+    """根据格式返回实际读写的路径"""
+    return store_path(csv_path) if fmt == 'store' else csv_path
+
+def encode_genotypes(values):
+    """将基因型字符串矩阵编码为 int8，返回 (编码矩阵, 编码表)；空值编码为 -1"""
+    flat = pd.Series(np.asarray(values, dtype=object).ravel())
+    codes, alleles = pd.factorize(flat, sort=True)
+    if len(alleles) > np.iinfo(np.int8).max:
+        raise ValueError(f"基因型种类过多（{len(alleles)}），无法使用 int8 编码。")
+    codes = codes.astype(np.int8).reshape(np.shape(values))
+    return codes, [str(allele) for allele in alleles]
+
+def decode_genotypes(codes, alleles, missing=''):
+    """将 int8 编码还原为基因型字符串矩阵；编码 -1 还原为 missing"""
+    lookup = np.array(list(alleles) + [missing], dtype=object)
+    return lookup[np.asarray(codes, dtype=np.int64)]
+
+def allele_code(alleles, genotype):
+    """基因型在编码表中的编码；编码表中没有时追加到 alleles 末尾（写出时重新排序）"""
+    if genotype not in alleles:
+        alleles.append(genotype)
+    return alleles.index(genotype)
+
+def column_strings(values):
+    """非基因型列转为写入存储的字符串，与 DataFrame 列的 fillna('').astype(str) 相同"""
+    return pd.Series(values).fillna('').astype(str).to_numpy()
+
+def write_store(path, frame, genotype_columns, position_column, header=True, chrom=None, parent_type=None):
+    """
+    将一个染色体的数据表写入存储目录。
+    genotype_columns 为基因型列的范围 (start, stop)，position_column 为位置列的序号；
+    header 为 False 时表示对应的 CSV 没有表头行。
+    """
+    n_columns = frame.shape[1]
+    start, stop = genotype_columns
+    if stop is None:
+        stop = n_columns
+
+    # 没有任何列的空文件（例如没有位点的染色体）也写成空存储
+    if position_column < n_columns:
+        positions = pd.to_numeric(frame.iloc[:, position_column]).to_numpy(dtype=np.int64)
+    else:
+        positions = np.zeros(0, dtype=np.int64)
+    codes, alleles = encode_genotypes(frame.iloc[:, start:stop].to_numpy(dtype=object))
+    other_columns = {col: column_strings(frame.iloc[:, col]) for col in range(n_columns)
+                     if col != position_column and not start <= col < stop}
+    columns = [str(column) for column in frame.columns] if header else None
+    write_codes(path, codes, alleles, positions, position_column, (start, stop), n_columns, columns, other_columns,
+                chrom=chrom, parent_type=parent_type)
+
+def write_codes(path, codes, alleles, positions, position_column, genotype_columns, n_columns, columns=None,
+                other_columns=None, chrom=None, parent_type=None):
+    """
+    直接写出已编码的基因型矩阵（int8，-1 为空值），不经过字符串：
+    编码表只保留用到的基因型并按字符串排序，与由字符串编码（encode_genotypes）得到的存储相同。
+    other_columns 为 {列序号: 字符串数组}，包括位置列和基因型列以外的所有列；columns 为 None 表示没有表头。
+    """
+    os.makedirs(path, exist_ok=True)
+    start, stop = genotype_columns
+    codes = np.asarray(codes)
+    used = np.unique(codes[codes != MISSING_CODE]) if codes.size else np.zeros(0, dtype=np.int64)
+    names = sorted({str(alleles[code]) for code in used})
+    if names != list(alleles):
+        remap = np.full(len(alleles) + 1, MISSING_CODE, dtype=np.int8)
+        for code in used:
+            remap[code] = names.index(str(alleles[code]))
+        codes = remap[codes]
+    codes = codes.astype(np.int8, copy=False)
+    alleles = names
+
+    # 非基因型列：取值全部相同的列只在表头中记录一次，其余列按定长字符串保存
+    constant_columns = {}
+    array_columns = []
+    for col, values in sorted((other_columns or {}).items()):
+        values = np.asarray(values, dtype=object).astype(str)
+        if len(values) > 0 and (values == values[0]).all():
+            constant_columns[str(col)] = values[0]
+        else:
+            np.save(os.path.join(path, f'column_{col}.npy'), values.astype(str))
+            array_columns.append(col)
+
+    if chrom is None and '0' in constant_columns and position_column != 0:
+        chrom = constant_columns['0']
+
+    metadata = {
+        'version': STORE_VERSION,
+        'chrom': chrom,
+        'columns': columns,
+        'n_columns': n_columns,
+        'n_rows': int(codes.shape[0]),
+        'position_column': position_column,
+        'genotype_columns': [start, stop],
+        'samples': columns[start:stop] if columns else None,
+        'alleles': alleles,
+        'segregation_type': SEGREGATION_TYPES.get(parent_type),
+        'constant_columns': constant_columns,
+        'array_columns': array_columns,
+    }
+    np.save(os.path.join(path, 'positions.npy'), np.asarray(positions, dtype=np.int64))
+    np.save(os.path.join(path, 'genotypes.npy'), codes)
+    with open(os.path.join(path, 'header.json'), 'w') as header_file:
+        json.dump(metadata, header_file, ensure_ascii=False, indent=1)
+
+class GenotypeStore:
+    """以内存映射方式打开的单条染色体基因型存储"""
+
+    def __init__(self, path, mmap_mode='r'):
+        self.path = path
+        with open(os.path.join(path, 'header.json'), 'r') as header_file:
+            self.metadata = json.load(header_file)
+        if self.metadata['version'] != STORE_VERSION:
+            raise ValueError(f"不支持的存储版本: {self.metadata['version']}")
+        self.positions = np.load(os.path.join(path, 'positions.npy'), mmap_mode=mmap_mode)
+        self.genotypes = np.load(os.path.join(path, 'genotypes.npy'), mmap_mode=mmap_mode)
+        self.alleles = self.metadata['alleles']
+        self.samples = self.metadata['samples']
+        self.segregation_type = self.metadata['segregation_type']
+        self.chrom = self.metadata['chrom']
+        self.mmap_mode = mmap_mode
+
+    @property
+    def columns(self):
+        return self.metadata['columns']
+
+    @property
+    def genotype_columns(self):
+        return tuple(self.metadata['genotype_columns'])
+
+    @property
+    def codes(self):
+        """基因型编码矩阵（int8，行 × 样本，-1 为空值），编码表为 alleles"""
+        return self.genotypes
+
+    def genotype_mask(self, genotype):
+        """等于某一基因型的单元格（布尔矩阵），编码表中没有该基因型时全为 False"""
+        if genotype not in self.alleles:
+            return np.zeros(self.genotypes.shape, dtype=bool)
+        return self.genotypes == self.alleles.index(genotype)
+
+    def other_columns(self):
+        """位置列和基因型列以外的各列，{列序号: 字符串数组}，可直接传给 write_codes"""
+        start, stop = self.genotype_columns
+        return {col: self.column(col) for col in range(self.metadata['n_columns'])
+                if col != self.metadata['position_column'] and not start <= col < stop}
+
+    def column(self, col):
+        """返回任意一列的字符串数组（位置列和基因型列除外）"""
+        constant = self.metadata['constant_columns'].get(str(col))
+        if constant is not None:
+            return np.full(self.metadata['n_rows'], constant, dtype=object)
+        return np.load(os.path.join(self.path, f'column_{col}.npy'), mmap_mode=self.mmap_mode).astype(object)
+
+    def to_frame(self):
+        """还原为与读取 CSV 时相同布局的 DataFrame：位置列为整数，其余列为字符串"""
+        start, stop = self.genotype_columns
+        data = {}
+        genotypes = decode_genotypes(self.genotypes, self.alleles, missing=np.nan)
+        for col in range(self.metadata['n_columns']):
+            if col == self.metadata['position_column']:
+                data[col] = np.asarray(self.positions, dtype=np.int64)
+            elif start <= col < stop:
+                data[col] = genotypes[:, col - start]
+            else:
+                data[col] = self.column(col)
+        frame = pd.DataFrame(data)
+        if self.columns is not None:
+            frame.columns = self.columns
+        return frame
+
+    def rows(self):
+        """还原为字符串列表形式的行（不含表头），与 csv.reader 读取的结果相同"""
+        frame = self.to_frame()
+        return [[str(value) if not pd.isna(value) else '' for value in row] for row in frame.itertuples(index=False)]
+
+def read_store(path, mmap_mode='r'):
+    return GenotypeStore(path, mmap_mode=mmap_mode)
+
+def write_rows(path, headers, rows, genotype_columns, position_column, chrom=None, parent_type=None):
+    """将 csv.writer 形式的行（headers 为 None 表示无表头）写入存储目录"""
+    n_columns = len(headers) if headers is not None else (len(rows[0]) if rows else 0)
+    frame = pd.DataFrame(rows, columns=range(n_columns), dtype=object)
+    if headers is not None:
+        frame.columns = headers
+    write_store(path, frame, genotype_columns, position_column, header=headers is not None,
+                chrom=chrom, parent_type=parent_type)
+
+def iter_rows(csv_path, fmt='csv'):
+    """按行读取一个步骤的输入，与 csv.reader 相同：第一行为表头（CSV 无表头时直接是数据行）"""
+    if fmt == 'store':
+        store = read_store(store_path(csv_path))
+        if store.columns is not None:
+            yield list(store.columns)
+        yield from store.rows()
+    else:
+        with open(csv_path, mode='r', newline='') as infile:
+            yield from csv.reader(infile, delimiter=';')
+
+def write_table_rows(csv_path, fmt, headers, rows, genotype_columns, position_column, chrom=None, parent_type=None):
+    """按格式写出一个步骤的结果：CSV（';' 分隔）或存储目录；headers 为 None 时不写表头"""
+    if fmt == 'store':
+        write_rows(store_path(csv_path), headers, list(rows), genotype_columns, position_column,
+                   chrom=chrom, parent_type=parent_type)
+        return
+    with open(csv_path, mode='w', newline='') as outfile:
+        writer = csv.writer(outfile, delimiter=';')
+        if headers is not None:
+            writer.writerow(headers)
+        writer.writerows(rows)
+
+def read_frame(csv_path, fmt='csv', **read_csv_kwargs):
+    """按格式读取 DataFrame；CSV 使用 pd.read_csv(sep=';')，存储目录直接还原"""
+    if fmt == 'store':
+        return read_store(store_path(csv_path)).to_frame()
+    return pd.read_csv(csv_path, sep=';', **read_csv_kwargs)
+
+def write_frame(frame, csv_path, fmt, genotype_columns, position_column, header=True, chrom=None, parent_type=None):
+    """按格式写出 DataFrame，CSV 与原来的 to_csv(sep=';', index=False) 相同"""
+    if fmt == 'store':
+        write_store(store_path(csv_path), frame, genotype_columns, position_column, header=header,
+                    chrom=chrom, parent_type=parent_type)
+    else:
+        frame.to_csv(csv_path, sep=';', index=False, header=header)
@@ -0,0 +1,172 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+import linkage_matrix
+import metrics
+
+# 连锁群划分：不建立完整的 标记数 × 标记数 LOD 矩阵，而是按 块 × 块 的小块（只算上三角）并行计算两两 LOD，
+# 每块只保留 LOD 不低于最小阈值的边，并在块内把每个连通分量化简为以第一个标记为根的星形（连通性不变），
+# 最后对每个阈值用并查集合并所有块的边。一次计算得到多个 LOD 阈值下的分组，并与物理染色体对照。
+DEFAULT_THRESHOLDS = (3, 4, 5, 6, 7, 8, 9, 10)
+
+# 进程池中各子进程共用的指示矩阵
+_is_a = None
+_called = None
+
+def init_worker(is_a, called):
+    global _is_a, _called
+    _is_a, _called = is_a, called
+
+def tile_links(row_start, column_start, block_size, thresholds):
+    """
+    计算一块（行块 × 列块）标记之间的 LOD，返回 (保留的边数, {阈值: (根, 标记)})。
+    对角块只取 j > i；LOD 与连锁相无关，不需要 free_phase。
+    """
+    rows = slice(row_start, row_start + block_size)
+    columns = slice(column_start, column_start + block_size)
+    _, lod = linkage_matrix.recombination_lod(*linkage_matrix.pair_counts(_is_a, _called, rows, columns))
+    if row_start == column_start:
+        lod = np.triu(lod, k=1)
+    i, j = np.nonzero(lod >= min(thresholds))
+    edge_lod = lod[i, j]
+    i, j = i + row_start, j + column_start
+
+    links = {}
+    for threshold in thresholds:
+        keep = edge_lod >= threshold
+        nodes, inverse = np.unique(np.r_[i[keep], j[keep]], return_inverse=True)
+        if len(nodes) == 0:
+            links[threshold] = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+            continue
+        half = keep.sum()
+        graph = coo_matrix((np.ones(half, dtype=np.int8), (inverse[:half], inverse[half:])), shape=(len(nodes),) * 2)
+        _, labels = connected_components(graph, directed=False)
+        # 每个分量的第一个标记为根，其余标记各连一条到根的边
+        _, first = np.unique(labels, return_index=True)
+        roots = nodes[first][labels]
+        star = roots != nodes
+        links[threshold] = (roots[star], nodes[star])
+    return len(edge_lod), links
+
+def union_find(n, a, b):
+    """
+    向量化的并查集：每一轮把各条边两端的根中编号较大者挂到较小者上（hooking），再压缩路径，
+    直到所有边的两端根相同。返回每个标记的根（分量中编号最小的标记）。
+    """
+    parent = np.arange(n)
+    while True:
+        # 路径压缩：parent 指向根
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+        root_a, root_b = parent[a], parent[b]
+        differ = root_a != root_b
+        if not differ.any():
+            return parent
+        np.minimum.at(parent, np.maximum(root_a, root_b)[differ], np.minimum(root_a, root_b)[differ])
+
+def name_groups(roots, chroms, min_size):
+    """
+    不少于 min_size 个标记的分量为连锁群，按第一个标记的顺序排列，以其中标记最多的染色体命名；
+    同一染色体分为多个群时依次加后缀 _2、_3……。返回每个标记的连锁群名（未分组为 None）。
+    """
+    labels = np.full(len(roots), None, dtype=object)
+    used = {}
+    components, first, sizes = np.unique(roots, return_index=True, return_counts=True)
+    for component in components[np.argsort(first)][sizes[np.argsort(first)] >= min_size]:
+        members = roots == component
+        chrom = pd.Series(chroms[members]).value_counts().index[0]
+        used[chrom] = used.get(chrom, 0) + 1
+        labels[members] = chrom if used[chrom] == 1 else f'{chrom}_{used[chrom]}'
+    return labels
+
+def cross_check(threshold, labels, chroms):
+    """一个阈值下的分组与物理染色体对照：连锁群数、未分组标记、最大群、被拆分的染色体、含多条染色体的群、一致率"""
+    assigned = labels != None
+    table = pd.DataFrame({'group': labels[assigned], 'chrom': chroms[assigned]})
+    groups_per_chrom = table.groupby('chrom')['group'].nunique()
+    chroms_per_group = table.groupby('group')['chrom'].nunique()
+    majority = table.groupby('group')['chrom'].agg(lambda values: values.value_counts().iloc[0]).sum()
+    return {
+        'lod': threshold,
+        'groups': len(chroms_per_group),
+        'unassigned': int((~assigned).sum()),
+        'largest': int(table['group'].value_counts().max()) if len(table) else 0,
+        'split_chromosomes': int((groups_per_chrom > 1).sum()),
+        'mixed_groups': int((chroms_per_group > 1).sum()),
+        'concordance': round(float(majority) / len(table), 4) if len(table) else 0.0,
+    }
+
+def group_markers(chromosome_file, parent_type, output_prefix, fmt='csv', thresholds=DEFAULT_THRESHOLDS,
+                  block_size=linkage_matrix.BLOCK_SIZE, workers=1, min_size=2):
+    """
+    写出：
+      <prefix>.LOD<t>.groups.csv  每个阈值一个文件（chrom、position、group，';' 分隔），可直接用作 marker_order.py --groups
+      <prefix>.grouping.csv       各阈值分组与物理染色体的对照
+    """
+    with open(chromosome_file, 'r') as f:
+        chrom_ids = [line.strip() for line in f if line.strip()]
+    thresholds = sorted(set(thresholds))
+
+    with metrics.stage('linkage_group', parent_type=parent_type) as record:
+        markers, genotypes = linkage_matrix.load_bin_markers(chrom_ids, parent_type, fmt)
+        is_a, called = linkage_matrix.indicator_matrices(genotypes, parent_type)
+        n_markers = len(markers)
+        record.add_rows_in(n_markers)
+
+        starts = range(0, n_markers, block_size)
+        tiles = [(row_start, column_start) for row_start in starts for column_start in starts if column_start >= row_start]
+        links = {threshold: ([], []) for threshold in thresholds}
+        n_edges = 0
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(is_a, called)) as pool:
+            futures = [pool.submit(tile_links, row_start, column_start, block_size, thresholds)
+                       for row_start, column_start in tiles]
+            for future in futures:
+                tile_edges, tile_links_by_threshold = future.result()
+                n_edges += tile_edges
+                for threshold, (roots, nodes) in tile_links_by_threshold.items():
+                    links[threshold][0].append(roots)
+                    links[threshold][1].append(nodes)
+
+        chroms = markers['chrom'].to_numpy(dtype=object)
+        summary = []
+        for threshold in thresholds:
+            a = np.concatenate(links[threshold][0]) if links[threshold][0] else np.zeros(0, dtype=np.int64)
+            b = np.concatenate(links[threshold][1]) if links[threshold][1] else np.zeros(0, dtype=np.int64)
+            labels = name_groups(union_find(n_markers, a, b), chroms, min_size)
+            groups = markers.assign(group=labels)[labels != None]
+            groups.to_csv(f'{output_prefix}.LOD{threshold:g}.groups.csv', sep=';', index=False)
+            summary.append(cross_check(threshold, labels, chroms))
+        record.add_rows_out(n_edges)
+
+    summary = pd.DataFrame(summary)
+    summary.to_csv(f'{output_prefix}.grouping.csv', sep=';', index=False)
+    print(summary.to_string(index=False))
+    print(f"{n_markers} 个标记在 {len(thresholds)} 个 LOD 阈值下的分组完成（LOD ≥ {thresholds[0]:g} 的边 {n_edges} 条），"
+          f"结果已保存至: {output_prefix}.grouping.csv")
+
+def main():
+    parser = argparse.ArgumentParser(description='Group the corrected bins into linkage groups at several LOD thresholds.')
+    parser.add_argument('chromosome_file', help='Chromosome ID file, e.g. chromosome_ids.txt.')
+    parser.add_argument('parent_type', choices=['male', 'female'], help="Parent type: 'male' or 'female'.")
+    parser.add_argument('output_prefix', help='Prefix of the output files (<prefix>.LOD<t>.groups.csv, <prefix>.grouping.csv).')
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help='Input format (default: csv).')
+    parser.add_argument('--lod', dest='thresholds', type=float, nargs='+', default=list(DEFAULT_THRESHOLDS),
+                        help='LOD thresholds (default: 3 4 5 6 7 8 9 10).')
+    parser.add_argument('--block-size', type=int, default=linkage_matrix.BLOCK_SIZE,
+                        help=f'Markers per side of a tile (default: {linkage_matrix.BLOCK_SIZE}).')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of tiles computed in parallel (default: all CPUs).')
+    parser.add_argument('--min-size', type=int, default=2, help='Smallest group reported; smaller groups are left unassigned (default: 2).')
+    args = parser.parse_args()
+
+    group_markers(args.chromosome_file, args.parent_type, args.output_prefix, args.format, args.thresholds,
+                  args.block_size, args.workers, args.min_size)
+
+if __name__ == '__main__':
+    main()
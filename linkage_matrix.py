@@ -0,0 +1,141 @@
+import argparse
+import numpy as np
+import pandas as pd
+import bins_to_joinmap
+import metrics
+
+# 由校正后的 bin 基因型计算所有标记两两之间的重组率和 LOD 值。
+# 拟测交（nn×np 或 lm×ll）群体中每个标记只有两种基因型：第一种记为 A，第二种记为 B，其余（--）为缺失。
+# 标记 i、j 的重组子个数 R = n(A,B) + n(B,A)，有效个体数 N 为两个标记都有基因型的子代个数，
+# 用指示矩阵的矩阵乘积一次算出一块标记与全部标记的 R 和 N，不逐对循环。
+GENOTYPE_CLASSES = {'male': ('nn', 'np'), 'female': ('ll', 'lm')}
+
+# 每次计算的行数：一块需要若干个 块大小 × 标记数 的 float32 矩阵
+BLOCK_SIZE = 1000
+
+def load_bin_markers(chrom_ids, parent_type, fmt='csv'):
+    """
+    读取各染色体的 *.bins.genotype.<parent>.correction.csv，
+    返回标记表（chrom、position 两列）和基因型矩阵（标记 × 子代，字符串）。
+    """
+    chroms, positions, rows = [], [], []
+    for chrom_id, position, _, genotypes in bins_to_joinmap.iter_correction_markers(chrom_ids, parent_type, fmt):
+        chroms.append(chrom_id)
+        positions.append(int(position))
+        rows.append(genotypes)
+    markers = pd.DataFrame({'chrom': chroms, 'position': np.array(positions, dtype=np.int64)})
+    n_samples = max((len(row) for row in rows), default=0)
+    genotypes = np.full((len(rows), n_samples), '--', dtype=object)
+    for index, row in enumerate(rows):
+        genotypes[index, :len(row)] = row
+    return markers, genotypes
+
+def indicator_matrices(genotypes, parent_type):
+    """基因型矩阵转为两个 float32 指示矩阵：is_a 为第一种基因型，called 为两种基因型之一（非缺失）"""
+    class_a, class_b = GENOTYPE_CLASSES[parent_type]
+    genotypes = np.asarray(genotypes, dtype=object)
+    is_a = genotypes == class_a
+    called = is_a | (genotypes == class_b)
+    return is_a.astype(np.float32), called.astype(np.float32)
+
+def pair_counts(is_a, called, rows=slice(None), columns=slice(None)):
+    """
+    rows 中的标记与 columns 中的标记（默认为全部标记）之间的重组子个数和有效个体数：
+        n(A, called) = A_i · C_j，n(A, A) = A_i · A_j，N = C_i · C_j
+        R = n(A_i, C_j) + n(C_i, A_j) - 2 n(A_i, A_j)
+    计数不超过 2^24 时 float32 乘积是精确的整数。
+    """
+    a_rows, c_rows = is_a[rows], called[rows]
+    a_columns, c_columns = is_a[columns], called[columns]
+    both_a = a_rows @ a_columns.T
+    recombinants = a_rows @ c_columns.T
+    recombinants += c_rows @ a_columns.T
+    recombinants -= 2 * both_a
+    informative = c_rows @ c_columns.T
+    return recombinants, informative
+
+def recombination_lod(recombinants, informative, free_phase=False):
+    """
+    重组率 r = R / N 及其相对于 r = 0.5 的 LOD：
+        LOD = N log10(2) + R log10(r) + (N - R) log10(1 - r)
+    free_phase 为真时不区分连锁相，r 取 min(R, N - R) / N（LOD 相同）。没有有效个体时 r = 0.5，LOD = 0。
+    """
+    # 保持输入的浮点精度（pair_counts 的结果为 float32），减少块内临时数组的内存
+    recombinants = np.asarray(recombinants)
+    informative = np.asarray(informative)
+    dtype = np.result_type(recombinants, informative, np.float32)
+    recombinants = recombinants.astype(dtype, copy=False)
+    informative = informative.astype(dtype, copy=False)
+    nonrecombinants = informative - recombinants
+    if free_phase:
+        recombinants = np.minimum(recombinants, nonrecombinants)
+        nonrecombinants = informative - recombinants
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = recombinants / informative
+        r[informative == 0] = 0.5
+        # R log10(r) + (N - R) log10(1 - r)，R = 0 或 N - R = 0 时对应项为 0
+        lod = recombinants * np.log10(r)
+        lod[recombinants == 0] = 0
+        log_term = nonrecombinants * np.log10(1 - r)
+        log_term[nonrecombinants == 0] = 0
+    lod += log_term
+    lod += informative * dtype.type(np.log10(2))
+    np.maximum(lod, 0, out=lod)
+    return r, lod
+
+def linkage_matrices(is_a, called, r_out, lod_out, block_size=BLOCK_SIZE, free_phase=False):
+    """按行块计算重组率和 LOD 矩阵，写入 r_out 和 lod_out（可以是内存映射数组）"""
+    for start in range(0, len(is_a), block_size):
+        rows = slice(start, start + block_size)
+        r, lod = recombination_lod(*pair_counts(is_a, called, rows), free_phase=free_phase)
+        r_out[rows] = r
+        lod_out[rows] = lod
+    return r_out, lod_out
+
+def compute_linkage(chromosome_file, parent_type, output_prefix, fmt='csv', block_size=BLOCK_SIZE, free_phase=False):
+    """
+    写出：
+      <prefix>.markers.csv  标记序号、染色体、区间起始位置（矩阵的行列顺序）
+      <prefix>.rf.npy       重组率矩阵（float32）
+      <prefix>.lod.npy      LOD 矩阵（float32）
+    两个矩阵以内存映射方式逐块写出，可用 np.load(..., mmap_mode='r') 读取。
+    """
+    with open(chromosome_file, 'r') as f:
+        chrom_ids = [line.strip() for line in f if line.strip()]
+
+    with metrics.stage('linkage_matrix', parent_type=parent_type) as record:
+        markers, genotypes = load_bin_markers(chrom_ids, parent_type, fmt)
+        is_a, called = indicator_matrices(genotypes, parent_type)
+        n_markers = len(markers)
+        record.add_rows_in(n_markers)
+
+        markers.to_csv(f'{output_prefix}.markers.csv', sep=';', index_label='marker')
+        shape = (n_markers, n_markers)
+        r_out = np.lib.format.open_memmap(f'{output_prefix}.rf.npy', mode='w+', dtype=np.float32, shape=shape)
+        lod_out = np.lib.format.open_memmap(f'{output_prefix}.lod.npy', mode='w+', dtype=np.float32, shape=shape)
+        linkage_matrices(is_a, called, r_out, lod_out, block_size, free_phase)
+        r_out.flush()
+        lod_out.flush()
+        del r_out, lod_out
+        record.add_rows_out(n_markers)
+
+    print(f"{n_markers} 个标记的重组率和 LOD 矩阵计算完成，结果已保存至: {output_prefix}.rf.npy, {output_prefix}.lod.npy")
+
+def main():
+    parser = argparse.ArgumentParser(description='Compute pairwise recombination fraction and LOD matrices of the corrected bins.')
+    parser.add_argument('chromosome_file', help='Chromosome ID file, e.g. chromosome_ids.txt.')
+    parser.add_argument('parent_type', choices=['male', 'female'], help="Parent type: 'male' or 'female'.")
+    parser.add_argument('output_prefix', help='Prefix of the output files (<prefix>.markers.csv, <prefix>.rf.npy, <prefix>.lod.npy).')
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help='Input format (default: csv).')
+    parser.add_argument('--block-size', type=int, default=BLOCK_SIZE,
+                        help=f'Number of markers compared with all others at a time (default: {BLOCK_SIZE}).')
+    parser.add_argument('--free-phase', action='store_true',
+                        help='Do not assume coupling phase: r = min(R, N - R) / N.')
+    args = parser.parse_args()
+
+    compute_linkage(args.chromosome_file, args.parent_type, args.output_prefix, args.format, args.block_size,
+                    args.free_phase)
+
+if __name__ == '__main__':
+    main()
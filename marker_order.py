@@ -0,0 +1,225 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy.linalg import eigh
+import bins_to_joinmap
+import linkage_matrix
+import metrics
+
+# 连锁群内标记排序和遗传距离：以相邻标记重组率之和（SARF）为目标，
+# 物理顺序、最近邻和谱排序三个初始顺序分别用 2-opt 和 Or-opt 改进后取 SARF 最小者，最后把相邻重组率换算为 cM，
+# 写出与 xlsx_to_map.py 相同格式的 .map 文件（标记名与 bins_to_joinmap.py 写出的 .loc 一致）。
+
+# 重组率上限：换算遗传距离时 r 接近 0.5 的相邻标记按此值计算
+MAX_RECOMBINATION = 0.499
+
+def kosambi(r):
+    """Kosambi 作图函数，返回 cM"""
+    r = np.minimum(np.asarray(r, dtype=float), MAX_RECOMBINATION)
+    return 25 * np.log((1 + 2 * r) / (1 - 2 * r))
+
+def haldane(r):
+    """Haldane 作图函数，返回 cM"""
+    r = np.minimum(np.asarray(r, dtype=float), MAX_RECOMBINATION)
+    return -50 * np.log(1 - 2 * r)
+
+MAP_FUNCTIONS = {'kosambi': kosambi, 'haldane': haldane}
+
+def path_length(dist, order):
+    """顺序 order 中相邻标记的距离之和"""
+    order = np.asarray(order)
+    return float(dist[order[:-1], order[1:]].sum())
+
+def nearest_neighbour_order(dist, start=0):
+    """从 start 出发，每次走到最近的未访问标记；距离相同时取编号（物理顺序）靠前的标记"""
+    n = len(dist)
+    visited = np.zeros(n, dtype=bool)
+    order = np.empty(n, dtype=np.int64)
+    current = start
+    for index in range(n):
+        order[index] = current
+        visited[current] = True
+        if index + 1 < n:
+            candidates = np.where(visited, np.inf, dist[current])
+            current = int(np.argmin(candidates))
+    return order
+
+def spectral_order(dist, power=4):
+    """
+    谱排序：以 (1 - 2r)^power 为相似度建图，按拉普拉斯矩阵第二小特征向量（Fiedler 向量）的分量排序。
+    一次特征分解就能得到正确的整体走向，避免最近邻在标记密集处来回交错。
+    """
+    n = len(dist)
+    if n < 3:
+        return np.arange(n)
+    weights = np.clip(1 - 2 * dist, 0, 1) ** power
+    laplacian = np.diag(weights.sum(axis=1)) - weights
+    _, vectors = eigh(laplacian, subset_by_index=[1, 1])
+    return np.argsort(vectors[:, 0], kind='stable')
+
+def padded_tour(dist, order):
+    """加入一个到所有标记距离为 0 的虚拟点，把开放路径变成以虚拟点开头的环"""
+    n = len(order)
+    padded = np.zeros((n + 1, n + 1))
+    padded[:n, :n] = dist
+    return padded, np.r_[n, order]
+
+def two_opt_pass(padded, tour):
+    """
+    一轮 2-opt：对每条边一次算出与其后所有边交换（翻转中间一段）的收益，取收益最大者。
+    虚拟点固定在第0位，翻转区间 tour[i+1:j+1] 不会移动它。返回是否有改进。
+    """
+    size = len(tour)
+    improved = False
+    for i in range(size - 2):
+        a, b = tour[i], tour[i + 1]
+        js = np.arange(i + 2, size)
+        c, d = tour[js], tour[(js + 1) % size]
+        gain = padded[a, b] + padded[c, d] - padded[a, c] - padded[b, d]
+        k = int(np.argmax(gain))
+        if gain[k] > 1e-9:
+            j = js[k]
+            tour[i + 1:j + 1] = tour[i + 1:j + 1][::-1].copy()
+            improved = True
+    return improved
+
+def or_opt_pass(padded, tour, max_segment=3):
+    """
+    一轮 Or-opt：把连续 1 到 max_segment 个标记整体移到其他位置（可以反向插入），
+    一次算出插入到每条边的代价，取收益最大者。最近邻顺序中被跳过的标记靠这一步放回原位。
+    """
+    size = len(tour)
+    improved = False
+    for length in range(1, max_segment + 1):
+        start = 1
+        while start + length <= size and size - length >= 3:
+            segment = tour[start:start + length]
+            first, last = segment[0], segment[-1]
+            prev, nxt = tour[start - 1], tour[(start + length) % size]
+            removal_gain = padded[prev, first] + padded[last, nxt] - padded[prev, nxt]
+
+            rest = np.r_[tour[:start], tour[start + length:]]
+            x, y = rest, np.roll(rest, -1)
+            forward = padded[x, first] + padded[last, y]
+            backward = padded[x, last] + padded[first, y]
+            cost = np.minimum(forward, backward) - padded[x, y]
+            k = int(np.argmin(cost))
+            if removal_gain - cost[k] > 1e-9:
+                moved = segment if forward[k] <= backward[k] else segment[::-1]
+                tour[:] = np.r_[rest[:k + 1], moved, rest[k + 1:]]
+                improved = True
+            start += 1
+    return improved
+
+def improve_order(dist, order, max_passes=100):
+    """开放路径的局部搜索：交替进行 2-opt 和 Or-opt，直到一轮中都没有改进"""
+    if len(order) < 3:
+        return np.asarray(order)
+    padded, tour = padded_tour(dist, order)
+    for _ in range(max_passes):
+        improved = two_opt_pass(padded, tour)
+        improved = or_opt_pass(padded, tour) or improved
+        if not improved:
+            break
+    # 虚拟点始终在第0位
+    return tour[1:]
+
+def order_group(is_a, called, positions, map_function='kosambi', max_passes=100):
+    """
+    对一个连锁群的标记排序（标记按物理位置排列），返回 (顺序, 各标记的 cM 位置)。
+    重组率不区分连锁相；几个初始顺序分别改进后取 SARF 最小者，排序后使物理位置整体递增。
+    """
+    n = len(positions)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    r, _ = linkage_matrix.recombination_lod(*linkage_matrix.pair_counts(is_a, called), free_phase=True)
+    dist = r.astype(float)
+
+    # 候选初始顺序：物理顺序、从物理上第一个标记出发的最近邻、谱排序
+    seeds = [np.arange(n), nearest_neighbour_order(dist, 0), spectral_order(dist)]
+    # 每个候选都做局部搜索，取最终 SARF 最小的顺序
+    orders = [improve_order(dist, seed, max_passes) for seed in seeds]
+    order = min(orders, key=lambda candidate: path_length(dist, candidate))
+    if positions[order[0]] > positions[order[-1]]:
+        order = order[::-1]
+
+    steps = MAP_FUNCTIONS[map_function](dist[order[:-1], order[1:]])
+    return order, np.r_[0.0, np.cumsum(steps)]
+
+def order_group_task(group, parent_type, is_a, called, positions, map_function, max_passes):
+    """进程池中对一个连锁群排序，记录运行指标"""
+    with metrics.stage('marker_order', group, parent_type) as record:
+        record.add_rows_in(len(positions))
+        order, cm = order_group(is_a, called, positions, map_function, max_passes)
+        record.add_rows_out(len(order))
+    return order, cm
+
+def load_groups(groups_file, markers):
+    """
+    读取连锁群划分文件（';' 分隔，含 chrom、position、group 三列），返回每个标记所属的连锁群；
+    文件中没有的标记不参与排序。
+    """
+    groups = pd.read_csv(groups_file, sep=';', dtype={'chrom': str, 'group': str})
+    labels = markers.merge(groups[['chrom', 'position', 'group']], on=['chrom', 'position'], how='left')['group']
+    return labels.to_numpy(dtype=object)
+
+def format_cm(value):
+    """cM 位置保留3位小数，去掉多余的0"""
+    return f'{value:.3f}'.rstrip('0').rstrip('.')
+
+def order_markers(chromosome_file, parent_type, output_file, fmt='csv', map_function='kosambi', groups_file=None,
+                  workers=1, max_passes=100):
+    """
+    每个染色体（或 groups_file 中的每个连锁群）一个 group，各组并行排序后写出 .map。
+    标记名 m1、m2…… 按 bins_to_joinmap.py 写出 .loc 的顺序编号，组内按 cM 位置排列。
+    """
+    with open(chromosome_file, 'r') as f:
+        chrom_ids = [line.strip() for line in f if line.strip()]
+
+    markers, genotypes = linkage_matrix.load_bin_markers(chrom_ids, parent_type, fmt)
+    is_a, called = linkage_matrix.indicator_matrices(genotypes, parent_type)
+    labels = load_groups(groups_file, markers) if groups_file else markers['chrom'].to_numpy(dtype=object)
+
+    # 组按第一个标记出现的顺序排列，组内标记保持物理顺序
+    group_names = list(dict.fromkeys(label for label in labels if isinstance(label, str)))
+    members = {group: np.flatnonzero(labels == group) for group in group_names}
+    positions = markers['position'].to_numpy()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {group: pool.submit(order_group_task, group, parent_type, is_a[index], called[index],
+                                      positions[index], map_function, max_passes)
+                   for group, index in members.items()}
+        results = {group: future.result() for group, future in futures.items()}
+
+    lines = []
+    for group in group_names:
+        order, cm = results[group]
+        lines.append(f"group {group}")
+        lines.extend(f"m{members[group][marker] + 1} {format_cm(position)}" for marker, position in zip(order, cm))
+
+    with open(output_file, 'w') as file:
+        bins_to_joinmap.write_lines(file, lines)
+
+    print(f"{len(group_names)} 个连锁群排序完成，生成的.map文件已保存为{output_file}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Order the corrected bins of each linkage group and write a .map file in cM.')
+    parser.add_argument('chromosome_file', help='Chromosome ID file, e.g. chromosome_ids.txt.')
+    parser.add_argument('parent_type', choices=['male', 'female'], help="Parent type: 'male' or 'female'.")
+    parser.add_argument('output_file', help='Output .map file.')
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help='Input format (default: csv).')
+    parser.add_argument('--map-function', choices=sorted(MAP_FUNCTIONS), default='kosambi',
+                        help='Map function used to convert recombination fractions to cM (default: kosambi).')
+    parser.add_argument('--groups', dest='groups_file',
+                        help="';'-separated file with chrom, position and group columns; by default each chromosome is one group.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of groups ordered in parallel (default: all CPUs).')
+    parser.add_argument('--max-passes', type=int, default=100, help='Maximum number of 2-opt/Or-opt passes per group (default: 100).')
+    args = parser.parse_args()
+
+    order_markers(args.chromosome_file, args.parent_type, args.output_file, args.format, args.map_function,
+                  args.groups_file, args.workers, args.max_passes)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import cProfile
+import json
+import os
+import resource
+import time
+import uuid
+from contextlib import contextmanager
+
+# 各步骤共用的运行记录：设置环境变量 BINMAP_METRICS=<文件> 后，每个步骤（及每个染色体）结束时
+# 向该文件追加一行 JSON，包括墙钟时间、CPU 时间、峰值内存、输入/输出行数和各过滤规则去除的行数。
+# 设置 BINMAP_PROFILE=<步骤名> 时对该步骤运行 cProfile，结果写入 BINMAP_PROFILE_DIR（默认当前目录）。
+METRICS_ENV = 'BINMAP_METRICS'
+PROFILE_ENV = 'BINMAP_PROFILE'
+PROFILE_DIR_ENV = 'BINMAP_PROFILE_DIR'
+RUN_ID_ENV = 'BINMAP_RUN_ID'
+
+def run_id():
+    """同一次运行（包括其子进程）共用的编号"""
+    if RUN_ID_ENV not in os.environ:
+        os.environ[RUN_ID_ENV] = time.strftime('%Y%m%d%H%M%S') + '-' + uuid.uuid4().hex[:6]
+    return os.environ[RUN_ID_ENV]
+
+def peak_rss_mb():
+    """当前进程到目前为止的峰值 RSS（Linux 下 ru_maxrss 的单位为 KB）"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class StageRecord:
+    """一个步骤的计数：输入行数、输出行数和各过滤规则去除的行数"""
+
+    def __init__(self, stage, chrom=None, parent_type=None):
+        self.stage = stage
+        self.chrom = chrom
+        self.parent_type = parent_type
+        self.rows_in = 0
+        self.rows_out = 0
+        self.dropped = {}
+
+    def add_rows_in(self, count):
+        self.rows_in += int(count)
+
+    def add_rows_out(self, count):
+        self.rows_out += int(count)
+
+    def drop(self, rule, count):
+        self.dropped[rule] = self.dropped.get(rule, 0) + int(count)
+
+def write_metrics(entry, path=None):
+    """向指标文件追加一行 JSON；未设置指标文件时不写"""
+    path = path or os.environ.get(METRICS_ENV)
+    if not path:
+        return
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+def profile_path(record):
+    parts = [record.stage] + [part for part in (record.chrom, record.parent_type) if part]
+    return os.path.join(os.environ.get(PROFILE_DIR_ENV, '.'), '.'.join(parts) + '.prof')
+
+@contextmanager
+def stage(name, chrom=None, parent_type=None):
+    """
+    记录一个步骤的运行情况：
+        with metrics.stage('MNP_maker_filter', chrom_id, parent_type) as record:
+            record.add_rows_in(...); record.drop('chi_square', ...); record.add_rows_out(...)
+    """
+    record = StageRecord(name, chrom, parent_type)
+    profiler = None
+    if os.environ.get(PROFILE_ENV) == name:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    status = 'ok'
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path(record))
+        write_metrics({
+            'run_id': run_id(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'pid': os.getpid(),
+            'stage': record.stage,
+            'chrom': record.chrom,
+            'parent_type': record.parent_type,
+            'status': status,
+            'wall_s': round(wall, 6),
+            'cpu_s': round(cpu, 6),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+            'rows_in': record.rows_in,
+            'rows_out': record.rows_out,
+            'dropped': record.dropped,
+        })
@@ -1,8 +1,56 @@
 import pysam
-import sys
+import argparse
 import os
+import numpy as np
+import metrics
 
-def process_vcf(vcf_in_path, vcf_out_path, dp_threshold):
+def mask_records(record_lines, dp_threshold):
+    """批量处理一组VCF记录行：将DP小于阈值的样本GT设置为缺失（./.）"""
+    # 按FORMAT列分组，同一FORMAT的记录中DP位于相同的子字段位置
+    split_lines = [line.rstrip('\n').split('\t', 9) for line in record_lines]
+    groups = {}
+    for line_index, fields in enumerate(split_lines):
+        if len(fields) < 10:
+            continue
+        groups.setdefault(fields[8], []).append(line_index)
+
+    masked_lines = list(record_lines)
+    for format_str, line_indices in groups.items():
+        format_keys = format_str.split(':')
+        if 'DP' not in format_keys or format_keys[0] != 'GT':
+            continue
+        dp_index = format_keys.index('DP')
+
+        # 将这一组记录的样本列展开为 记录数 × 样本数 的矩阵
+        cells = np.array([split_lines[i][9].split('\t') for i in line_indices])
+
+        # 拆分出GT子字段和其余子字段
+        partitioned = np.char.partition(cells, ':')
+        gt_sep = partitioned[..., 1]
+        gt_rest = partitioned[..., 2]
+
+        # 提取DP子字段
+        dp_str = cells
+        for _ in range(dp_index):
+            dp_str = np.char.partition(dp_str, ':')[..., 2]
+        dp_str = np.char.partition(dp_str, ':')[..., 0]
+
+        # 一次性计算整组记录的掩码，DP缺失（.）的样本保持不变
+        dp_called = (dp_str != '.') & (dp_str != '')
+        dp_values = np.where(dp_called, dp_str, '0').astype(np.int64)
+        mask = dp_called & (dp_values < dp_threshold)
+        if not mask.any():
+            continue
+
+        masked_cells = np.where(mask, np.char.add(np.char.add('./.', gt_sep), gt_rest), cells)
+        for row_index in np.flatnonzero(mask.any(axis=1)):
+            line_index = line_indices[row_index]
+            fields = split_lines[line_index]
+            masked_lines[line_index] = '\t'.join(fields[:9] + masked_cells[row_index].tolist()) + '\n'
+
+    return masked_lines
+
+def process_vcf(vcf_in_path, vcf_out_path, dp_threshold, block_size=10000, bgzip=False):
     # 判断输入文件是否是压缩文件，如果是则生成索引
     if vcf_in_path.endswith('.gz'):
         if not os.path.exists(vcf_in_path + '.tbi'):
@@ -11,32 +59,54 @@ def process_vcf(vcf_in_path, vcf_out_path, dp_threshold):
     # 打开输入VCF文件进行读取
     vcf_in = pysam.VariantFile(vcf_in_path, 'r')
 
-    # 检查输出文件名，如果以'.gz'结尾，去除'.gz'后缀
-    if vcf_out_path.endswith('.gz'):
-        vcf_out_path = vcf_out_path[:-3]
+    # 未指定bgzip时，输出文件名以'.gz'结尾则去除'.gz'后缀，输出未压缩文件
+    if bgzip:
+        if not vcf_out_path.endswith('.gz'):
+            vcf_out_path = vcf_out_path + '.gz'
+        vcf_out = pysam.BGZFile(vcf_out_path, 'wb')
+    else:
+        if vcf_out_path.endswith('.gz'):
+            vcf_out_path = vcf_out_path[:-3]
+            print(f"未指定 --bgzip，输出未压缩文件: {vcf_out_path}")
+        vcf_out = open(vcf_out_path, 'wb')
 
     # 准备输出VCF文件
-    vcf_out = pysam.VariantFile(vcf_out_path, 'w', header=vcf_in.header)
-
-    # 遍历输入文件中的每个变异
-    for record in vcf_in.fetch():
-        for sample in record.samples:
-            # 获取DP值
-            dp = record.samples[sample]['DP']
-            # 如果DP小于指定阈值，设置GT为缺失
-            if dp is not None and dp < dp_threshold:
-                record.samples[sample]['GT'] = (None, None)
-        vcf_out.write(record)
+    vcf_out.write(str(vcf_in.header).encode())
+
+    # 按块读取变异记录，整块进行DP掩码后写出（只掩码基因型，不去除位点）
+    with metrics.stage('offsprings_vcf_filter') as stage_record:
+        block = []
+        for record in vcf_in.fetch():
+            block.append(str(record))
+            if len(block) == block_size:
+                vcf_out.write(''.join(mask_records(block, dp_threshold)).encode())
+                stage_record.add_rows_in(len(block))
+                stage_record.add_rows_out(len(block))
+                block = []
+        if block:
+            vcf_out.write(''.join(mask_records(block, dp_threshold)).encode())
+            stage_record.add_rows_in(len(block))
+            stage_record.add_rows_out(len(block))
 
     # 关闭VCF文件
     vcf_in.close()
     vcf_out.close()
 
+    # 压缩输出时同时建立tabix索引
+    if bgzip:
+        pysam.tabix_index(vcf_out_path, preset="vcf", force=True)
+
 if __name__ == "__main__":
     # 从命令行获取参数
-    vcf_in_path = sys.argv[1]
-    vcf_out_path = sys.argv[2]
-    dp_threshold = int(sys.argv[3])
+    parser = argparse.ArgumentParser(description='Set offspring genotypes with low coverage depth to missing.')
+    parser.add_argument('vcf_in', help='The input VCF file (can be compressed).')
+    parser.add_argument('vcf_out', help='The output VCF file.')
+    parser.add_argument('dp_threshold', type=int, help='The coverage depth threshold.')
+    parser.add_argument('--block-size', type=int, default=10000,
+                        help='Number of records masked together in one batch (default: 10000).')
+    parser.add_argument('--bgzip', action='store_true',
+                        help='Write BGZF-compressed output (.gz) and build its tabix index.')
+    args = parser.parse_args()
 
     # 处理VCF文件
-    process_vcf(vcf_in_path, vcf_out_path, dp_threshold)
+    process_vcf(args.vcf_in, args.vcf_out, args.dp_threshold, args.block_size, args.bgzip)
@@ -1,8 +1,13 @@
-import sys
-import csv
+import argparse
 from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill
 from openpyxl.utils import get_column_letter
+import genotype_store
+import metrics
+
+# 基因型对应的填充颜色
+GENOTYPE_COLORS = {'nn': "FFFFE0", 'll': "FFFFE0", 'np': "FFC0C0", 'lm': "FFC0C0"}
 
 def apply_formatting(sheet, parent_type):
     yellow_fill = PatternFill(start_color="FFFFE0", end_color="FFFFE0", fill_type="solid")
@@ -35,11 +40,9 @@ def add_segregation_type(sheet, parent_type):
     for row in range(2, sheet.max_row + 1):
         sheet.cell(row=row, column=2, value=segregation_type)
 
-def process_chromosome(chrom_id, parent_type, output_wb, header_file):
+def process_chromosome(chrom_id, parent_type, output_wb, header_file, fmt='csv'):
     input_file = f'{chrom_id}.bins.genotype.{parent_type}.correction.csv'
-    with open(input_file, mode='r') as infile:
-        reader = csv.reader(infile, delimiter=';')
-        data = list(reader)
+    data = list(genotype_store.iter_rows(input_file, fmt))
 
     # 创建新的工作表并命名为染色体ID
     sheet = output_wb.create_sheet(title=chrom_id)
@@ -57,8 +60,49 @@ def process_chromosome(chrom_id, parent_type, output_wb, header_file):
     
     # 应用格式
     apply_formatting(sheet, parent_type)
+    return max(len(data) - 1, 0)
+
+def write_chromosome_sheet(chrom_id, parent_type, output_wb, new_headers, fmt='csv'):
+    """
+    只写模式：逐行读取校正结果并直接写出，分离类型列和新表头在写出时就位，
+    不再插入列或遍历整个工作表设置格式，内存占用与行数无关。
+    """
+    input_file = f'{chrom_id}.bins.genotype.{parent_type}.correction.csv'
+    reader = genotype_store.iter_rows(input_file, fmt)
+    headers = next(reader, [])
+
+    # 与原流程相同：表头第3列起替换为新表头，再在第2列插入分离类型列
+    headers = list(headers) + [None] * max(0, 2 + len(new_headers) - len(headers))
+    headers[2:2 + len(new_headers)] = new_headers
+    headers = headers[:1] + ["Segregation Type"] + headers[1:]
+
+    # 只写模式下列宽必须在写入行之前设置
+    sheet = output_wb.create_sheet(title=chrom_id)
+    for col in range(2, len(headers) + 1):
+        sheet.column_dimensions[get_column_letter(col)].width = 2.5
+    sheet.append(headers)
 
-def main(chromosome_file, parent_type, output_file, header_file):
+    # 每种基因型的填充只创建一次，各单元格共用同一个 PatternFill（openpyxl 写出时按值去重）
+    fills = {genotype: PatternFill(start_color=color, end_color=color, fill_type="solid")
+             for genotype, color in GENOTYPE_COLORS.items()}
+
+    def genotype_cell(value):
+        fill = fills.get(value)
+        if fill is None:
+            return value
+        cell = WriteOnlyCell(sheet, value=value)
+        cell.fill = fill
+        return cell
+
+    # 第3列起为样本基因型：有颜色的基因型写为带填充的单元格，其余直接写值
+    segregation_type = genotype_store.SEGREGATION_TYPES[parent_type]
+    n_rows = 0
+    for row in reader:
+        sheet.append(row[:1] + [segregation_type] + [genotype_cell(value) for value in row[1:]])
+        n_rows += 1
+    return n_rows
+
+def main(chromosome_file, parent_type, output_file, header_file, write_only=False, fmt='csv'):
     # 读取染色体ID文件
     with open(chromosome_file, 'r') as f:
         chrom_ids = f.read().splitlines()
@@ -66,24 +110,37 @@ def main(chromosome_file, parent_type, output_file, header_file):
     if parent_type not in ["male", "female"]:
         raise ValueError("亲本类型只能是 'male' 或 'female'")
     
-    # 创建Excel工作簿
-    output_wb = Workbook()
-    output_wb.remove(output_wb.active)  # 删除默认创建的工作表
+    with metrics.stage('output_to_xlsx', parent_type=parent_type) as record:
+        # 只写模式：每个染色体一遍写完
+        if write_only:
+            with open(header_file, 'r') as f:
+                new_headers = f.read().splitlines()
+            output_wb = Workbook(write_only=True)
+            for chrom_id in chrom_ids:
+                record.add_rows_out(write_chromosome_sheet(chrom_id, parent_type, output_wb, new_headers, fmt))
+        else:
+            # 创建Excel工作簿
+            output_wb = Workbook()
+            output_wb.remove(output_wb.active)  # 删除默认创建的工作表
 
-    # 处理每个染色体ID
-    for chrom_id in chrom_ids:
-        process_chromosome(chrom_id, parent_type, output_wb, header_file)
-    
-    # 保存输出文件
-    output_wb.save(output_file)
+            # 处理每个染色体ID
+            for chrom_id in chrom_ids:
+                record.add_rows_out(process_chromosome(chrom_id, parent_type, output_wb, header_file, fmt))
+
+        # 保存输出文件；每个区间写为一行，输入行数与输出行数相同
+        output_wb.save(output_file)
+        record.add_rows_in(record.rows_out)
     print(f"结果已保存至: {output_file}")
 
 if __name__ == '__main__':
-    if len(sys.argv) != 5:
-        print("Usage: python script.py <chromosome_file> <parent_type> <output_file> <header_file>")
-    else:
-        chromosome_file = sys.argv[1]
-        parent_type = sys.argv[2]
-        output_file = sys.argv[3]
-        header_file = sys.argv[4]
-        main(chromosome_file, parent_type, output_file, header_file)
+    parser = argparse.ArgumentParser(description="Write the corrected bin genotypes of all chromosomes to one xlsx workbook.")
+    parser.add_argument('chromosome_file', type=str, help="Path to the text file containing chromosome IDs.")
+    parser.add_argument('parent_type', type=str, help="Parent type: 'male' or 'female'.")
+    parser.add_argument('output_file', type=str, help="Output xlsx file.")
+    parser.add_argument('header_file', type=str, help="Sample names, one per line (e.g. samples_header.txt).")
+    parser.add_argument('--write-only', action='store_true',
+                        help="Stream rows into a write-only workbook with shared cell styles (faster, bounded memory).")
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help="Input format (default: csv).")
+
+    args = parser.parse_args()
+    main(args.chromosome_file, args.parent_type, args.output_file, args.header_file, args.write_only, args.format)
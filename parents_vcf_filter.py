@@ -3,8 +3,71 @@
 import argparse
 import pysam
 import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import metrics
 
-def filter_vcf(vcf_in_path, vcf_out_path, male_id, female_id, DP):
+def keep_record(rec, male_id, female_id, DP):
+    """判断一个变异位点是否满足亲本过滤条件"""
+    male_gt = rec.samples[male_id]['GT']
+    male_dp = rec.samples[male_id].get('DP', -1)
+    female_gt = rec.samples[female_id]['GT']
+    female_dp = rec.samples[female_id].get('DP', -1)
+
+    # 过滤掉带 '*' 的变异以及GT为缺失的样本
+    if '*' in rec.alts or male_gt == (None, None) or female_gt == (None, None):
+        return False
+
+    # 过滤DP值低于阈值的样本
+    if male_dp < DP or female_dp < DP:
+        return False
+
+    # 过滤掉父母都是同源合子的情况
+    if male_gt in [(0,0), (1,1), (2,2)] and female_gt in [(0,0), (1,1), (2,2)]:
+        return False
+
+    return True
+
+def filter_region(vcf_in_path, shard_path, male_id, female_id, DP, region):
+    """过滤单个染色体区域，并将结果写入独立的分片文件；返回 (读入位点数, 保留位点数)"""
+    vcf_in = pysam.VariantFile(vcf_in_path)
+    vcf_out = pysam.VariantFile(shard_path, 'w', header=vcf_in.header)
+
+    n_in = n_out = 0
+    for rec in vcf_in.fetch(region):
+        n_in += 1
+        if keep_record(rec, male_id, female_id, DP):
+            vcf_out.write(rec)
+            n_out += 1
+
+    vcf_in.close()
+    vcf_out.close()
+    return n_in, n_out
+
+def merge_shards(shard_paths, vcf_out_path):
+    """按表头中染色体的顺序合并分片：表头只取第一个分片，其余分片只取记录行"""
+    with open(vcf_out_path, 'w') as outfile:
+        for shard_index, shard_path in enumerate(shard_paths):
+            with open(shard_path, 'r') as shard:
+                for line in shard:
+                    if line.startswith('#'):
+                        if shard_index == 0:
+                            outfile.write(line)
+                        continue
+                    outfile.write(line)
+                    # 表头之后的记录直接整块复制
+                    shutil.copyfileobj(shard, outfile)
+
+def filter_vcf(vcf_in_path, vcf_out_path, male_id, female_id, DP, workers=1):
+    with metrics.stage('parents_vcf_filter') as record:
+        n_in, n_out = filter_records(vcf_in_path, vcf_out_path, male_id, female_id, DP, workers)
+        record.add_rows_in(n_in)
+        record.drop('parent_filter', n_in - n_out)
+        record.add_rows_out(n_out)
+
+def filter_records(vcf_in_path, vcf_out_path, male_id, female_id, DP, workers=1):
+    """按亲本条件过滤位点，返回 (读入位点数, 保留位点数)"""
     # 检查输入文件是否已经索引
     if vcf_in_path.endswith('.gz'):
         index_path = vcf_in_path + '.tbi'
@@ -18,32 +81,44 @@ def filter_vcf(vcf_in_path, vcf_out_path, male_id, female_id, DP):
     if vcf_out_path.endswith('.gz'):
         vcf_out_path = vcf_out_path[:-3]
 
+    # 多进程模式：按表头中的染色体顺序，将有索引记录的染色体分发给进程池
+    if workers > 1 and vcf_in.index is not None:
+        regions = [contig for contig in vcf_in.header.contigs if contig in vcf_in.index]
+        vcf_in.close()
+        if regions:
+            return filter_vcf_parallel(vcf_in_path, vcf_out_path, male_id, female_id, DP, regions, workers)
+        vcf_in = pysam.VariantFile(vcf_in_path)
+    elif workers > 1:
+        print("输入文件没有索引（需要 bgzip 压缩的 .gz 文件），使用单进程模式。")
+
     # 打开输出VCF文件，确保输出的是未压缩文件
     vcf_out = pysam.VariantFile(vcf_out_path, 'w', header=vcf_in.header)
 
+    n_in = n_out = 0
     for rec in vcf_in.fetch():
-        male_gt = rec.samples[male_id]['GT']
-        male_dp = rec.samples[male_id].get('DP', -1)
-        female_gt = rec.samples[female_id]['GT']
-        female_dp = rec.samples[female_id].get('DP', -1)
-
-        # 过滤掉带 '*' 的变异以及GT为缺失的样本
-        if '*' in rec.alts or male_gt == (None, None) or female_gt == (None, None):
-            continue
-
-        # 过滤DP值低于阈值的样本
-        if male_dp < DP or female_dp < DP:
-            continue
-
-        # 过滤掉父母都是同源合子的情况
-        if male_gt in [(0,0), (1,1), (2,2)] and female_gt in [(0,0), (1,1), (2,2)]:
-            continue
-
-        vcf_out.write(rec)
+        n_in += 1
+        if keep_record(rec, male_id, female_id, DP):
+            vcf_out.write(rec)
+            n_out += 1
 
     # 关闭输入输出VCF文件
     vcf_in.close()
     vcf_out.close()
+    return n_in, n_out
+
+def filter_vcf_parallel(vcf_in_path, vcf_out_path, male_id, female_id, DP, regions, workers):
+    """每个染色体由一个进程过滤并写入分片，最后按表头顺序拼接为一个输出文件"""
+    shard_dir = tempfile.mkdtemp(prefix='parents_vcf_filter.', dir=os.path.dirname(os.path.abspath(vcf_out_path)))
+    try:
+        shard_paths = [os.path.join(shard_dir, f'{index}.vcf') for index in range(len(regions))]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(filter_region, vcf_in_path, shard_path, male_id, female_id, DP, region)
+                       for shard_path, region in zip(shard_paths, regions)]
+            counts = [future.result() for future in futures]
+        merge_shards(shard_paths, vcf_out_path)
+        return sum(n_in for n_in, _ in counts), sum(n_out for _, n_out in counts)
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
 
 def main():
     parser = argparse.ArgumentParser(description='Filter a VCF file based on certain criteria.')
@@ -52,9 +127,11 @@ def main():
     parser.add_argument('male_id', help='The ID of the male sample.')
     parser.add_argument('female_id', help='The ID of the female sample.')
     parser.add_argument('DP', type=int, help='The coverage depth threshold.')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of processes; each contig of an indexed .gz input is filtered in parallel (default: 1).')
     args = parser.parse_args()
 
-    filter_vcf(args.vcf_in, args.vcf_out, args.male_id, args.female_id, args.DP)
+    filter_vcf(args.vcf_in, args.vcf_out, args.male_id, args.female_id, args.DP, args.workers)
 
 if __name__ == '__main__':
     main()
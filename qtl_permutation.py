@@ -0,0 +1,142 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import genotype_probability
+import metrics
+import qtl_scan
+
+# Haley–Knott 扫描的置换检验阈值：把表型在子代间随机重排，记录每次置换的全基因组和各连锁群最大 LOD，
+# 其 90%、95%、99% 分位数即为阈值。每批 batch_size 次置换的表型排成一个矩阵，与预先算好的设计矩阵
+# 做一次矩阵乘积得到全部位置的 LOD；各批在进程池中并行，内存只随批大小增长。
+QUANTILES = (0.90, 0.95, 0.99)
+
+# 每批的置换次数：一批需要 位置数 × 批大小 × 性状数 的 float64 矩阵
+BATCH_SIZE = 100
+
+# 进程池中各子进程共用的 p（位置 × 子代）和按缺失模式缓存的设计矩阵
+_probabilities = None
+_designs = {}
+
+def init_worker(probabilities):
+    global _probabilities
+    _probabilities = probabilities
+    _designs.clear()
+
+def pattern_design(observed):
+    """有表型的子代为 observed 时的设计矩阵，同一子进程内只计算一次"""
+    key = observed.tobytes()
+    if key not in _designs:
+        _designs[key] = qtl_scan.centred_design(_probabilities[:, observed])
+    return _designs[key]
+
+def permutation_lod(p_centered, sxx, y_centered, permutations):
+    """
+    一批置换的 LOD（位置 × (置换数 × 性状数)）。置换不改变 Σ(y - ȳ)²，所以
+        LOD = -n/2 log10(1 - Sxy² / (Sxx Syy))
+    每次置换对同一缺失模式的所有性状使用同一个子代重排。
+    """
+    n, n_traits = y_centered.shape
+    permuted = y_centered[permutations].transpose(1, 0, 2).reshape(n, -1)
+    syy = np.tile((y_centered ** 2).sum(axis=0), len(permutations))[None, :]
+    sxy = p_centered @ permuted
+    with np.errstate(divide='ignore', invalid='ignore'):
+        explained = np.where((sxx > 1e-12) & (syy > 0), sxy ** 2 / (sxx * syy), 0.0)
+    return -n / 2 * np.log10(np.maximum(1 - explained, 1e-300))
+
+def permutation_batch(observed, y, n_permutations, seed, group_starts):
+    """
+    子进程中运行一批置换，随机数由 seed 决定（与子进程个数和调度顺序无关）。
+    返回各连锁群的最大 LOD（置换数 × 性状数 × 连锁群数）。
+    """
+    rng = np.random.default_rng(seed)
+    p_centered, sxx = pattern_design(observed)
+    y_centered = y - y.mean(axis=0)
+    permutations = rng.permuted(np.tile(np.arange(len(y)), (n_permutations, 1)), axis=1)
+    lod = permutation_lod(p_centered, sxx, y_centered, permutations)
+    group_max = np.maximum.reduceat(lod, group_starts, axis=0)
+    return group_max.T.reshape(n_permutations, y.shape[1], len(group_starts))
+
+def threshold_rows(trait, group_names, maxima):
+    """一个性状的阈值表行：全基因组（各置换所有连锁群的最大值）在前，然后是各连锁群"""
+    n_permutations = len(maxima)
+    columns = [('genome', maxima.max(axis=1))] + [(group, maxima[:, index]) for index, group in enumerate(group_names)]
+    return [[trait, group, n_permutations] + [round(float(value), 2) for value in np.quantile(values, QUANTILES)]
+            for group, values in columns]
+
+def permutation_thresholds(map_file, traits_file, output_file, loc_file=None, bins=None, fmt='csv', step=1.0,
+                           traits=None, n_permutations=1000, batch_size=BATCH_SIZE, workers=1, seed=1,
+                           method='flanking', error_rate=genotype_probability.DEFAULT_ERROR_RATE, cache_dir=None):
+    """
+    对所选性状做 n_permutations 次置换，写出 ';' 分隔的阈值表：
+    trait、group（genome 为全基因组）、permutations 及 90%、95%、99% 分位数。
+    第 i 个缺失模式的第 b 批置换使用随机数种子 [seed, i, b]，结果可以重复。
+    """
+    with metrics.stage('qtl_permutation') as record:
+        trait_names, positions, probabilities, phenotypes = qtl_scan.load_scan_data(
+            map_file, traits_file, loc_file, bins, fmt, step, traits, method, error_rate, cache_dir)
+        groups, group_names = pd.factorize(positions['Group'])
+        group_starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        record.add_rows_in(len(trait_names) * n_permutations)
+
+        batches = [(start, min(batch_size, n_permutations - start)) for start in range(0, n_permutations, batch_size)]
+        maxima = {}
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(probabilities,)) as pool:
+            futures = []
+            for pattern, (observed, pattern_traits) in enumerate(qtl_scan.missing_patterns(phenotypes)):
+                # 有表型的子代太少时无法回归，与 qtl_scan.py 相同
+                if observed.sum() < 3:
+                    continue
+                y = phenotypes[observed][:, pattern_traits]
+                futures.append((pattern_traits, [
+                    pool.submit(permutation_batch, observed, y, size, [seed, pattern, index], group_starts)
+                    for index, (_, size) in enumerate(batches)]))
+            for pattern_traits, batch_futures in futures:
+                pattern_maxima = np.concatenate([future.result() for future in batch_futures])
+                for column, trait in enumerate(pattern_traits):
+                    maxima[trait] = pattern_maxima[:, column]
+
+        rows = []
+        for trait, name in enumerate(trait_names):
+            if trait not in maxima:
+                print(f"性状 {name} 的有效表型少于3个，跳过。")
+                continue
+            rows.extend(threshold_rows(name, list(group_names), maxima[trait]))
+            record.add_rows_out(n_permutations)
+
+        columns = ['trait', 'group', 'permutations'] + [f'{int(round(q * 100))}%' for q in QUANTILES]
+        pd.DataFrame(rows, columns=columns).to_csv(output_file, sep=';', index=False)
+
+    print(f"{len(maxima)} 个性状各 {n_permutations} 次置换完成，LOD 阈值已保存至: {output_file}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Genome-wide and per-group LOD thresholds of Haley-Knott scans by permutation.')
+    parser.add_argument('map_file', help='Linkage map (.map), e.g. from marker_order.py or xlsx_to_map.py.')
+    parser.add_argument('traits_file', help='Phenotypes: a .qua file or a workbook laid out like 2021A_qua.xlsx (SampleID, NR, traits).')
+    parser.add_argument('output_file', help="';'-separated threshold table.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--loc', dest='loc_file', help='Genotypes from a .loc file.')
+    source.add_argument('--bins', nargs=2, metavar=('CHROMOSOME_FILE', 'PARENT_TYPE'),
+                        help='Genotypes from the corrected bins (*.bins.genotype.<parent>.correction.csv).')
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help='Format of the bin files (default: csv).')
+    parser.add_argument('--trait', dest='traits', action='append', help='Trait to test (repeatable; default: all traits).')
+    parser.add_argument('--step', type=float, default=1.0, help='Step between scan positions in cM (default: 1).')
+    qtl_scan.add_probability_arguments(parser)
+    parser.add_argument('--permutations', type=int, default=1000, help='Number of permutations per trait (default: 1000).')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help=f'Permutations evaluated together in one matrix product (default: {BATCH_SIZE}).')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of batches run in parallel (default: all CPUs).')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (default: 1).')
+    args = parser.parse_args()
+
+    if args.bins and args.bins[1] not in ('male', 'female'):
+        parser.error("PARENT_TYPE must be 'male' or 'female'")
+    if not 0 < args.error_rate < 0.5:
+        parser.error('--error-rate must be between 0 and 0.5')
+    permutation_thresholds(args.map_file, args.traits_file, args.output_file, args.loc_file, args.bins, args.format,
+                           args.step, args.traits, args.permutations, args.batch_size, args.workers, args.seed,
+                           args.method, args.error_rate, args.cache_dir)
+
+if __name__ == '__main__':
+    main()
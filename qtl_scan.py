@@ -0,0 +1,346 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+import genotype_probability
+import linkage_matrix
+import metrics
+
+# Haley–Knott 区间作图：在连锁群上每隔 step cM 取一个位置，由两侧最近的有基因型的标记算出
+# 每个子代为 A（nn/ll/a）的条件概率 p，再对所有位置、所有性状一次做 y = mu_H + (mu_A - mu_H) p 的最小二乘回归。
+# 输出与 MapQTL 区间作图结果（如 LCP.xlsx）相同的列，每个性状一个文件。
+
+# 拟测交群体的两种基因型：A 为 nn、ll（BC1 写为 a），H 为 np、lm（BC1 写为 h），其余为缺失
+CALL_CODES = {'a': 1, 'nn': 1, 'll': 1, 'h': 0, 'np': 0, 'lm': 0}
+MISSING_CALL = -1
+
+OUTPUT_COLUMNS = ['Nr', 'Group', 'Position', 'Locus', 'LOD', '# Iter.', 'mu_A', 'mu_H', 'Variance', '% Expl.',
+                  'Additive', 'GIC']
+
+def encode_calls(genotypes):
+    """基因型矩阵（标记 × 子代）编码为 int8：1 = A，0 = H，-1 = 缺失"""
+    genotypes = np.asarray(genotypes, dtype=object)
+    calls = np.full(genotypes.shape, MISSING_CALL, dtype=np.int8)
+    for genotype, code in CALL_CODES.items():
+        calls[genotypes == genotype] = code
+    return calls
+
+def read_loc(loc_file):
+    """
+    读取 .loc 文件（bins_to_joinmap.py 的输出，或 2021A_CP.loc.xlsx 那样以制表符分隔的 JoinMap 表格），
+    返回 (标记名列表, 基因型矩阵)。分离类型（<nnxnp> 或 nnxnp）和连锁相（{-1}）列不属于基因型。
+    """
+    names, rows = [], []
+    with open(loc_file, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if not fields or '=' in line or fields[0] == 'MarkerName':
+                continue
+            genotypes = [field for field in fields[1:]
+                         if not (field.startswith('<') or field.startswith('{') or 'x' in field)]
+            names.append(fields[0])
+            rows.append(genotypes)
+    n_individuals = max((len(row) for row in rows), default=0)
+    genotypes = np.full((len(rows), n_individuals), '--', dtype=object)
+    for index, row in enumerate(rows):
+        genotypes[index, :len(row)] = row
+    return names, genotypes
+
+def bin_genotypes(chromosome_file, parent_type, fmt='csv'):
+    """由校正后的 bin 基因型直接得到标记名（与 bins_to_joinmap.py 的 .loc 相同，m1、m2……）和基因型矩阵"""
+    with open(chromosome_file, 'r') as f:
+        chrom_ids = [line.strip() for line in f if line.strip()]
+    markers, genotypes = linkage_matrix.load_bin_markers(chrom_ids, parent_type, fmt)
+    return [f'm{index + 1}' for index in range(len(markers))], genotypes
+
+def read_map(map_file):
+    """读取 .map 文件，返回 [(连锁群, [(标记名, cM), ...]), ...]，组内按 cM 排序"""
+    groups = []
+    with open(map_file, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 2:
+                continue
+            if fields[0] == 'group':
+                groups.append((fields[1], []))
+            elif groups:
+                groups[-1][1].append((fields[0], float(fields[1])))
+    return [(group, sorted(markers, key=lambda marker: marker[1])) for group, markers in groups]
+
+def read_traits(traits_file):
+    """
+    读取表型：.qua 文件（xlsx_to_qua.py 的输出）或同样布局的 .xlsx（SampleID、NR、性状……）。
+    返回 (性状名列表, 个体编号 NR 数组, 表型矩阵 个体 × 性状，缺失为 NaN)。
+    """
+    if traits_file.endswith('.xlsx'):
+        workbook = load_workbook(traits_file, read_only=True)
+        rows = [list(row) for row in workbook.worksheets[0].iter_rows(values_only=True)
+                if not all(value is None for value in row)]
+        workbook.close()
+        header = [str(value) for value in rows[0]]
+        nr_col = header.index('NR')
+        rows = [row + [None] * (len(header) - len(row)) for row in rows[1:]]
+    else:
+        missing = '*'
+        with open(traits_file, 'r') as f:
+            lines = [line.split() for line in f if line.strip()]
+        while lines and lines[0][0] != 'NR':
+            if lines[0][0].startswith('miss'):
+                missing = lines[0][-1]
+            lines.pop(0)
+        header, nr_col = lines[0], 0
+        width = max((len(line) for line in lines[1:]), default=len(header))
+        if len(header) != width:
+            raise ValueError(f"{traits_file} 的表头有 {len(header)} 列，数据有 {width} 列（性状名中可能含有空格），请直接使用 .xlsx 表型文件。")
+        rows = [[None if value == missing else value for value in line] + [None] * (width - len(line))
+                for line in lines[1:]]
+
+    # NR 之后的列为性状；xlsx_to_qua.py 写出的 .qua 中 NR 列出现两次，第二个 NR 不是性状
+    trait_columns = [index for index in range(nr_col + 1, len(header)) if header[index] != 'NR']
+    table = pd.DataFrame(rows)
+    nr = pd.to_numeric(table.iloc[:, nr_col], errors='coerce').to_numpy(dtype=float)
+    values = table.iloc[:, trait_columns].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    return [header[index] for index in trait_columns], nr, values
+
+def scan_positions(marker_cm, step=1.0):
+    """
+    与 MapQTL 相同的扫描位置：每个标记处一个位置，并从每个标记起每隔 step cM 取一个位置直到下一个标记。
+    返回 (位置数组, 每个位置所在的标记序号或 -1)。
+    """
+    positions, loci = [], []
+    for index, cm in enumerate(marker_cm):
+        positions.append(cm)
+        loci.append(index)
+        if index + 1 < len(marker_cm):
+            pseudo = cm + step * np.arange(1, int(np.ceil((marker_cm[index + 1] - cm) / step)) + 1)
+            pseudo = pseudo[pseudo < marker_cm[index + 1] - 1e-9]
+            positions.extend(pseudo)
+            loci.extend([-1] * len(pseudo))
+    return np.array(positions, dtype=float), np.array(loci, dtype=np.int64)
+
+def flanking_probabilities(calls, marker_cm, positions):
+    """
+    每个位置每个子代为 A 的条件概率（位置 × 子代）：只用两侧最近的有基因型的标记，
+        P(Q = A | L, R) ∝ P(L | Q = A) P(R | Q = A)，P(L | Q) = 1 - r 或 r（相同或不同）
+    一侧没有标记时只用另一侧，两侧都没有（或两侧互相矛盾）时为 0.5。所有子代和位置一起计算。
+    """
+    n_markers, n_individuals = calls.shape
+    called = calls != MISSING_CALL
+    marker_index = np.arange(n_markers)[:, None]
+    # 每个标记处及之前最近的有基因型的标记，以及之后最近的（没有时为 -1 或 n_markers）
+    last_called = np.maximum.accumulate(np.where(called, marker_index, -1), axis=0)
+    next_called = np.minimum.accumulate(np.where(called, marker_index, n_markers)[::-1], axis=0)[::-1]
+
+    left_row = np.searchsorted(marker_cm, positions, side='right') - 1
+    right_row = np.searchsorted(marker_cm, positions, side='left')
+    left = np.where(left_row[:, None] >= 0, last_called[np.maximum(left_row, 0)], -1)
+    right = np.where(right_row[:, None] < n_markers, next_called[np.minimum(right_row, n_markers - 1)], n_markers)
+
+    columns = np.arange(n_individuals)[None, :]
+    weight_a = np.ones(left.shape)
+    weight_h = np.ones(left.shape)
+    for flank, has_flank, distance in (
+            (left, left >= 0, positions[:, None] - marker_cm[np.maximum(left, 0)]),
+            (right, right < n_markers, marker_cm[np.minimum(right, n_markers - 1)] - positions[:, None])):
+        r = genotype_probability.haldane_r(np.abs(distance))
+        is_a = calls[np.clip(flank, 0, n_markers - 1), columns] == 1
+        weight_a *= np.where(has_flank, np.where(is_a, 1 - r, r), 1.0)
+        weight_h *= np.where(has_flank, np.where(is_a, r, 1 - r), 1.0)
+    # 同一位置上基因型不一致的两个标记（两侧距离都为 0）使两种权重都为 0，此时没有信息，取 0.5
+    total = weight_a + weight_h
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(total > 0, weight_a / total, 0.5)
+
+def centred_design(probabilities):
+    """回归的设计矩阵：中心化后的 p（位置 × 子代）及每个位置的 Σ(p - p̄)²（位置 × 1）"""
+    if not np.isfinite(probabilities).all():
+        raise ValueError("基因型概率中有 NaN 或无穷大，无法回归。")
+    p_centered = probabilities - probabilities.mean(axis=1, keepdims=True)
+    return p_centered, (p_centered ** 2).sum(axis=1)[:, None]
+
+def hk_regression(probabilities, phenotypes):
+    """
+    所有位置、所有性状一次回归（位置 × 子代 的 p，子代 × 性状 的 y，都不含缺失）：
+    y = mu_H + (mu_A - mu_H) p 的最小二乘解由中心化后的矩阵乘积得到。返回各统计量（位置 × 性状）。
+    """
+    n = probabilities.shape[1]
+    p_centered, sxx = centred_design(probabilities)
+    y_mean = phenotypes.mean(axis=0)
+    y_centered = phenotypes - y_mean
+    sxy = p_centered @ y_centered
+    syy = (y_centered ** 2).sum(axis=0)[None, :]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        additive = np.where(sxx > 1e-12, sxy / sxx, 0.0)
+        rss = np.maximum(syy - additive * sxy, 0)
+        lod = np.where((rss > 0) & (syy > 0), n / 2 * np.log10(syy / rss), 0.0)
+        explained = np.where(syy > 0, 100 * (1 - rss / syy), 0.0)
+    mu_h = y_mean[None, :] - additive * probabilities.mean(axis=1)[:, None]
+    return {'LOD': lod, 'mu_A': mu_h + additive, 'mu_H': mu_h, 'Variance': rss / n, '% Expl.': explained,
+            'Additive': additive}
+
+def missing_patterns(phenotypes):
+    """按缺失模式把性状分组：同一组的性状在相同的子代上有表型，可以一起回归"""
+    patterns = {}
+    for trait, observed in enumerate(~np.isnan(phenotypes).T):
+        patterns.setdefault(observed.tobytes(), (observed, []))[1].append(trait)
+    return list(patterns.values())
+
+def scan_genome(map_groups, marker_names, calls, step=1.0, method='flanking',
+                error_rate=genotype_probability.DEFAULT_ERROR_RATE, cache_dir=None):
+    """
+    为整个基因组建立扫描位置和条件概率，返回位置表（Group、Position、Locus）和 p（位置 × 子代）。
+    .map 中有而基因型中没有的标记跳过。method 为 flanking（两侧最近标记）或 hmm（前向–后向算法）；
+    给出 cache_dir 时结果按 .map、基因型、步长和方法缓存为内存映射文件，再次扫描时直接读取。
+    """
+    if cache_dir:
+        key = genotype_probability.cache_key(map_groups, marker_names, calls, step, method, error_rate)
+        cached = genotype_probability.load_cache(cache_dir, key)
+        if cached is not None:
+            return cached
+        positions, probabilities = scan_genome(map_groups, marker_names, calls, step, method, error_rate)
+        return positions, genotype_probability.store_cache(cache_dir, key, positions, probabilities)
+
+    name_index = {name: index for index, name in enumerate(marker_names)}
+    tables, probabilities = [], []
+    for group, markers in map_groups:
+        markers = [(name, cm) for name, cm in markers if name in name_index]
+        if not markers:
+            continue
+        marker_cm = np.array([cm for _, cm in markers])
+        group_calls = calls[[name_index[name] for name, _ in markers]]
+        positions, loci = scan_positions(marker_cm, step)
+        if method == 'hmm':
+            probabilities.append(genotype_probability.hmm_probabilities(group_calls, positions, loci, error_rate))
+        else:
+            probabilities.append(flanking_probabilities(group_calls, marker_cm, positions))
+        tables.append(pd.DataFrame({'Group': group, 'Position': positions,
+                                    'Locus': [markers[locus][0] if locus >= 0 else None for locus in loci]}))
+    positions = pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=['Group', 'Position', 'Locus'])
+    return positions, np.vstack(probabilities) if probabilities else np.zeros((0, calls.shape[1]))
+
+def match_individuals(nr, n_individuals):
+    """表型的 NR 为 .loc 中子代的序号（从 1 开始）；返回有基因型的表型行和对应的基因型列"""
+    valid = ~np.isnan(nr) & (nr >= 1) & (nr <= n_individuals)
+    rows = np.flatnonzero(valid)
+    return rows, nr[rows].astype(np.int64) - 1
+
+def hk_scan(positions, probabilities, phenotypes):
+    """对每个性状计算 LOD 曲线：按缺失模式分组后，每组的所有位置和性状一次回归。返回 {性状序号: 统计量}"""
+    results = {}
+    for observed, traits in missing_patterns(phenotypes):
+        # 有表型的子代太少时无法回归
+        if observed.sum() < 3:
+            continue
+        stats = hk_regression(probabilities[:, observed], phenotypes[observed][:, traits])
+        for column, trait in enumerate(traits):
+            results[trait] = {name: values[:, column] for name, values in stats.items()}
+    return results
+
+def profile_table(positions, stats, gic):
+    """与 MapQTL 区间作图输出相同的列和小数位"""
+    significant = lambda values: np.array([float(f'{value:.6g}') for value in values])
+    table = pd.DataFrame({
+        'Nr': np.arange(1, len(positions) + 1),
+        'Group': positions['Group'].to_numpy(),
+        'Position': np.round(positions['Position'].to_numpy(), 3),
+        'Locus': positions['Locus'].to_numpy(),
+        'LOD': np.round(stats['LOD'], 2),
+        '# Iter.': 1,
+        'mu_A': significant(stats['mu_A']),
+        'mu_H': significant(stats['mu_H']),
+        'Variance': significant(stats['Variance']),
+        '% Expl.': np.round(stats['% Expl.'], 1),
+        'Additive': significant(stats['Additive']),
+        'GIC': np.round(gic, 3),
+    })
+    return table[OUTPUT_COLUMNS]
+
+def write_profile(table, output_file):
+    """写出一个性状的 LOD 曲线：.xlsx（只写模式）或 ';' 分隔的 .csv"""
+    if output_file.endswith('.csv'):
+        table.to_csv(output_file, sep=';', index=False)
+        return
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    sheet.append(OUTPUT_COLUMNS)
+    for row in table.itertuples(index=False):
+        sheet.append([None if isinstance(value, float) and np.isnan(value) else value for value in row])
+    workbook.save(output_file)
+
+def load_scan_data(map_file, traits_file, loc_file=None, bins=None, fmt='csv', step=1.0, traits=None,
+                   method='flanking', error_rate=genotype_probability.DEFAULT_ERROR_RATE, cache_dir=None):
+    """
+    读取基因型（.loc 或 bin 校正结果）、.map 和表型，返回 (性状名列表, 位置表, p, 表型矩阵)；
+    p 的列与表型矩阵的行是同一批子代。
+    """
+    if loc_file:
+        marker_names, genotypes = read_loc(loc_file)
+    else:
+        marker_names, genotypes = bin_genotypes(bins[0], bins[1], fmt)
+    calls = encode_calls(genotypes)
+    trait_names, nr, values = read_traits(traits_file)
+    if traits:
+        selected = [trait_names.index(trait) for trait in traits]
+        trait_names, values = [trait_names[index] for index in selected], values[:, selected]
+
+    rows, columns = match_individuals(nr, calls.shape[1])
+    positions, probabilities = scan_genome(read_map(map_file), marker_names, calls, step, method, error_rate, cache_dir)
+    return trait_names, positions, probabilities[:, columns], values[rows]
+
+def run_scan(map_file, traits_file, output_dir, loc_file=None, bins=None, fmt='csv', step=1.0, traits=None,
+             output_format='xlsx', method='flanking', error_rate=genotype_probability.DEFAULT_ERROR_RATE,
+             cache_dir=None):
+    """对所选性状做 Haley–Knott 扫描，每个性状写出一个文件"""
+    with metrics.stage('qtl_scan') as record:
+        trait_names, positions, probabilities, phenotypes = load_scan_data(map_file, traits_file, loc_file, bins,
+                                                                           fmt, step, traits, method, error_rate,
+                                                                           cache_dir)
+        record.add_rows_in(len(positions))
+
+        results = hk_scan(positions, probabilities, phenotypes)
+        gic = ((2 * probabilities - 1) ** 2).mean(axis=1)
+        os.makedirs(output_dir, exist_ok=True)
+        for trait, name in enumerate(trait_names):
+            if trait not in results:
+                print(f"性状 {name} 的有效表型少于3个，跳过。")
+                continue
+            write_profile(profile_table(positions, results[trait], gic), os.path.join(output_dir, f'{name}.{output_format}'))
+            record.add_rows_out(len(positions))
+
+    print(f"{len(trait_names)} 个性状、{len(positions)} 个位置扫描完成，结果已保存至: {output_dir}")
+
+def add_probability_arguments(parser):
+    """qtl_scan.py 和 qtl_permutation.py 共用的条件概率参数"""
+    parser.add_argument('--method', choices=['flanking', 'hmm'], default='flanking',
+                        help='Genotype probabilities from the nearest flanking markers or from an HMM over the whole group (default: flanking).')
+    parser.add_argument('--error-rate', type=float, default=genotype_probability.DEFAULT_ERROR_RATE,
+                        help=f'Genotyping error rate of the HMM (default: {genotype_probability.DEFAULT_ERROR_RATE}).')
+    parser.add_argument('--cache-dir', help='Cache the genotype probabilities per map, step and method in this directory.')
+
+def main():
+    parser = argparse.ArgumentParser(description='Haley-Knott interval mapping of many traits over a linkage map.')
+    parser.add_argument('map_file', help='Linkage map (.map), e.g. from marker_order.py or xlsx_to_map.py.')
+    parser.add_argument('traits_file', help='Phenotypes: a .qua file or a workbook laid out like 2021A_qua.xlsx (SampleID, NR, traits).')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--loc', dest='loc_file', help='Genotypes from a .loc file.')
+    source.add_argument('--bins', nargs=2, metavar=('CHROMOSOME_FILE', 'PARENT_TYPE'),
+                        help='Genotypes from the corrected bins (*.bins.genotype.<parent>.correction.csv).')
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help='Format of the bin files (default: csv).')
+    parser.add_argument('--trait', dest='traits', action='append', help='Trait to scan (repeatable; default: all traits).')
+    parser.add_argument('--step', type=float, default=1.0, help='Step between scan positions in cM (default: 1).')
+    add_probability_arguments(parser)
+    parser.add_argument('--output-dir', default='qtl', help='Directory for the LOD profiles, one file per trait (default: qtl).')
+    parser.add_argument('--output-format', choices=['xlsx', 'csv'], default='xlsx', help='Format of the LOD profiles (default: xlsx).')
+    args = parser.parse_args()
+
+    if args.bins and args.bins[1] not in ('male', 'female'):
+        parser.error("PARENT_TYPE must be 'male' or 'female'")
+    if not 0 < args.error_rate < 0.5:
+        parser.error('--error-rate must be between 0 and 0.5')
+    run_scan(args.map_file, args.traits_file, args.output_dir, args.loc_file, args.bins, args.format, args.step,
+             args.traits, args.output_format, args.method, args.error_rate, args.cache_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import pysam
+import genotype_store
+import metrics
+
+# VCF_to_binMap 流程的驱动脚本：把从 parents_vcf_filter 到 output_to_xlsx 的各步骤建成
+# 以 (步骤, 染色体, 亲本类型) 为单位的任务图，互不依赖的任务在进程池中并行运行；
+# 输入文件内容、参数和代码版本的哈希相同的任务直接从缓存目录恢复输出，不再重新计算。
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SHARED_SCRIPTS = ['genotype_store.py']
+
+_loaded_scripts = {}
+
+def load_script(script):
+    """按文件名导入流程脚本（部分脚本名含 '.'，不能直接 import）"""
+    module = _loaded_scripts.get(script)
+    if module is None:
+        name = os.path.splitext(script)[0].replace('.', '_')
+        spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPT_DIR, script))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _loaded_scripts[script] = module
+    return module
+
+def run_function(workdir, script, function, args):
+    """在工作目录中调用脚本的函数，各脚本都按相对路径读写文件"""
+    os.chdir(workdir)
+    getattr(load_script(script), function)(*args)
+
+def write_chromosome_ids(vcf_path, output_file):
+    """与 bcftools query -f '%CHROM\\n' | sort -u 相同：VCF 中出现过的染色体，按名称排序"""
+    with pysam.VariantFile(vcf_path) as vcf_in:
+        chrom_ids = sorted({rec.chrom for rec in vcf_in.fetch()})
+    with open(output_file, 'w') as f:
+        f.writelines(f"{chrom_id}\n" for chrom_id in chrom_ids)
+
+class Task:
+    """任务图中的一个节点：调用 script 中的 function(*args)，inputs/outputs 为工作目录中的相对路径"""
+
+    def __init__(self, name, script, function, args, inputs, outputs, deps=()):
+        self.name = name
+        self.script = script
+        self.function = function
+        self.args = list(args)
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.deps = set(deps)
+
+class StageCache:
+    """
+    按内容寻址的任务缓存：键为代码、参数和输入文件内容的 SHA-256，
+    cache_dir/objects/<键> 中保存任务的输出和 manifest.json。
+    文件哈希按 (路径, 大小, 修改时间) 记录在 hashes.json 中，未改动的文件不再重新读取。
+    """
+
+    def __init__(self, cache_dir, enabled=True):
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.index_file = os.path.join(cache_dir, 'hashes.json')
+        self.hashes = {}
+        if enabled:
+            os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok=True)
+            if os.path.exists(self.index_file):
+                with open(self.index_file, 'r') as f:
+                    self.hashes = json.load(f)
+
+    def save_index(self):
+        if self.enabled:
+            with open(self.index_file, 'w') as f:
+                json.dump(self.hashes, f)
+
+    def file_digest(self, path):
+        """文件或存储目录（.gstore）内容的哈希，不存在时返回 None"""
+        if os.path.isdir(path):
+            digest = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    file_path = os.path.join(root, filename)
+                    digest.update(os.path.relpath(file_path, path).encode())
+                    digest.update(self.file_digest(file_path).encode())
+            return digest.hexdigest()
+        if not os.path.exists(path):
+            return None
+
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self.hashes.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        self.hashes[path] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def task_key(self, task, workdir):
+        # 作为输入的路径参数以文件内容代替，移动输入文件不影响缓存
+        input_paths = {path: os.path.join(workdir, path) for path in task.inputs}
+        args = [f"input:{self.file_digest(input_paths[arg])}" if isinstance(arg, str) and arg in input_paths else arg
+                for arg in task.args]
+        code = [self.file_digest(os.path.join(SCRIPT_DIR, script)) for script in [task.script] + SHARED_SCRIPTS]
+        inputs = [[path, self.file_digest(input_paths[path])] for path in task.inputs]
+        description = {'function': task.function, 'args': args, 'code': code, 'inputs': inputs, 'outputs': task.outputs}
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode()).hexdigest()
+
+    def restore(self, key, workdir):
+        """缓存命中时把输出复制到工作目录，返回是否命中"""
+        if not self.enabled:
+            return False
+        entry = os.path.join(self.cache_dir, 'objects', key)
+        manifest_file = os.path.join(entry, 'manifest.json')
+        if not os.path.exists(manifest_file):
+            return False
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+        for index, output in enumerate(manifest['outputs']):
+            target = os.path.join(workdir, output)
+            remove_path(target)
+            source = os.path.join(entry, str(index))
+            if os.path.isdir(source):
+                shutil.copytree(source, target)
+            else:
+                shutil.copy2(source, target)
+        return True
+
+    def store(self, key, task, workdir):
+        """任务完成后把存在的输出保存到缓存（先写入临时目录，再整体改名）"""
+        if not self.enabled:
+            return
+        entry = os.path.join(self.cache_dir, 'objects', key)
+        if os.path.exists(entry):
+            return
+        staging = entry + '.tmp'
+        remove_path(staging)
+        os.makedirs(staging)
+        outputs = [output for output in task.outputs if os.path.exists(os.path.join(workdir, output))]
+        for index, output in enumerate(outputs):
+            source = os.path.join(workdir, output)
+            if os.path.isdir(source):
+                shutil.copytree(source, os.path.join(staging, str(index)))
+            else:
+                shutil.copy2(source, os.path.join(staging, str(index)))
+        with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+            json.dump({'task': task.name, 'outputs': outputs}, f, indent=1)
+        os.replace(staging, entry)
+
+def record_cached(task):
+    """命中缓存的任务没有运行，在指标文件中只记一条 cached 记录"""
+    stage, chrom, parent_type = (task.name.split(':') + [None, None])[:3]
+    metrics.write_metrics({'run_id': metrics.run_id(), 'stage': stage, 'chrom': chrom,
+                           'parent_type': parent_type, 'status': 'cached'})
+
+def remove_path(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def run_tasks(tasks, workdir, cache, workers=1):
+    """
+    按依赖关系运行任务：依赖都完成的任务先查缓存，未命中的提交到进程池；
+    任一任务出错时停止提交新任务，并在已提交的任务结束后抛出异常。
+    """
+    pending = {task.name: task for task in tasks}
+    done = set()
+    counts = {'run': 0, 'cached': 0}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        while pending or running:
+            ready = [task for task in pending.values() if task.deps <= done]
+            for task in ready:
+                del pending[task.name]
+                key = cache.task_key(task, workdir)
+                if cache.restore(key, workdir):
+                    print(f"[cache] {task.name}")
+                    record_cached(task)
+                    done.add(task.name)
+                    counts['cached'] += 1
+                else:
+                    future = pool.submit(run_function, workdir, task.script, task.function, task.args)
+                    running[future] = (task, key)
+            if ready and not running:
+                # 全部命中缓存，继续查找新就绪的任务
+                continue
+            if not running:
+                raise RuntimeError(f"任务依赖无法满足: {', '.join(sorted(pending))}")
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                task, key = running.pop(future)
+                future.result()
+                cache.store(key, task, workdir)
+                print(f"[done] {task.name}")
+                done.add(task.name)
+                counts['run'] += 1
+    cache.save_index()
+    return counts
+
+def front_tasks(args):
+    """VCF 过滤、合并和缺失过滤：整个基因组一次运行"""
+    tasks = [
+        Task('parents_vcf_filter', 'parents_vcf_filter.py', 'filter_vcf',
+             [args.parents_vcf, 'filtered.parents.vcf', args.male_id, args.female_id, args.parent_dp],
+             [args.parents_vcf], ['filtered.parents.vcf']),
+        Task('offsprings_vcf_filter', 'offsprings_vcf_filter.py', 'process_vcf',
+             [args.offsprings_vcf, 'filtered.offsprings.vcf', args.offspring_dp],
+             [args.offsprings_vcf], ['filtered.offsprings.vcf']),
+        Task('vcf_to_merged_variant', 'vcf_to_merged_variant.py', 'build_merged_variant',
+             ['filtered.parents.vcf', 'filtered.offsprings.vcf', 'merged.variant.csv', None, None, 'samples_header.txt'],
+             ['filtered.parents.vcf', 'filtered.offsprings.vcf'], ['merged.variant.csv', 'samples_header.txt'],
+             deps=['parents_vcf_filter', 'offsprings_vcf_filter']),
+        Task('filtered.merged.variant', 'filtered.merged.variant.py', 'filter_csv',
+             ['merged.variant.csv', 'filtered.merged.variant.csv', args.missing_threshold, 100000],
+             ['merged.variant.csv'], ['filtered.merged.variant.csv'], deps=['vcf_to_merged_variant']),
+    ]
+    if not args.chromosomes:
+        tasks.append(Task('chromosome_ids', 'run_pipeline.py', 'write_chromosome_ids',
+                          ['filtered.parents.vcf', 'chromosome_ids.txt'],
+                          ['filtered.parents.vcf'], ['chromosome_ids.txt'], deps=['parents_vcf_filter']))
+    return tasks
+
+def chromosome_tasks(args, chrom_ids, offspring_count):
+    """按染色体和亲本类型拆分后的各步骤，以及每种亲本类型一个的 xlsx 输出"""
+    fmt = args.format
+    path = lambda name: genotype_store.data_path(name, fmt)
+    split_outputs = [path(f"{chrom_id}.merged.variant.{parent_type}.csv")
+                     for parent_type in args.parent_types for chrom_id in chrom_ids]
+    tasks = [Task('split_by_parent_type', 'split_by_parent_type.py', 'split_by_parent_type',
+                  ['filtered.merged.variant.csv', 'chromosome_ids.txt', list(args.parent_types), 64, fmt],
+                  ['filtered.merged.variant.csv', 'chromosome_ids.txt'], split_outputs)]
+
+    threshold = int(offspring_count * args.max_missing_rate)
+    for parent_type in args.parent_types:
+        correction_tasks = []
+        for chrom_id in chrom_ids:
+            files = {step: f"{chrom_id}.{name}.{parent_type}.csv" for step, name in [
+                ('variant', 'merged.variant'), ('range', 'MNP.range'), ('genotype', 'MNP.genotype'),
+                ('filted', 'MNP.genotype.filted'), ('swap', 'MNP.genotype.swap'), ('bins', 'bins.genotype')]}
+            files['correction'] = f"{chrom_id}.bins.genotype.{parent_type}.correction.csv"
+            name = lambda stage: f"{stage}:{chrom_id}:{parent_type}"
+            tasks += [
+                Task(name('MNP_marker_building'), 'MNP_marker_building.py', 'process_chromosome',
+                     [chrom_id, parent_type, fmt, [args.window_size], args.window_offset, args.markers_per_mnp],
+                     [path(files['variant'])], [path(files['range'])], deps=['split_by_parent_type']),
+                Task(name('MNP_maker_genotype'), 'MNP_maker_genotype.py', 'process_chromosome',
+                     [chrom_id, parent_type, offspring_count, fmt, args.markers_per_mnp],
+                     [path(files['range'])], [path(files['genotype'])], deps=[name('MNP_marker_building')]),
+                Task(name('MNP_maker_filter'), 'MNP_maker_filter.py', 'filter_chromosome',
+                     [chrom_id, parent_type, threshold, fmt, args.min_p_value],
+                     [path(files['genotype'])], [path(files['filted'])], deps=[name('MNP_maker_genotype')]),
+                Task(name('MNP_maker_swap'), 'MNP_maker_swap.py', 'process_file',
+                     [chrom_id, parent_type, fmt, args.swap_mode, args.swap_window],
+                     [path(files['filted'])], [path(files['swap'])], deps=[name('MNP_maker_filter')]),
+                Task(name('bin_maker_genotype'), 'bin_maker_genotype.py', 'bin_chromosome',
+                     [chrom_id, parent_type, args.bin_size, fmt, args.majority],
+                     [path(files['swap'])], [path(files['bins'])], deps=[name('MNP_maker_swap')]),
+                Task(name('bin_correct_genotypes'), 'bin_correct_genotypes.py', 'correct_chromosome',
+                     [chrom_id, parent_type, fmt],
+                     [path(files['bins'])], [path(files['correction'])], deps=[name('bin_maker_genotype')]),
+            ]
+            correction_tasks.append(name('bin_correct_genotypes'))
+
+        output_file = f"{parent_type}.bins.xlsx"
+        correction_files = [path(f"{chrom_id}.bins.genotype.{parent_type}.correction.csv") for chrom_id in chrom_ids]
+        tasks.append(Task(f"output_to_xlsx:{parent_type}", 'output_to_xlsx.py', 'main',
+                          ['chromosome_ids.txt', parent_type, output_file, 'samples_header.txt', True, fmt],
+                          ['chromosome_ids.txt', 'samples_header.txt'] + correction_files, [output_file],
+                          deps=correction_tasks))
+    return tasks
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the VCF_to_binMap pipeline as a parallel, cached task graph.')
+    parser.add_argument('parents_vcf', help='Parent VCF file (female first, then male).')
+    parser.add_argument('offsprings_vcf', help='Offspring VCF file.')
+    parser.add_argument('male_id', help='The ID of the male sample.')
+    parser.add_argument('female_id', help='The ID of the female sample.')
+    parser.add_argument('--parent-dp', type=int, required=True, help='Minimum coverage for parent variant sites.')
+    parser.add_argument('--offspring-dp', type=int, required=True, help='Minimum coverage for offspring genotypes.')
+    parser.add_argument('--missing-threshold', type=int, required=True,
+                        help='Maximum number of missing offspring genotypes per site.')
+    parser.add_argument('--bin-size', type=int, required=True, help='The bin size for bin_maker_genotype.py.')
+    parser.add_argument('--parent-types', nargs='+', choices=['male', 'female'], default=['male', 'female'],
+                        help='Parent types to process (default: male female).')
+    parser.add_argument('--chromosomes', help='Chromosome ID file to use instead of the chromosomes of the filtered parent VCF.')
+    parser.add_argument('--workdir', default='.', help='Directory for all intermediate and output files (default: .).')
+    parser.add_argument('--cache-dir', default='.pipeline_cache', help='Cache directory (default: .pipeline_cache in the workdir).')
+    parser.add_argument('--no-cache', action='store_true', help='Run every task and do not read or write the cache.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Number of processes (default: all CPUs).')
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help='Per-chromosome file format (default: csv).')
+    parser.add_argument('--window-size', type=int, default=5000, help='MNP window size (default: 5000).')
+    parser.add_argument('--window-offset', type=int, default=5000, help='Start of the first MNP window (default: 5000).')
+    parser.add_argument('--markers-per-mnp', type=int, default=5, help='SNPs per MNP marker (default: 5).')
+    parser.add_argument('--max-missing-rate', type=float, default=0.25, help='MNP_maker_filter missing rate (default: 0.25).')
+    parser.add_argument('--min-p-value', type=float, default=0.01, help='MNP_maker_filter p-value (default: 0.01).')
+    parser.add_argument('--swap-mode', choices=['greedy', 'global'], default='greedy', help='MNP_maker_swap mode (default: greedy).')
+    parser.add_argument('--swap-window', type=int, default=3, help='MNP_maker_swap global window (default: 3).')
+    parser.add_argument('--majority', type=float, default=0.51, help='bin_maker_genotype majority (default: 0.51).')
+    parser.add_argument('--metrics', help='Append per-stage timings, peak memory and row counts to this JSON-lines file.')
+    parser.add_argument('--profile', metavar='STAGE',
+                        help='Run cProfile for this stage, e.g. MNP_maker_genotype; .prof files are written to the workdir.')
+    args = parser.parse_args()
+
+    # 输入文件使用绝对路径，其余文件都在工作目录中按相对路径读写
+    args.parents_vcf = os.path.abspath(args.parents_vcf)
+    args.offsprings_vcf = os.path.abspath(args.offsprings_vcf)
+    workdir = os.path.abspath(args.workdir)
+    os.makedirs(workdir, exist_ok=True)
+    if args.chromosomes:
+        shutil.copyfile(args.chromosomes, os.path.join(workdir, 'chromosome_ids.txt'))
+    cache = StageCache(os.path.join(workdir, args.cache_dir), enabled=not args.no_cache)
+
+    # 指标和性能分析通过环境变量传给各子进程；同一次运行的记录共用一个 run_id
+    if args.metrics:
+        os.environ[metrics.METRICS_ENV] = os.path.abspath(args.metrics)
+    if args.profile:
+        os.environ[metrics.PROFILE_ENV] = args.profile
+        os.environ.setdefault(metrics.PROFILE_DIR_ENV, workdir)
+    metrics.run_id()
+
+    counts = run_tasks(front_tasks(args), workdir, cache, args.workers)
+
+    # 染色体列表和子代个数在前面的步骤完成后才能确定
+    with open(os.path.join(workdir, 'chromosome_ids.txt'), 'r') as f:
+        chrom_ids = [line.strip() for line in f if line.strip()]
+    with open(os.path.join(workdir, 'samples_header.txt'), 'r') as f:
+        offspring_count = sum(1 for line in f if line.strip())
+
+    chrom_counts = run_tasks(chromosome_tasks(args, chrom_ids, offspring_count), workdir, cache, args.workers)
+    print(f"流程完成：运行 {counts['run'] + chrom_counts['run']} 个任务，"
+          f"缓存命中 {counts['cached'] + chrom_counts['cached']} 个任务。")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+from collections import OrderedDict
+import genotype_store
+import metrics
+
+# 每种亲本类型对应的判断列：母本（第5列）纯合时父本分离（nn×np），父本（第6列）纯合时母本分离（lm×ll）
+PARENT_COLUMNS = {'male': 4, 'female': 5}
+
+class FileHandlePool:
+    """限制同时打开的输出文件数量，超出时关闭最久未使用的文件，再次写入时以追加方式重新打开"""
+
+    def __init__(self, max_open_files):
+        self.max_open_files = max_open_files
+        self.handles = OrderedDict()
+
+    def write(self, filename, line):
+        handle = self.handles.get(filename)
+        if handle is None:
+            if len(self.handles) >= self.max_open_files:
+                _, oldest = self.handles.popitem(last=False)
+                oldest.close()
+            handle = open(filename, 'a')
+            self.handles[filename] = handle
+        else:
+            self.handles.move_to_end(filename)
+        handle.write(line)
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles.clear()
+
+def is_homozygous(genotype):
+    """与 filter_by_parent_type 相同的判断：基因型的第1个和第3个字符相同"""
+    return len(genotype) >= 3 and genotype[0] == genotype[2]
+
+def split_by_parent_type(input_file, chromosome_file, parent_types=('male', 'female'), max_open_files=64, fmt='csv'):
+    # 读取染色体ID，染色体按第一列精确匹配
+    with open(chromosome_file, 'r') as prefix_file:
+        chrom_ids = [line.strip() for line in prefix_file if line.strip()]
+    chrom_set = set(chrom_ids)
+
+    # 预先创建（清空）所有输出文件，没有位点的染色体也输出空文件
+    output_files = {}
+    for parent_type in parent_types:
+        for chrom_id in chrom_ids:
+            output_filename = f"{chrom_id}.merged.variant.{parent_type}.csv"
+            open(output_filename, 'w').close()
+            output_files[(chrom_id, parent_type)] = output_filename
+
+    row_counts = {parent_type: 0 for parent_type in parent_types}
+    with metrics.stage('split_by_parent_type') as record:
+        pool = FileHandlePool(max_open_files)
+        try:
+            with open(input_file, 'r') as infile:
+                for line in infile:
+                    record.add_rows_in(1)
+                    fields = line.rstrip('\r\n').split(';', 6)
+                    if len(fields) < 6 or fields[0] not in chrom_set:
+                        record.drop('chromosome', 1)
+                        continue
+
+                    # 一行可能同时满足两种亲本类型，此时两种类型的文件都写入，与分别运行原脚本的结果一致
+                    stripped_line = None
+                    for parent_type in parent_types:
+                        if is_homozygous(fields[PARENT_COLUMNS[parent_type]]):
+                            if stripped_line is None:
+                                # 去除基因型分隔符 '/' 和 '|'
+                                stripped_line = line.rstrip('\r\n').replace('/', '').replace('|', '') + '\n'
+                            pool.write(output_files[(fields[0], parent_type)], stripped_line)
+                            row_counts[parent_type] += 1
+                    if stripped_line is None:
+                        record.drop('parent_type', 1)
+        finally:
+            pool.close()
+
+        # 二进制存储格式：每个染色体文件写完后转换为存储目录，并删除临时的 CSV
+        if fmt == 'store':
+            for (chrom_id, parent_type), output_filename in output_files.items():
+                with open(output_filename, 'r') as csv_file:
+                    rows = [line.rstrip('\n').split(';') for line in csv_file]
+                genotype_store.write_table_rows(output_filename, 'store', None, rows, (6, None), 1,
+                                                chrom=chrom_id, parent_type=parent_type)
+                os.remove(output_filename)
+        # 输出行数为各亲本类型文件的行数之和（同一行可能写入两种类型）
+        record.add_rows_out(sum(row_counts.values()))
+
+    for parent_type in parent_types:
+        print(f"{parent_type}: {row_counts[parent_type]} rows split into {len(chrom_ids)} chromosome files")
+
+def main():
+    parser = argparse.ArgumentParser(description='Filter variants by parent type and split them by chromosome in one pass.')
+    parser.add_argument('input_file', help='The filtered merged variant file, e.g. filtered.merged.variant.csv.')
+    parser.add_argument('chromosome_file', nargs='?', default='chromosome_ids.txt',
+                        help='Chromosome ID file (default: chromosome_ids.txt).')
+    parser.add_argument('--parent-types', nargs='+', choices=['male', 'female'], default=['male', 'female'],
+                        help='Parent types to write (default: male female).')
+    parser.add_argument('--max-open-files', type=int, default=64,
+                        help='Maximum number of output files kept open at the same time (default: 64).')
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help='Output format (default: csv).')
+    args = parser.parse_args()
+
+    split_by_parent_type(args.input_file, args.chromosome_file, args.parent_types, args.max_open_files, args.format)
+
+if __name__ == '__main__':
+    main()
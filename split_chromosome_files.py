@@ -1,10 +1,13 @@
 import csv
 import argparse
+import genotype_store
+import metrics
 
 def main():
     # 解析命令行参数
     parser = argparse.ArgumentParser(description='Split variant files based on chromosome prefixes.')
     parser.add_argument('parent_type', choices=['male', 'female'], help='Specify the parent type: "male" or "female".')
+    parser.add_argument('--format', choices=['csv', 'store'], default='csv', help='Output format (default: csv).')
     args = parser.parse_args()
 
     # 读取染色体前缀
@@ -20,13 +23,21 @@ def main():
         data_rows = input_file.readlines()
 
     # 遍历前缀列表，为每个前缀创建一个输出文件
-    for prefix in prefixes:
-        output_filename = f"{prefix}.merged.variant.{args.parent_type}.csv"
-        with open(output_filename, 'w') as output_file:
-            # 遍历数据行，写入以当前前缀开头的行
-            for row in data_rows:
-                if row.startswith(prefix):
-                    output_file.write(row)
+    with metrics.stage('split_chromosome_files', parent_type=args.parent_type) as record:
+        record.add_rows_in(len(data_rows))
+        for prefix in prefixes:
+            output_filename = f"{prefix}.merged.variant.{args.parent_type}.csv"
+            rows = [row for row in data_rows if row.startswith(prefix)]
+            record.add_rows_out(len(rows))
+            if args.format == 'store':
+                # 二进制存储：第6列之后为子代基因型，第2列为位置
+                rows = [row.rstrip('\n').split(';') for row in rows]
+                genotype_store.write_table_rows(output_filename, 'store', None, rows, (6, None), 1,
+                                                chrom=prefix, parent_type=args.parent_type)
+                continue
+            with open(output_filename, 'w') as output_file:
+                # 写入以当前前缀开头的行
+                output_file.writelines(rows)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import pytest
+from openpyxl import load_workbook
+import qtl_scan
+import xlsx_to_qua
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_colocated_conflicting_markers():
+    # m1、m2 都在 0 cM，第1、2个子代在两个标记上的基因型不一致
+    calls = np.array([[1, 0, 1, 0, 1, 0],
+                      [0, 1, 1, 0, 1, 0],
+                      [1, 0, 1, 0, 0, 1]], dtype=np.int8)
+    marker_cm = np.array([0.0, 0.0, 5.0])
+    positions, _ = qtl_scan.scan_positions(marker_cm)
+    probabilities = qtl_scan.flanking_probabilities(calls, marker_cm, positions)
+
+    assert np.isfinite(probabilities).all()
+    np.testing.assert_allclose(probabilities[:2, :2], 0.5)
+    np.testing.assert_allclose(probabilities[:2, 2:], np.broadcast_to(calls[0, 2:], (2, 4)))
+
+    phenotypes = np.array([[10.0], [2.0], [11.0], [1.0], [9.0], [3.0]])
+    stats = qtl_scan.hk_regression(probabilities, phenotypes)
+    for values in stats.values():
+        assert np.isfinite(values).all()
+    assert (stats['LOD'] > 0).all()
+
+def test_centred_design_rejects_nan():
+    with pytest.raises(ValueError):
+        qtl_scan.centred_design(np.array([[0.0, np.nan, 1.0]]))
+
+def test_qua_matches_workbook(tmp_path):
+    # 性状名 'Peel_and _flesh_drop_slope' 含有空格，写出 .qua 时替换为 _，各列不错位
+    qua_file = str(tmp_path / 'traits.qua')
+    xlsx_to_qua.process_excel_to_qua(os.path.join(REPO, '2021A_qua.xlsx'), qua_file)
+    names, nr, values = qtl_scan.read_traits(qua_file)
+    expected_names, expected_nr, expected_values = qtl_scan.read_traits(os.path.join(REPO, '2021A_qua.xlsx'))
+
+    assert names == ['_'.join(name.split()) for name in expected_names]
+    np.testing.assert_array_equal(nr, expected_nr)
+    np.testing.assert_array_equal(values, expected_values)
+
+def test_reproduces_mapqtl_lcp(tmp_path):
+    # 由 LCP.xlsx 的标记行建立 .map，用 2021A_CP.loc.xlsx 和 2021A_qua.xlsx 重新扫描 LCP
+    workbook = load_workbook(os.path.join(REPO, 'LCP.xlsx'), read_only=True)
+    rows = list(workbook.worksheets[0].iter_rows(values_only=True))
+    workbook.close()
+    header, rows = list(rows[0]), rows[1:]
+    expected = {name: np.array([row[header.index(name)] for row in rows], dtype=float)
+                for name in ('Position', 'LOD', '% Expl.', 'mu_A', 'mu_H', 'Variance', 'Additive', 'GIC')}
+
+    lines, group = [], None
+    for row in rows:
+        if row[header.index('Group')] != group:
+            group = row[header.index('Group')]
+            lines.append(f'group {group}')
+        if row[header.index('Locus')] is not None:
+            lines.append(f"{row[header.index('Locus')]} {row[header.index('Position')]}")
+    map_file = tmp_path / 'LG.map'
+    map_file.write_text('\n'.join(lines) + '\n')
+
+    trait_names, positions, probabilities, phenotypes = qtl_scan.load_scan_data(
+        str(map_file), os.path.join(REPO, '2021A_qua.xlsx'), os.path.join(REPO, '2021A_CP.loc.xlsx'), traits=['LCP'])
+    results = qtl_scan.hk_scan(positions, probabilities, phenotypes)
+    gic = ((2 * probabilities - 1) ** 2).mean(axis=1)
+    table = qtl_scan.profile_table(positions, results[0], gic)
+
+    assert len(table) == len(rows)
+    np.testing.assert_allclose(table['Position'], expected['Position'], atol=1e-9)
+    np.testing.assert_array_equal(table['LOD'], expected['LOD'])
+    np.testing.assert_allclose(table['GIC'], expected['GIC'], atol=1e-9)
+    np.testing.assert_allclose(table['% Expl.'], expected['% Expl.'], atol=0.1 + 1e-9)
+    # 效应列只有 LG18 起始的两个位置（Nr 1894、1895）与 MapQTL 相差约 0.003，其余在 6 位有效数字内相同
+    loose = np.isin(table['Nr'], [1894, 1895])
+    for name in ('mu_A', 'mu_H', 'Variance', 'Additive'):
+        np.testing.assert_allclose(table[name][~loose], expected[name][~loose], rtol=1e-5)
+        np.testing.assert_allclose(table[name][loose], expected[name][loose], atol=3e-3)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import argparse
+import pysam
+import metrics
+
+def query_lines(vcf_path):
+    """逐条读取VCF记录，生成与 bcftools query -f '%CHROM;%POS;%REF;%ALT[;%GT]' 相同的字段"""
+    vcf_in = pysam.VariantFile(vcf_path)
+    try:
+        for record in vcf_in.fetch():
+            fields = str(record).rstrip('\n').split('\t')
+            alt = ','.join(record.alts) if record.alts else '.'
+            format_keys = fields[8].split(':') if len(fields) > 8 else []
+            if format_keys and format_keys[0] == 'GT':
+                genotypes = [cell.split(':', 1)[0] for cell in fields[9:]]
+            elif 'GT' in format_keys:
+                gt_index = format_keys.index('GT')
+                genotypes = [(cell.split(':') + ['.'] * gt_index)[gt_index] for cell in fields[9:]]
+            else:
+                genotypes = ['.'] * (len(fields) - 9)
+            yield record.chrom, record.pos, [record.chrom, str(record.pos), record.ref, alt] + genotypes
+    finally:
+        vcf_in.close()
+
+def sorted_keys(lines, contig_rank, label):
+    """为每条记录计算排序键 (染色体序号, 位置)，并检查输入是否已排序"""
+    previous_key = None
+    for chrom, pos, fields in lines:
+        if chrom not in contig_rank:
+            contig_rank[chrom] = len(contig_rank)
+        key = (contig_rank[chrom], pos)
+        if previous_key is not None and key < previous_key:
+            raise ValueError(f"{label} 未按染色体和位置排序（{chrom}:{pos}），请先使用 bcftools sort 排序。")
+        previous_key = key
+        yield key, fields
+
+def collapse_duplicates(keyed_lines):
+    """同一位置有多条亲本记录时只保留最后一条，与原 awk 合并的行为一致"""
+    current_key, current_fields = None, None
+    for key, fields in keyed_lines:
+        if current_key is not None and key != current_key:
+            yield current_key, current_fields
+        current_key, current_fields = key, fields
+    if current_key is not None:
+        yield current_key, current_fields
+
+def build_merged_variant(parents_vcf, offsprings_vcf, output_file, parents_csv=None, offsprings_csv=None,
+                         samples_header=None):
+    """以流的方式按 (CHROM, POS) 合并亲本与子代位点，输出 merged.variant.csv"""
+    # 染色体顺序以亲本VCF表头为准，两个VCF需按相同的染色体顺序排序
+    with pysam.VariantFile(parents_vcf) as parents_in, pysam.VariantFile(offsprings_vcf) as offsprings_in:
+        contig_rank = {contig: rank for rank, contig in enumerate(parents_in.header.contigs)}
+        for contig in offsprings_in.header.contigs:
+            contig_rank.setdefault(contig, len(contig_rank))
+
+        # 需要时写出子代样本ID，代替 bcftools query -l
+        if samples_header:
+            with open(samples_header, 'w') as header_file:
+                header_file.writelines(f"{sample}\n" for sample in offsprings_in.header.samples)
+
+    parents_out = open(parents_csv, 'w') if parents_csv else None
+    offsprings_out = open(offsprings_csv, 'w') if offsprings_csv else None
+
+    def tee(keyed_lines, csv_out):
+        # 需要时同时写出 bcftools query 格式的中间文件
+        for key, fields in keyed_lines:
+            if csv_out is not None:
+                csv_out.write(';'.join(fields) + '\n')
+            yield key, fields
+
+    merged_count = 0
+    try:
+        parents = collapse_duplicates(tee(sorted_keys(query_lines(parents_vcf), contig_rank, parents_vcf), parents_out))
+        offsprings = tee(sorted_keys(query_lines(offsprings_vcf), contig_rank, offsprings_vcf), offsprings_out)
+
+        with metrics.stage('vcf_to_merged_variant') as record, open(output_file, 'w') as outfile:
+            parent_key, parent_fields = next(parents, (None, None))
+            for offspring_key, offspring_fields in offsprings:
+                record.add_rows_in(1)
+                # 亲本流前进到不小于当前子代位点的位置
+                while parent_key is not None and parent_key < offspring_key:
+                    parent_key, parent_fields = next(parents, (None, None))
+                if parent_key == offspring_key:
+                    outfile.write(';'.join(parent_fields[:6] + offspring_fields[4:]) + '\n')
+                    merged_count += 1
+
+            # 继续读完亲本流，保证中间文件完整
+            for _ in parents:
+                pass
+            # 输入行数按子代位点计，亲本中没有的子代位点不输出
+            record.drop('no_parent_site', record.rows_in - merged_count)
+            record.add_rows_out(merged_count)
+    finally:
+        if parents_out is not None:
+            parents_out.close()
+        if offsprings_out is not None:
+            offsprings_out.close()
+
+    print(f"合并完成，共 {merged_count} 个位点，结果已保存至: {output_file}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Merge filtered parent and offspring VCFs into merged.variant.csv.')
+    parser.add_argument('parents_vcf', help='The filtered parent VCF file (female first, then male).')
+    parser.add_argument('offsprings_vcf', help='The filtered offspring VCF file.')
+    parser.add_argument('output_file', help='The merged output file, e.g. merged.variant.csv.')
+    parser.add_argument('--skip-intermediate', action='store_true',
+                        help='Do not write filtered.parents.csv and filtered.offsprings.csv.')
+    parser.add_argument('--parents-csv', default='filtered.parents.csv',
+                        help='Intermediate parent table (default: filtered.parents.csv).')
+    parser.add_argument('--offsprings-csv', default='filtered.offsprings.csv',
+                        help='Intermediate offspring table (default: filtered.offsprings.csv).')
+    parser.add_argument('--samples-header', default=None,
+                        help='Also write the offspring sample IDs to this file, e.g. samples_header.txt.')
+    args = parser.parse_args()
+
+    parents_csv = None if args.skip_intermediate else args.parents_csv
+    offsprings_csv = None if args.skip_intermediate else args.offsprings_csv
+    build_merged_variant(args.parents_vcf, args.offsprings_vcf, args.output_file, parents_csv, offsprings_csv,
+                         args.samples_header)
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,51 @@
-import pandas as pd
 import sys
+from openpyxl import load_workbook
+import bins_to_joinmap
+
+def position_key(value):
+    return float(value)
 
 def process_excel_to_map(input_file, output_file):
-    # 读取输入文件的所有工作表，并将所有列都读取为字符串类型
-    excel_data = pd.read_excel(input_file, sheet_name=None, dtype=str, engine='openpyxl')
-    
+    # 以只读方式逐行读取输入文件的所有工作表
+    workbook = load_workbook(input_file, read_only=True)
+
     marker_count = 1
+    lines = []
 
-    with open(output_file, 'w') as file:
-        # 遍历每一个工作表
-        for sheet_name, sheet_data in excel_data.items():
-            # 提取Locus和Position列
-            if 'Locus' not in sheet_data.columns or 'Position' not in sheet_data.columns:
-                print(f"工作表 '{sheet_name}' 缺少 'Locus' 或 'Position' 列。跳过该工作表。")
+    # 遍历每一个工作表
+    for sheet in workbook.worksheets:
+        rows = sheet.iter_rows(values_only=True)
+        header = [str(value) if value is not None else None for value in next(rows, ())]
+
+        # 提取Locus和Position列
+        if 'Locus' not in header or 'Position' not in header:
+            print(f"工作表 '{sheet.title}' 缺少 'Locus' 或 'Position' 列。跳过该工作表。")
+            continue
+        locus_col = header.index('Locus')
+        position_col = header.index('Position')
+
+        # 写入组信息
+        lines.append(f"group {sheet.title}")
+
+        # 只保留Locus和Position列都不为空的行
+        positions = []
+        for row in rows:
+            if len(row) <= max(locus_col, position_col):
                 continue
-            
-            # 写入组信息
-            file.write(f"group {sheet_name}\n")
-            
-            # 只保留Locus和Position列，并去掉表头
-            selected_data = sheet_data[['Locus', 'Position']].dropna()
-            
-            # 重命名第1列
-            selected_data['Locus'] = [f"m{marker_count + i}" for i in range(len(selected_data))]
-            marker_count += len(selected_data)
-            
-            # 按照Position列数值从小到大排序
-            selected_data = selected_data.sort_values(by='Position', key=pd.to_numeric)
-            
-            # 将数据写入文件
-            for index, row in selected_data.iterrows():
-                file.write(f"{row['Locus']} {row['Position']}\n")
+            if row[locus_col] is not None and row[position_col] is not None:
+                positions.append(row[position_col])
+
+        # 重命名第1列后按照Position列数值从小到大排序（稳定排序）
+        selected_data = [(f"m{marker_count + i}", position) for i, position in enumerate(positions)]
+        marker_count += len(selected_data)
+        selected_data.sort(key=lambda item: position_key(item[1]))
+
+        lines.extend(f"{locus} {position}" for locus, position in selected_data)
+    workbook.close()
+
+    # 将数据批量写入文件
+    with open(output_file, 'w') as file:
+        bins_to_joinmap.write_lines(file, lines)
 
     print(f"转换完成，生成的.map文件已保存为{output_file}")
 
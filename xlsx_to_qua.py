@@ -1,51 +1,51 @@
-import pandas as pd
-import sys
+import argparse
+from openpyxl import load_workbook
+import bins_to_joinmap
 
-def process_excel_to_qua(input_file, output_file, nind, ntrt):
-    # 读取Excel文件
-    df = pd.read_excel(input_file, engine='openpyxl')
+def format_value(value, missing='*'):
+    # 空单元格按缺失值写出
+    return missing if value is None else str(value)
 
-    # 打开一个新文件，用于写入.qua文件内容
+def process_excel_to_qua(input_file, output_file, nind=None, ntrt=None):
+    # 以只读方式逐行读取第一个工作表
+    workbook = load_workbook(input_file, read_only=True)
+    rows = workbook.worksheets[0].iter_rows(values_only=True)
+    columns = [format_value(value, '') for value in next(rows, ())]
+    nr_col = columns.index('NR')
+
+    # 获取并组合表头（从第二列开始直到最后一列）；.qua 以空白分隔，列名中的空白替换为 _
+    lines = ['NR ' + ' '.join('_'.join(name.split()) for name in columns[1:])]
+
+    # 每行：样品ID，以及从第二列开始的所有表型数据，用空格分隔
+    for row in rows:
+        if all(value is None for value in row):
+            continue
+        row = tuple(row) + (None,) * (len(columns) - len(row))
+        phenotype_str = ' '.join(format_value(value) for value in row[1:len(columns)])
+        lines.append(f"{format_value(row[nr_col])} {phenotype_str}")
+    workbook.close()
+
+    # 个体数和性状数未指定时由表格得到
+    if nind is None:
+        nind = len(lines) - 1
+    if ntrt is None:
+        ntrt = len(columns) - 2
+
+    # 写入表头信息和数据
     with open(output_file, 'w') as file:
-        # 写入表头信息
         file.write(f"nind= {nind}\n")
         file.write(f"ntrt= {ntrt}\n")
         file.write(f"miss=   *\n")
-        
-        # 获取并组合表头（从第二列开始直到最后一列）
-        headers = df.columns[1:]  # 从第二列开始直到最后一列
-        header_str = 'NR ' + ' '.join(headers)
-        
-        # 写入列名到文件
-        file.write(header_str + '\n')
-        
-        # 遍历DataFrame的每一行
-        for index, row in df.iterrows():
-            # 获取样品ID
-            sample_id = row['NR']
-            
-            # 获取所有表型数据列（从第二列开始）
-            phenotype_data = row.iloc[1:]  # 从第二列开始直到最后一列
-            
-            # 将所有表型数据组合成一个字符串，用空格分隔
-            phenotype_str = ' '.join(map(str, phenotype_data.values))
-            
-            # 组合.qua文件的一行内容
-            qua_line = f"{sample_id} {phenotype_str}\n"
-            
-            # 写入文件
-            file.write(qua_line)
+        bins_to_joinmap.write_lines(file, lines)
 
     print(f"转换完成，生成的.qua文件已保存为{output_file}")
 
 # 使用方式：process_excel_to_qua('input.xlsx', 'output.qua', 100, 10)
 if __name__ == "__main__":
-    if len(sys.argv) != 5:
-        print("Usage: python script.py <input_file.xlsx> <output_file.qua> <nind> <ntrt>")
-    else:
-        input_file = sys.argv[1]
-        output_file = sys.argv[2]
-        nind = int(sys.argv[3])
-        ntrt = int(sys.argv[4])
-        process_excel_to_qua(input_file, output_file, nind, ntrt)
-
+    parser = argparse.ArgumentParser(description="Convert a phenotype workbook (SampleID, NR, traits...) to a MapQTL .qua file.")
+    parser.add_argument('input_file', help="Input workbook (.xlsx).")
+    parser.add_argument('output_file', help="Output .qua file.")
+    parser.add_argument('nind', type=int, nargs='?', help="Number of individuals (default: number of data rows).")
+    parser.add_argument('ntrt', type=int, nargs='?', help="Number of traits (default: number of columns after NR).")
+    args = parser.parse_args()
+    process_excel_to_qua(args.input_file, args.output_file, args.nind, args.ntrt)